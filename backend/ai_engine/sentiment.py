@@ -106,18 +106,20 @@ def classify_feedback(feedback_text):
     }
 
 
-def analyze_testimonial_quality(testimonial_text):
+def analyze_testimonial_quality(testimonial_text, sentiment=None):
     """
     Analyze quality of a testimonial.
     
     Args:
         testimonial_text: Testimonial message
+        sentiment: Result of analyze_sentiment() for the text, if already computed
     
     Returns:
         Quality score and suggestions
     """
     
-    sentiment = analyze_sentiment(testimonial_text)
+    if sentiment is None:
+        sentiment = analyze_sentiment(testimonial_text)
     blob = TextBlob(testimonial_text)
     
     # Quality metrics
@@ -20,9 +20,9 @@ from .predictions import (
     campaign_success_predictor
 )
 
-from donations.models import Donation
+from donations.models import DonorStats
 from campaigns.models import Campaign
-from django.db.models import Sum, Count, Avg
+from django.db.models import Count, Avg
 from datetime import datetime, timedelta
 from django.utils import timezone
 
@@ -128,6 +128,20 @@ def analyze_testimonial(request):
     return Response(result)
 
 
+def _retention_features(donor, stats):
+    """Retention predictor inputs for ``donor`` from their DonorStats row."""
+    return {
+        'total_donations': stats.donation_count,
+        'total_amount': float(stats.total_amount),
+        'avg_donation': float(stats.average_amount),
+        'days_since_last_donation': stats.days_since_last_donation,
+        'campaigns_supported': stats.campaigns_supported,
+        'account_age_days': (timezone.now() - donor.date_joined).days,
+        'has_profile_picture': bool(donor.profile_picture),
+        'bio': donor.bio or ''
+    }
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def predict_donor_retention(request):
@@ -135,36 +149,17 @@ def predict_donor_retention(request):
     
     user = request.user
     
-    # Get donor statistics
-    donations = Donation.objects.filter(donor=user, status='completed')
+    # Per-donor aggregates are maintained in DonorStats, so this is one row fetch
+    stats = DonorStats.objects.filter(donor=user).first()
     
-    if not donations.exists():
+    if stats is None or not stats.donation_count:
         return Response({
             'retention_probability': 0.5,
             'message': 'Not enough data for accurate prediction',
             'recommendation': 'Make your first donation to start building your impact profile!'
         })
     
-    total_donations = donations.count()
-    total_amount = donations.aggregate(total=Sum('amount'))['total'] or 0
-    avg_donation = total_amount / total_donations if total_donations > 0 else 0
-    
-    last_donation = donations.order_by('-completed_at').first()
-    days_since_last = (timezone.now() - last_donation.completed_at).days if last_donation else 365
-    
-    campaigns_supported = donations.values('campaign').distinct().count()
-    account_age = (timezone.now() - user.created_at).days
-    
-    donor_data = {
-        'total_donations': total_donations,
-        'total_amount': float(total_amount),
-        'avg_donation': float(avg_donation),
-        'days_since_last_donation': days_since_last,
-        'campaigns_supported': campaigns_supported,
-        'account_age_days': account_age,
-        'has_profile_picture': bool(user.profile_picture),
-        'bio': user.bio or ''
-    }
+    donor_data = _retention_features(user, stats)
     
     probability = donor_retention_predictor.predict(donor_data)
     
@@ -197,9 +192,9 @@ def predict_campaign_success(request, campaign_id):
     
     # Calculate campaign statistics
     days_remaining = (campaign.deadline - timezone.now().date()).days
-    donor_count = campaign.donations.filter(status='completed').count()
-    update_count = campaign.updates.count()
-    testimonial_count = campaign.testimonials.filter(is_approved=True).count()
+    donor_count = campaign.donation_count
+    update_count = campaign.update_count
+    testimonial_count = campaign.testimonial_count
     
     campaign_data = {
         'goal': float(campaign.goal),
@@ -243,39 +238,16 @@ def get_likely_donors(request):
             'error': 'Admin access required'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    # Get all donors with their statistics
-    from users.models import User
-    
-    donors = User.objects.filter(role='alumni', donations__isnull=False).distinct()
+    donor_stats = DonorStats.objects.filter(
+        donor__role='alumni',
+        donation_count__gt=0
+    ).select_related('donor')
     
     likely_donors = []
     
-    for donor in donors:
-        donations = Donation.objects.filter(donor=donor, status='completed')
-        
-        if not donations.exists():
-            continue
-        
-        total_donations = donations.count()
-        total_amount = donations.aggregate(total=Sum('amount'))['total'] or 0
-        avg_donation = total_amount / total_donations if total_donations > 0 else 0
-        
-        last_donation = donations.order_by('-completed_at').first()
-        days_since_last = (timezone.now() - last_donation.completed_at).days if last_donation else 365
-        
-        campaigns_supported = donations.values('campaign').distinct().count()
-        account_age = (timezone.now() - donor.created_at).days
-        
-        donor_data = {
-            'total_donations': total_donations,
-            'total_amount': float(total_amount),
-            'avg_donation': float(avg_donation),
-            'days_since_last_donation': days_since_last,
-            'campaigns_supported': campaigns_supported,
-            'account_age_days': account_age,
-            'has_profile_picture': bool(donor.profile_picture),
-            'bio': donor.bio or ''
-        }
+    for stats in donor_stats.iterator():
+        donor = stats.donor
+        donor_data = _retention_features(donor, stats)
         
         probability = donor_retention_predictor.predict(donor_data)
         
@@ -285,9 +257,9 @@ def get_likely_donors(request):
                 'donor_name': donor.name,
                 'donor_email': donor.email,
                 'retention_probability': probability,
-                'total_donations': total_donations,
-                'total_amount': float(total_amount),
-                'days_since_last_donation': days_since_last
+                'total_donations': donor_data['total_donations'],
+                'total_amount': donor_data['total_amount'],
+                'days_since_last_donation': donor_data['days_since_last_donation']
             })
     
     # Sort by probability
@@ -0,0 +1,53 @@
+"""
+Admin configuration for Analytics app.
+"""
+from django.contrib import admin
+from .models import DonationRollup, ExportJob, DashboardSnapshot, DonationSketch, DonorSketch
+
+
+@admin.register(DonationRollup)
+class DonationRollupAdmin(admin.ModelAdmin):
+    """Donation rollup admin."""
+    
+    list_display = ('day', 'campaign', 'category', 'donor_segment', 'total_amount', 'donation_count')
+    list_filter = ('category', 'donor_segment', 'day')
+    date_hierarchy = 'day'
+    readonly_fields = ('day', 'campaign', 'category', 'donor_segment', 'total_amount',
+                       'donation_count', 'min_amount', 'max_amount')
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    """Export job admin."""
+    
+    list_display = ('id', 'report_type', 'export_format', 'status', 'rows_written', 'requested_by', 'created_at')
+    list_filter = ('status', 'report_type', 'export_format')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+    # Export files have no public URL; they are downloaded through the API
+    exclude = ('file',)
+
+
+@admin.register(DashboardSnapshot)
+class DashboardSnapshotAdmin(admin.ModelAdmin):
+    """Dashboard snapshot admin."""
+    
+    list_display = ('scope', 'user', 'is_stale', 'as_of')
+    list_filter = ('is_stale',)
+    search_fields = ('scope', 'user__email')
+    readonly_fields = ('as_of',)
+
+
+@admin.register(DonationSketch)
+class DonationSketchAdmin(admin.ModelAdmin):
+    """Donation sketch admin."""
+    
+    list_display = ('day', 'campaign')
+    list_filter = ('day',)
+    date_hierarchy = 'day'
+
+
+@admin.register(DonorSketch)
+class DonorSketchAdmin(admin.ModelAdmin):
+    """Monthly donor sketch admin."""
+    
+    list_display = ('month',)
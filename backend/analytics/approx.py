@@ -0,0 +1,262 @@
+"""
+Approximate analytics backed by daily DonationSketch rows.
+
+Each completed donation is added to its (day, campaign) sketch: a
+HyperLogLog of donor ids and a t-digest of amounts. Donors are also added
+to a monthly HyperLogLog across all campaigns (DonorSketch), which
+all-time donor estimates merge. Live donations reach the sketches through
+the rollup queue (rollups.fold_pending). Range queries merge the daily
+sketches instead of scanning the donations table.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from donations.models import Donation
+from .models import DonationSketch, DonorSketch
+from .sketches import HyperLogLog, TDigest
+
+PERCENTILES = (0.5, 0.75, 0.9, 0.95, 0.99)
+
+# Daily HyperLogLog registers merged per numpy reduction (4 KB each at the default precision)
+MERGE_CHUNK_SIZE = 1024
+
+
+def is_approx(request):
+    """Whether the request opted into approximate answers with ?approx=1."""
+    return request.GET.get('approx') in ('1', 'true')
+
+
+def _merge_into_sketch(day, campaign_id, donors, amounts):
+    """Merge in-memory sketches into the stored sketch for (day, campaign)."""
+    
+    with transaction.atomic():
+        sketch, _ = DonationSketch.objects.select_for_update().get_or_create(
+            day=day,
+            campaign_id=campaign_id,
+            defaults={'donors_hll': HyperLogLog().to_bytes(), 'amounts_digest': TDigest().to_dict()}
+        )
+        
+        sketch.donors_hll = HyperLogLog.from_bytes(sketch.donors_hll).merge(donors).to_bytes()
+        sketch.amounts_digest = TDigest.from_dict(sketch.amounts_digest).merge(amounts).to_dict()
+        sketch.save(update_fields=['donors_hll', 'amounts_digest'])
+
+
+def _merge_into_donor_sketch(month, donors):
+    """Merge an in-memory HyperLogLog into the stored donor sketch for ``month``."""
+    
+    with transaction.atomic():
+        sketch, _ = DonorSketch.objects.select_for_update().get_or_create(
+            month=month, defaults={'donors_hll': HyperLogLog().to_bytes()}
+        )
+        sketch.donors_hll = HyperLogLog.from_bytes(sketch.donors_hll).merge(donors).to_bytes()
+        sketch.save(update_fields=['donors_hll'])
+
+
+def record_donations(donations):
+    """Add completed donations to their daily campaign sketches, one write per sketch."""
+    
+    record_values(
+        (timezone.localdate(donation.completed_at), donation.campaign_id, donation.donor_id, donation.amount)
+        for donation in donations
+    )
+
+
+def record_values(rows):
+    """
+    Add (day, campaign_id, donor_id, amount) rows to their daily campaign
+    sketches and monthly donor sketches, one write per sketch.
+    """
+    
+    buckets = {}
+    months = {}
+    for day, campaign_id, donor_id, amount in rows:
+        key = (day, campaign_id)
+        if key not in buckets:
+            buckets[key] = (HyperLogLog(), TDigest())
+        buckets[key][0].add(donor_id)
+        buckets[key][1].add(amount)
+        months.setdefault(period_start(day, 'month'), HyperLogLog()).add(donor_id)
+    
+    for (day, campaign_id), (donors, amounts) in sorted(buckets.items()):
+        _merge_into_sketch(day, campaign_id, donors, amounts)
+    for month, donors in sorted(months.items()):
+        _merge_into_donor_sketch(month, donors)
+
+
+def merged_sketches(start_date=None, end_date=None, **filters):
+    """
+    Merge daily sketches over a date range.
+    
+    Returns:
+        (HyperLogLog of donors, TDigest of amounts)
+    """
+    
+    sketches = DonationSketch.objects.filter(**filters)
+    if start_date:
+        sketches = sketches.filter(day__gte=start_date)
+    if end_date:
+        sketches = sketches.filter(day__lte=end_date)
+    
+    donors = HyperLogLog()
+    amounts = TDigest()
+    registers = []
+    for donors_hll, amounts_digest in sketches.values_list('donors_hll', 'amounts_digest').iterator():
+        registers.append(donors_hll)
+        if len(registers) >= MERGE_CHUNK_SIZE:
+            donors.merge_registers(registers)
+            registers = []
+        amounts.merge(TDigest.from_dict(amounts_digest))
+    donors.merge_registers(registers)
+    
+    return donors, amounts
+
+
+def merged_donors():
+    """
+    HyperLogLog of every donor, merged from the monthly donor sketches.
+    
+    Reads one row per month rather than the daily campaign sketches.
+    """
+    
+    donors = HyperLogLog()
+    donors.merge_registers(DonorSketch.objects.values_list('donors_hll', flat=True))
+    return donors
+
+
+def period_start(day, period):
+    """First day of the day/week/month/year period containing ``day``."""
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day.replace(day=1)
+
+
+def sketch_series(start_date, end_date, period='month', **filters):
+    """
+    Merge daily sketches per period.
+    
+    Returns:
+        Dictionary mapping period start dates to (HyperLogLog, TDigest)
+    """
+    
+    sketches = DonationSketch.objects.filter(day__gte=start_date, day__lte=end_date, **filters)
+    
+    series = {}
+    registers = {}
+    for day, donors_hll, amounts_digest in sketches.values_list('day', 'donors_hll', 'amounts_digest').iterator():
+        key = period_start(day, period)
+        if key not in series:
+            series[key] = (HyperLogLog(), TDigest())
+            registers[key] = []
+        registers[key].append(donors_hll)
+        if len(registers[key]) >= MERGE_CHUNK_SIZE:
+            series[key][0].merge_registers(registers[key])
+            registers[key] = []
+        series[key][1].merge(TDigest.from_dict(amounts_digest))
+    
+    for key, pending in registers.items():
+        series[key][0].merge_registers(pending)
+    
+    return series
+
+
+def distinct_estimate(hll):
+    """Distinct count estimate with a ~95% (two standard error) interval."""
+    
+    estimate = hll.count()
+    margin = 2 * hll.relative_error * estimate
+    
+    return {
+        'estimate': round(estimate),
+        'relative_error': hll.relative_error,
+        'lower': max(round(estimate - margin), 0),
+        'upper': round(estimate + margin),
+    }
+
+
+def percentile_estimates(digest, percentiles=PERCENTILES):
+    """Quantile estimates with their approximate rank error."""
+    
+    return {
+        f'p{round(q * 100)}': {
+            'value': digest.quantile(q),
+            'rank_error': digest.rank_error(q),
+        }
+        for q in percentiles
+    }
+
+
+def rebuild_sketches(batch_size=5000):
+    """
+    Recompute all daily sketches from completed donations.
+    
+    Returns:
+        Number of sketch rows written
+    """
+    
+    from .rollups import fold_pending
+    
+    # Queued donations are already in the table; apply them now so they
+    # are not counted twice later
+    fold_pending(batch_size)
+    
+    buckets = {}
+    donations = Donation.objects.filter(status='completed', completed_at__isnull=False).values_list(
+        'completed_at', 'campaign_id', 'donor_id', 'amount'
+    )
+    
+    for completed_at, campaign_id, donor_id, amount in donations.iterator(chunk_size=batch_size):
+        key = (timezone.localdate(completed_at), campaign_id)
+        if key not in buckets:
+            buckets[key] = (HyperLogLog(), TDigest())
+        buckets[key][0].add(donor_id)
+        buckets[key][1].add(amount)
+    
+    with transaction.atomic():
+        # Sketches of archived campaigns are kept: their donations are no longer in the table
+        DonationSketch.objects.filter(campaign__archived_at__isnull=True).delete()
+        DonationSketch.objects.bulk_create(
+            (
+                DonationSketch(
+                    day=day,
+                    campaign_id=campaign_id,
+                    donors_hll=donors.to_bytes(),
+                    amounts_digest=amounts.to_dict()
+                )
+                for (day, campaign_id), (donors, amounts) in buckets.items()
+            ),
+            batch_size=500
+        )
+        _rebuild_donor_sketches()
+    
+    return len(buckets)
+
+
+def _rebuild_donor_sketches():
+    """Recompute the monthly donor sketches from the daily sketches, archived campaigns included."""
+    
+    months = {}
+    registers = {}
+    sketches = DonationSketch.objects.order_by().values_list('day', 'donors_hll')
+    for day, donors_hll in sketches.iterator():
+        month = period_start(day, 'month')
+        if month not in months:
+            months[month] = HyperLogLog()
+            registers[month] = []
+        registers[month].append(donors_hll)
+        if len(registers[month]) >= MERGE_CHUNK_SIZE:
+            months[month].merge_registers(registers[month])
+            registers[month] = []
+    
+    for month, pending in registers.items():
+        months[month].merge_registers(pending)
+    
+    DonorSketch.objects.all().delete()
+    DonorSketch.objects.bulk_create(
+        DonorSketch(month=month, donors_hll=donors.to_bytes()) for month, donors in months.items()
+    )
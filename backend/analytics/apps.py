@@ -5,3 +5,6 @@ class AnalyticsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'analytics'
     verbose_name = 'Analytics & Reporting'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
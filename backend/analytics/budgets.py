@@ -0,0 +1,105 @@
+"""
+Per-view query time budgets for analytics endpoints.
+
+Each budgeted view runs in a transaction with a database-enforced
+statement timeout, so a slow aggregate is cancelled by the server instead
+of holding a pooled connection. Successful responses are remembered; when
+the budget is exceeded the last good response is served marked stale, or
+a 503 with a retry hint if there is none.
+"""
+import functools
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction, OperationalError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+# PostgreSQL SQLSTATE for a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+LAST_GOOD_TIMEOUT = 86400
+
+
+def _is_timeout(exc):
+    cause = exc.__cause__
+    code = getattr(cause, 'pgcode', None) or getattr(cause, 'sqlstate', None)
+    return code == QUERY_CANCELED or 'interrupted' in str(exc)
+
+
+def _run_with_timeout(seconds, func, *args, **kwargs):
+    """Call ``func`` with every statement it issues limited to ``seconds``."""
+    
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s', [int(seconds * 1000)])
+            return func(*args, **kwargs)
+        
+        if connection.vendor == 'sqlite':
+            # SQLite has no statement timeout; abort from the VM progress callback instead
+            deadline = time.monotonic() + seconds
+            connection.ensure_connection()
+            connection.connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                connection.connection.set_progress_handler(None, 0)
+        
+        return func(*args, **kwargs)
+
+
+def query_budget(seconds=None):
+    """
+    Enforce a statement timeout on a DRF function view.
+    
+    Apply below ``@api_view`` so the wrapped function receives the DRF
+    request. Only successful GET responses are kept as fallbacks; they are
+    keyed by user and full path, so alumni never see another user's data.
+    """
+    
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            budget = seconds or settings.ANALYTICS_STATEMENT_TIMEOUT
+            key = f'analytics:last_good:{request.user.pk}:{request.get_full_path()}'
+            
+            try:
+                response = _run_with_timeout(budget, view, request, *args, **kwargs)
+            except OperationalError as exc:
+                if not _is_timeout(exc):
+                    raise
+                return _degraded_response(key)
+            
+            if request.method == 'GET' and response.status_code == status.HTTP_200_OK:
+                cache.set(key, (response.data, timezone.now()), LAST_GOOD_TIMEOUT)
+            return response
+        
+        return wrapper
+    
+    return decorator
+
+
+def _degraded_response(key):
+    """Serve the last good response marked stale, or a 503 asking the client to retry."""
+    
+    retry_after = settings.ANALYTICS_RETRY_AFTER
+    cached = cache.get(key)
+    
+    if cached is None:
+        response = Response({
+            'error': 'Analytics are temporarily unavailable, please retry shortly',
+            'retry_after': retry_after
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    else:
+        data, as_of = cached
+        if isinstance(data, dict):
+            data = {**data, 'is_stale': True, 'as_of': as_of}
+        response = Response(data)
+        response['X-Data-Stale'] = 'true'
+        response['X-Data-As-Of'] = as_of.isoformat()
+    
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,203 @@
+"""
+Alumni cohort analytics by graduation year and department.
+
+Donations are loaded once as donor-year rows and every cohort metric is
+computed with grouped pandas operations over that frame. Results are
+cached per period; closed periods are cached longer than the current one.
+"""
+from datetime import date, datetime, time, timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, Count
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from users.models import User
+from donations import archive
+from donations.models import Donation
+
+GROUPINGS = {
+    'graduation_year': ['graduation_year'],
+    'department': ['department'],
+    'both': ['graduation_year', 'department'],
+}
+
+OPEN_PERIOD_TIMEOUT = 600
+CLOSED_PERIOD_TIMEOUT = 86400
+
+
+def _donor_years(start_year, end_year):
+    """One row per donor and calendar year with that year's giving."""
+    
+    rows = Donation.objects.completed_between(date(start_year, 1, 1), date(end_year + 1, 1, 1)).filter(
+        status='completed',
+        donor__role='alumni'
+    ).annotate(
+        year=ExtractYear('completed_at')
+    ).values(
+        'donor_id', 'donor__graduation_year', 'donor__department', 'year'
+    ).annotate(
+        total=Sum('amount'),
+        count=Count('id')
+    ).order_by()
+    
+    frame = pd.DataFrame.from_records(
+        rows.values_list('donor_id', 'donor__graduation_year', 'donor__department', 'year', 'total', 'count'),
+        columns=['donor_id', 'graduation_year', 'department', 'year', 'total', 'count']
+    )
+    frame['total'] = frame['total'].astype(float)
+    
+    archived = _archived_donor_years(start_year, end_year)
+    if archived.empty:
+        return frame
+    return pd.concat([frame, archived]).groupby(
+        ['donor_id', 'graduation_year', 'department', 'year'], dropna=False, as_index=False
+    )[['total', 'count']].sum()
+
+
+def _archived_donor_years(start_year, end_year):
+    """The same rows as ``_donor_years`` for archived donations."""
+    
+    start = timezone.make_aware(datetime.combine(date(start_year, 1, 1), time.min))
+    end = timezone.make_aware(datetime.combine(date(end_year + 1, 1, 1), time.min))
+    donations = archive.read(
+        ['donor_id', 'amount', 'completed_at'],
+        status='completed',
+        start=start - timedelta(days=settings.DONATION_SETTLEMENT_DAYS),
+        end=end
+    ).to_pandas()
+    
+    completed_at = donations['completed_at']
+    donations = donations[(completed_at >= start) & (completed_at < end)]
+    if donations.empty:
+        return pd.DataFrame()
+    
+    donations = donations.assign(
+        year=donations['completed_at'].dt.tz_convert(timezone.get_current_timezone_name()).dt.year,
+        total=donations['amount'].astype(float)
+    )
+    frame = donations.groupby(['donor_id', 'year'], as_index=False).agg(
+        total=('total', 'sum'),
+        count=('total', 'size')
+    )
+    alumni = pd.DataFrame.from_records(
+        User.objects.filter(role='alumni', id__in=frame['donor_id'].unique().tolist()).values_list(
+            'id', 'graduation_year', 'department'
+        ),
+        columns=['donor_id', 'graduation_year', 'department']
+    )
+    return frame.merge(alumni, on='donor_id')
+
+
+def _alumni_counts(keys):
+    rows = User.objects.filter(role='alumni').values(*keys).annotate(alumni_count=Count('id')).order_by()
+    return pd.DataFrame.from_records(list(rows), columns=keys + ['alumni_count'])
+
+
+def compute_cohorts(start_year, end_year, group_by='both'):
+    """
+    Compute cohort metrics for calendar years ``start_year``..``end_year``.
+    
+    Returns:
+        List of cohort dictionaries with yearly series and retention curve
+    """
+    
+    keys = GROUPINGS[group_by]
+    donor_years = _donor_years(start_year, end_year)
+    alumni = _alumni_counts(keys).set_index(keys)['alumni_count']
+    
+    if donor_years.empty:
+        return []
+    
+    # Yearly giving per cohort
+    yearly = donor_years.groupby(keys + ['year']).agg(
+        donors=('donor_id', 'nunique'),
+        total=('total', 'sum'),
+        count=('count', 'sum')
+    ).reset_index()
+    yearly['average_gift'] = yearly['total'] / yearly['count']
+    yearly['yoy_growth'] = yearly.sort_values('year').groupby(keys)['total'].pct_change()
+    yearly = yearly.join(alumni, on=keys)
+    yearly['participation_rate'] = yearly['donors'] / yearly['alumni_count']
+    
+    # Whole-period totals per cohort
+    overall = donor_years.groupby(keys).agg(
+        donor_count=('donor_id', 'nunique'),
+        total_donated=('total', 'sum'),
+        donation_count=('count', 'sum')
+    ).join(alumni)
+    overall['average_gift'] = overall['total_donated'] / overall['donation_count']
+    overall['participation_rate'] = overall['donor_count'] / overall['alumni_count']
+    
+    # Retention: share of each cohort's donors still giving N years after their first gift
+    first_year = donor_years.groupby('donor_id')['year'].transform('min')
+    donor_years = donor_years.assign(offset=donor_years['year'] - first_year)
+    retained = donor_years.groupby(keys + ['offset'])['donor_id'].nunique()
+    
+    starters = donor_years[donor_years['offset'] == 0]
+    starters = starters.assign(horizon=end_year - starters['year'])
+    eligible = pd.concat(
+        [
+            starters[starters['horizon'] >= offset].groupby(keys)['donor_id'].nunique().rename(offset)
+            for offset in range(end_year - start_year + 1)
+        ],
+        axis=1
+    ).stack().dropna()
+    eligible.index = eligible.index.set_names(keys + ['offset'])
+    retention = retained.reindex(eligible.index, fill_value=0) / eligible
+    
+    cohorts = []
+    for cohort_key, row in overall.iterrows():
+        cohort_key = cohort_key if isinstance(cohort_key, tuple) else (cohort_key,)
+        labels = dict(zip(keys, cohort_key))
+        mask = (yearly[keys] == pd.Series(labels)).all(axis=1)
+        curve = retention.xs(cohort_key, level=keys)
+        
+        cohorts.append({
+            **labels,
+            'alumni_count': _int(row['alumni_count']),
+            'donor_count': int(row['donor_count']),
+            'participation_rate': _float(row['participation_rate']),
+            'total_donated': float(row['total_donated']),
+            'donation_count': int(row['donation_count']),
+            'average_gift': float(row['average_gift']),
+            'yearly': [
+                {
+                    'year': int(item['year']),
+                    'donors': int(item['donors']),
+                    'participation_rate': _float(item['participation_rate']),
+                    'total_donated': float(item['total']),
+                    'average_gift': float(item['average_gift']),
+                    'yoy_growth': _float(item['yoy_growth']),
+                }
+                for _, item in yearly[mask].sort_values('year').iterrows()
+            ],
+            'retention': [float(value) for _, value in curve.sort_index().items()],
+        })
+    
+    cohorts.sort(key=lambda cohort: cohort['total_donated'], reverse=True)
+    return cohorts
+
+
+def _float(value):
+    return None if pd.isna(value) else float(value)
+
+
+def _int(value):
+    return None if pd.isna(value) else int(value)
+
+
+def get_cohorts(start_year, end_year, group_by='both'):
+    """Return cached cohort metrics for the period, computing them on a miss."""
+    
+    key = f'analytics:cohorts:{group_by}:{start_year}:{end_year}'
+    cohorts = cache.get(key)
+    
+    if cohorts is None:
+        cohorts = compute_cohorts(start_year, end_year, group_by)
+        is_open = end_year >= timezone.localdate().year
+        cache.set(key, cohorts, OPEN_PERIOD_TIMEOUT if is_open else CLOSED_PERIOD_TIMEOUT)
+    
+    return cohorts
@@ -0,0 +1,167 @@
+"""
+Dashboard statistics snapshots.
+
+The dashboard aggregates are computed off the request path and stored in
+DashboardSnapshot rows. Committed writes mark the affected snapshots
+stale and queue a refresh; the view serves whatever snapshot is stored together
+with its ``as_of`` timestamp. Each refresh publishes the changed figures
+to live dashboard streams.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum, Count, Q
+from django.utils import timezone
+
+from users.models import User
+from campaigns.models import Campaign
+from donations.models import ArchivedDonationTotal, Donation
+from .models import DashboardSnapshot
+from . import live
+
+# Bursts of writes within this window trigger a single refresh per scope
+REFRESH_DEBOUNCE_SECONDS = 5
+
+
+def compute_dashboard(user=None):
+    """
+    Compute dashboard statistics.
+    
+    Args:
+        user: Alumni user for a personal dashboard, or None for the admin view
+    
+    Returns:
+        JSON-serializable dictionary
+    """
+    
+    # Admin sees all data, alumni see their own
+    if user is None:
+        donations = Donation.objects.filter(status='completed')
+        archived = ArchivedDonationTotal.objects.filter(donation_count__gt=0)
+        campaigns = Campaign.objects.all()
+        alumni = User.objects.filter(role='alumni')
+    else:
+        donations = Donation.objects.filter(donor=user, status='completed')
+        archived = ArchivedDonationTotal.objects.filter(donor=user, donation_count__gt=0)
+        campaigns = Campaign.objects.filter(created_by=user)
+        alumni = User.objects.filter(id=user.id)
+    
+    # Calculate statistics
+    thirty_days_ago = timezone.now() - timedelta(days=30)
+    total_donations = donations.aggregate(
+        total_amount=Sum('amount'),
+        count=Count('id')
+    )
+    # Donations of archived campaigns only remain as per-donor totals
+    archived_totals = archived.aggregate(amount=Sum('total_amount'), count=Sum('donation_count'))
+    total_donations['total_amount'] = (total_donations['total_amount'] or 0) + (archived_totals['amount'] or 0)
+    total_donations['count'] += archived_totals['count'] or 0
+    total_donations['active_donors'] = donations.values('donor').order_by().union(
+        archived.values('donor').order_by()
+    ).count()
+    # Bounded separately so the recent figures only read recent partitions
+    total_donations.update(donations.completed_between(thirty_days_ago).aggregate(
+        recent_amount=Sum('amount'),
+        recent_count=Count('id')
+    ))
+    
+    campaign_stats = campaigns.aggregate(
+        total_campaigns=Count('id'),
+        active_campaigns=Count('id', filter=Q(status='active')),
+        completed_campaigns=Count('id', filter=Q(status='completed')),
+        total_goal=Sum('goal'),
+        total_raised=Sum('raised')
+    )
+    
+    # Top campaign
+    top_campaign = campaigns.filter(status__in=['active', 'completed']).order_by('-raised').first()
+    
+    return {
+        'donations': {
+            'total_amount': float(total_donations['total_amount'] or 0),
+            'total_count': total_donations['count'],
+            'recent_amount': float(total_donations['recent_amount'] or 0),
+            'recent_count': total_donations['recent_count'],
+        },
+        'campaigns': {
+            'total': campaign_stats['total_campaigns'],
+            'active': campaign_stats['active_campaigns'],
+            'completed': campaign_stats['completed_campaigns'],
+            'total_goal': float(campaign_stats['total_goal'] or 0),
+            'total_raised': float(campaign_stats['total_raised'] or 0),
+        },
+        'alumni': {
+            'total_count': alumni.count(),
+            'active_donors': total_donations['active_donors']
+        },
+        'top_campaign': {
+            'id': top_campaign.id,
+            'title': top_campaign.title,
+            'raised': float(top_campaign.raised)
+        } if top_campaign else None
+    }
+
+
+def refresh_snapshot(scope):
+    """Recompute and store the snapshot for ``scope``."""
+    
+    if scope == DashboardSnapshot.GLOBAL_SCOPE:
+        user = None
+    else:
+        user = User.objects.filter(id=int(scope.split(':', 1)[1])).first()
+        # Admins are served the global snapshot
+        if user is None or user.role == 'admin':
+            DashboardSnapshot.objects.filter(scope=scope).delete()
+            return None
+    
+    previous = DashboardSnapshot.objects.filter(scope=scope).values_list('payload', flat=True).first()
+    snapshot, _ = DashboardSnapshot.objects.update_or_create(
+        scope=scope,
+        defaults={
+            'user': user,
+            'payload': compute_dashboard(user),
+            'is_stale': False,
+            'as_of': timezone.now(),
+        }
+    )
+    
+    delta = live.payload_delta(previous, snapshot.payload)
+    if delta:
+        live.publish(live.dashboard_channel(scope), 'dashboard.delta', {**delta, 'as_of': snapshot.as_of})
+    
+    return snapshot
+
+
+def get_snapshot(user):
+    """Return the stored snapshot for ``user``, computing it on first use."""
+    
+    scope = DashboardSnapshot.scope_for(user)
+    snapshot = DashboardSnapshot.objects.filter(scope=scope).first()
+    if snapshot is None:
+        snapshot = refresh_snapshot(scope)
+    return snapshot
+
+
+def mark_stale(*scopes):
+    """
+    Flag snapshots as stale and queue a debounced refresh for each.
+    
+    The flag is written after the caller's transaction commits, and only to
+    snapshots not already flagged, so donation transactions never hold a
+    lock on the shared global snapshot row.
+    """
+    
+    from .tasks import refresh_dashboard_snapshot
+    
+    transaction.on_commit(
+        lambda: DashboardSnapshot.objects.filter(scope__in=scopes, is_stale=False).update(is_stale=True)
+    )
+    
+    for scope in scopes:
+        if cache.add(f'dashboard:refresh:{scope}', True, REFRESH_DEBOUNCE_SECONDS):
+            transaction.on_commit(
+                lambda scope=scope: refresh_dashboard_snapshot.apply_async(
+                    args=[scope], countdown=REFRESH_DEBOUNCE_SECONDS
+                )
+            )
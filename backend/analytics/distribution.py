@@ -0,0 +1,104 @@
+"""
+Exact distribution of donation amounts, computed by the database.
+
+Counts, bounds, percentiles and histogram buckets are all aggregated in
+SQL, so only a few rows reach Python however many donations match.
+PostgreSQL computes every percentile in the same pass with
+percentile_cont; other databases read the two ranks either side of each
+percentile. Both interpolate linearly between ranks, like numpy.quantile.
+"""
+import math
+
+from django.db import connection
+from django.db.models import Aggregate, Count, FloatField, Max, Min, Value
+from django.db.models.functions import Cast, Floor, Least
+
+from .approx import PERCENTILES
+
+
+class PercentileCont(Aggregate):
+    """PostgreSQL's percentile_cont ordered-set aggregate."""
+    
+    function = 'percentile_cont'
+    template = '%(function)s(%(fraction)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+    
+    def __init__(self, expression, fraction, **extra):
+        super().__init__(expression, fraction=float(fraction), **extra)
+
+
+def _key(q):
+    return f'p{round(q * 100)}'
+
+
+def _ranked_percentiles(donations, count):
+    """Percentiles from the amounts at the ranks around each one."""
+    
+    amounts = donations.order_by('amount').values_list('amount', flat=True)
+    percentiles = {}
+    for q in PERCENTILES:
+        position = q * (count - 1)
+        lower = float(amounts[math.floor(position)])
+        upper = float(amounts[math.ceil(position)]) if position % 1 else lower
+        percentiles[_key(q)] = lower + (upper - lower) * (position % 1)
+    return percentiles
+
+
+def _histogram(donations, low, high, bins):
+    """``bins`` equal-width buckets between ``low`` and ``high``; the last one includes ``high``."""
+    
+    if low == high:
+        # A single value gets a unit-wide range, as in numpy.histogram
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / bins
+    
+    bucket = Least(
+        Floor((Cast('amount', FloatField()) - Value(low)) / Value(width)),
+        Value(bins - 1),
+        output_field=FloatField()
+    )
+    counts = {
+        int(row['bucket']): row['count']
+        for row in donations.annotate(bucket=bucket).values('bucket').annotate(count=Count('id')).order_by()
+    }
+    return [
+        {'lower': low + width * i, 'upper': low + width * (i + 1), 'count': counts.get(i, 0)}
+        for i in range(bins)
+    ]
+
+
+def distribution(donations, bins):
+    """
+    Count, distinct donors, percentiles and histogram of the amounts of ``donations``.
+    
+    Returns:
+        Dict with donation_count, distinct_donors, percentiles (value and
+        rank_error per percentile) and histogram
+    """
+    
+    aggregates = {}
+    if connection.vendor == 'postgresql':
+        aggregates = {_key(q): PercentileCont('amount', q) for q in PERCENTILES}
+    summary = donations.order_by().aggregate(
+        count=Count('id'),
+        donors=Count('donor', distinct=True),
+        low=Min('amount'),
+        high=Max('amount'),
+        **aggregates
+    )
+    
+    count = summary['count']
+    if not count:
+        return {'donation_count': 0, 'distinct_donors': 0, 'percentiles': {}, 'histogram': []}
+    
+    if aggregates:
+        percentiles = {key: summary[key] for key in aggregates}
+    else:
+        percentiles = _ranked_percentiles(donations, count)
+    
+    return {
+        'donation_count': count,
+        'distinct_donors': summary['donors'],
+        'percentiles': {key: {'value': float(value), 'rank_error': 0} for key, value in percentiles.items()},
+        'histogram': _histogram(donations, float(summary['low']), float(summary['high']), bins),
+    }
@@ -0,0 +1,212 @@
+"""
+Set-based donor analytics with RFM segmentation.
+
+Per-donor aggregates are read from DonorStats in a single pass and scored
+with vectorized numpy operations. The resulting frame is cached briefly
+so paging through the donor list does not repeat the grouped pass.
+"""
+import base64
+import json
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from donations.models import DonorStats
+
+CACHE_KEY = 'analytics:donor_frame'
+CACHE_TIMEOUT = 300
+
+ACTIVE_DAYS = 90
+REGULAR_MIN_DONATIONS = 3
+HIGH_VALUE_MIN_TOTAL = 10000
+
+ORDERING_FIELDS = ('total_donated', 'donation_count', 'days_since_last_donation', 'rfm_score')
+SEGMENTS = ('active', 'regular', 'high_value')
+MAX_PAGE_SIZE = 500
+
+
+def _quintile_scores(values):
+    """Score each value 1-5 by its percentile rank (ties share a score)."""
+    
+    if not len(values):
+        return np.zeros(0, dtype=np.int64)
+    
+    ranked = np.sort(values)
+    percentile = np.searchsorted(ranked, values, side='right') / len(values)
+    return np.clip(np.ceil(percentile * 5), 1, 5).astype(np.int64)
+
+
+def build_donor_frame():
+    """
+    Load per-donor aggregates and compute RFM scores in one pass.
+    
+    Returns:
+        Dictionary of equally sized numpy arrays keyed by column name
+    """
+    
+    rows = list(
+        DonorStats.objects.filter(
+            donation_count__gt=0,
+            donor__role='alumni'
+        ).values_list(
+            'donor_id', 'donor__name', 'total_amount', 'donation_count', 'last_donation_at', 'campaigns_supported'
+        )
+    )
+    
+    now = timezone.now()
+    donor_ids, names, totals, counts, lasts, campaigns = zip(*rows) if rows else ([],) * 6
+    
+    frame = {
+        'donor_id': np.array(donor_ids, dtype=np.int64),
+        'donor_name': np.array(names, dtype=object),
+        'total_donated': np.array([float(total) for total in totals], dtype=np.float64),
+        'donation_count': np.array(counts, dtype=np.int64),
+        'campaigns_supported': np.array(campaigns, dtype=np.int64),
+        'days_since_last_donation': np.array(
+            [(now - last).days if last else 365 for last in lasts], dtype=np.int64
+        ),
+    }
+    
+    frame['avg_donation'] = np.divide(
+        frame['total_donated'],
+        frame['donation_count'],
+        out=np.zeros(len(donor_ids)),
+        where=frame['donation_count'] > 0
+    )
+    
+    # Recency scores highest for the most recent donors
+    frame['recency_score'] = _quintile_scores(-frame['days_since_last_donation'])
+    frame['frequency_score'] = _quintile_scores(frame['donation_count'])
+    frame['monetary_score'] = _quintile_scores(frame['total_donated'])
+    frame['rfm_score'] = frame['recency_score'] + frame['frequency_score'] + frame['monetary_score']
+    
+    frame['is_active'] = frame['days_since_last_donation'] < ACTIVE_DAYS
+    frame['is_regular'] = frame['donation_count'] >= REGULAR_MIN_DONATIONS
+    frame['is_high_value'] = frame['total_donated'] > HIGH_VALUE_MIN_TOTAL
+    
+    return frame
+
+
+def get_donor_frame(refresh=False):
+    """Return the cached donor frame, rebuilding it when missing."""
+    
+    frame = None if refresh else cache.get(CACHE_KEY)
+    if frame is None:
+        frame = build_donor_frame()
+        cache.set(CACHE_KEY, frame, CACHE_TIMEOUT)
+    return frame
+
+
+def encode_cursor(value, donor_id):
+    payload = json.dumps([value, donor_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into (sort value, donor id); raises ValueError if invalid."""
+    
+    try:
+        value, donor_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(value), int(donor_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def _row(frame, index):
+    return {
+        'donor_id': int(frame['donor_id'][index]),
+        'donor_name': frame['donor_name'][index],
+        'total_donated': float(frame['total_donated'][index]),
+        'donation_count': int(frame['donation_count'][index]),
+        'avg_donation': float(frame['avg_donation'][index]),
+        'campaigns_supported': int(frame['campaigns_supported'][index]),
+        'days_since_last_donation': int(frame['days_since_last_donation'][index]),
+        'recency_score': int(frame['recency_score'][index]),
+        'frequency_score': int(frame['frequency_score'][index]),
+        'monetary_score': int(frame['monetary_score'][index]),
+        'rfm_score': int(frame['rfm_score'][index]),
+        'is_active': bool(frame['is_active'][index]),
+        'is_regular': bool(frame['is_regular'][index]),
+        'is_high_value': bool(frame['is_high_value'][index]),
+    }
+
+
+def segment_totals(frame):
+    """Count donors per segment."""
+    
+    return {
+        'total_donors': len(frame['donor_id']),
+        'active_donors': int(frame['is_active'].sum()),
+        'regular_donors': int(frame['is_regular'].sum()),
+        'high_value_donors': int(frame['is_high_value'].sum()),
+    }
+
+
+def donor_page(frame, ordering='-total_donated', segment=None, min_total=None,
+               max_total=None, search=None, cursor=None, limit=50):
+    """
+    Filter, sort and keyset-paginate the donor frame.
+    
+    Args:
+        frame: Donor frame from get_donor_frame()
+        ordering: One of ORDERING_FIELDS, optionally prefixed with '-'
+        segment: Restrict to one of SEGMENTS
+        min_total / max_total: Bounds on total_donated
+        search: Case-insensitive substring of the donor name
+        cursor: Opaque cursor returned as ``next_cursor`` by the previous page
+        limit: Page size, clamped to 1..MAX_PAGE_SIZE
+    
+    Returns:
+        Dictionary with ``results``, ``count`` and ``next_cursor``
+    """
+    
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    descending = ordering.startswith('-')
+    field = ordering.lstrip('-')
+    if field not in ORDERING_FIELDS:
+        raise ValueError(f'Invalid ordering: {ordering}')
+    
+    mask = np.ones(len(frame['donor_id']), dtype=bool)
+    if segment:
+        if segment not in SEGMENTS:
+            raise ValueError(f'Invalid segment: {segment}')
+        mask &= frame[f'is_{segment}']
+    if min_total is not None:
+        mask &= frame['total_donated'] >= min_total
+    if max_total is not None:
+        mask &= frame['total_donated'] <= max_total
+    if search:
+        needle = search.lower()
+        mask &= np.array([needle in name.lower() for name in frame['donor_name']], dtype=bool)
+    
+    indices = np.flatnonzero(mask)
+    values = frame[field][indices].astype(np.float64)
+    ids = frame['donor_id'][indices]
+    
+    # Sort on (value, donor_id) so the cursor position is unambiguous
+    sign = -1 if descending else 1
+    order = np.lexsort((sign * ids, sign * values))
+    indices, values, ids = indices[order], values[order], ids[order]
+    
+    start = 0
+    if cursor:
+        cursor_value, cursor_id = decode_cursor(cursor)
+        after = (sign * values > sign * cursor_value) | (
+            (values == cursor_value) & (sign * ids > sign * cursor_id)
+        )
+        start = int(np.argmax(after)) if after.any() else len(indices)
+    
+    page = indices[start:start + limit]
+    results = [_row(frame, index) for index in page]
+    
+    next_cursor = None
+    if results and start + limit < len(indices):
+        last = results[-1]
+        next_cursor = encode_cursor(last[field], last['donor_id'])
+    
+    return {
+        'count': len(indices),
+        'next_cursor': next_cursor,
+        'results': results,
+    }
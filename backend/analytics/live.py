@@ -0,0 +1,135 @@
+"""
+Live progress events pushed to clients over Server-Sent Events.
+
+Writers publish JSON events to Redis pub/sub channels and every ASGI
+worker relays them to its connected streams. Campaign progress is
+coalesced: the first donation in a window schedules one publish at the
+end of the window, and that publish reads the campaign row as it stands
+then, so a hot campaign emits at most one event per window.
+"""
+import json
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from campaigns.counters import pending_totals
+from campaigns.models import Campaign
+
+CHANNEL_PREFIX = 'nostos:live:'
+ALL_CAMPAIGNS = 'campaigns'
+
+_client = None
+
+
+def campaign_channel(campaign_id):
+    return f'campaign:{campaign_id}'
+
+
+def dashboard_channel(scope):
+    return f'dashboard:{scope}'
+
+
+def _redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.LIVE_UPDATES_REDIS_URL)
+    return _client
+
+
+def publish(channel, event, data):
+    """Publish an event to subscribers of ``channel``; delivery is best effort."""
+    
+    message = json.dumps({'event': event, 'data': data}, default=str)
+    try:
+        _redis().publish(CHANNEL_PREFIX + channel, message)
+    except redis.RedisError:
+        pass
+
+
+def campaign_progress(campaign_id):
+    """Current progress figures for one campaign, or None if it is gone."""
+    
+    campaign = Campaign.objects.filter(pk=campaign_id).values(
+        'id', 'raised', 'goal', 'donor_count', 'donation_count', 'status'
+    ).first()
+    if campaign is None:
+        return None
+    
+    # Unfolded donation shards are added on read; only the periodic task folds them
+    amount, donations, donors = pending_totals(campaign_id)
+    goal = float(campaign['goal'])
+    raised = float(campaign['raised'] + amount)
+    return {
+        'id': campaign['id'],
+        'raised': raised,
+        'goal': goal,
+        'progress_percentage': min(raised / goal * 100, 100) if goal > 0 else 0,
+        'donor_count': campaign['donor_count'] + donors,
+        'donation_count': campaign['donation_count'] + donations,
+        'status': campaign['status'],
+    }
+
+
+def publish_campaign(campaign_id):
+    """Publish a campaign's current progress to its channel and the all-campaigns channel."""
+    
+    progress = campaign_progress(campaign_id)
+    if progress is not None:
+        publish(campaign_channel(campaign_id), 'campaign.progress', progress)
+        publish(ALL_CAMPAIGNS, 'campaign.progress', progress)
+
+
+def schedule_campaign_push(campaign_id):
+    """Queue one progress event per coalescing window for ``campaign_id``."""
+    
+    from .tasks import publish_campaign_progress
+    
+    window = settings.LIVE_UPDATES_COALESCE_SECONDS
+    if cache.add(f'live:campaign:{campaign_id}', True, window):
+        transaction.on_commit(
+            lambda: publish_campaign_progress.apply_async(args=[campaign_id], countdown=window)
+        )
+
+
+def payload_delta(old, new):
+    """Keys of ``new`` whose values differ from ``old``, recursing into dictionaries."""
+    
+    delta = {}
+    for key, value in new.items():
+        previous = (old or {}).get(key)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = payload_delta(previous, value)
+            if nested:
+                delta[key] = nested
+        elif value != previous:
+            delta[key] = value
+    return delta
+
+
+async def subscribe(*channels, heartbeat=15):
+    """
+    Yield published events for ``channels`` as (event, data) pairs.
+    
+    Yields (None, None) after ``heartbeat`` idle seconds so callers can
+    keep the connection alive.
+    """
+    
+    client = aioredis.Redis.from_url(settings.LIVE_UPDATES_REDIS_URL)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(*(CHANNEL_PREFIX + channel for channel in channels))
+    
+    try:
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+            if message is None:
+                yield None, None
+                continue
+            payload = json.loads(message['data'])
+            yield payload['event'], payload['data']
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+        await client.aclose()
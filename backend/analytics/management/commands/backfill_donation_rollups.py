@@ -0,0 +1,17 @@
+"""
+Rebuild daily donation rollups from the donations table.
+"""
+from django.core.management.base import BaseCommand
+
+from analytics.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily donation rollup table from completed donations'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+    
+    def handle(self, *args, **options):
+        count = rebuild_rollups(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} rollup rows'))
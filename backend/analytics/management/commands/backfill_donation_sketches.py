@@ -0,0 +1,17 @@
+"""
+Rebuild daily HyperLogLog / t-digest sketches from the donations table.
+"""
+from django.core.management.base import BaseCommand
+
+from analytics.approx import rebuild_sketches
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily donation sketches used by ?approx=1 analytics'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+    
+    def handle(self, *args, **options):
+        count = rebuild_sketches(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} sketch rows'))
@@ -0,0 +1,200 @@
+"""
+Models for Analytics.
+"""
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+from users.models import User
+from campaigns.models import Campaign
+import uuid
+
+
+class DonationRollup(models.Model):
+    """Daily aggregate of completed donations per campaign and donor segment."""
+    
+    SEGMENT_CHOICES = (
+        ('first_time', 'First-time Donor'),
+        ('repeat', 'Repeat Donor'),
+    )
+    
+    day = models.DateField()
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='rollups')
+    category = models.CharField(max_length=50)
+    donor_segment = models.CharField(max_length=20, choices=SEGMENT_CHOICES)
+    
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    donation_count = models.PositiveIntegerField(default=0)
+    min_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    max_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        db_table = 'donation_rollups'
+        ordering = ['day']
+        unique_together = ['day', 'campaign', 'donor_segment']
+        indexes = [
+            models.Index(fields=['day', 'category']),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} - {self.campaign_id} ({self.donor_segment})"
+
+
+class PendingDonation(models.Model):
+    """
+    Completed or refunded donation queued for its daily rollup and sketch.
+    
+    The donation path only inserts rows; rollups.fold_pending applies and
+    deletes them, so concurrent donations never wait on a rollup row lock.
+    """
+    
+    day = models.DateField()
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='+')
+    category = models.CharField(max_length=50)
+    donor_segment = models.CharField(max_length=20, choices=DonationRollup.SEGMENT_CHOICES)
+    donor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    # Signed: refunds are negative
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        db_table = 'donation_rollup_queue'
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.day} - {self.campaign_id} ({self.amount})"
+
+
+class ExportStorage(FileSystemStorage):
+    """
+    Export files under EXPORT_ROOT. They hold donor names and emails, so
+    they have no public URL and are only served by export_job_download.
+    """
+    
+    @property
+    def base_location(self):
+        return settings.EXPORT_ROOT
+    
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+class ExportJob(models.Model):
+    """Background report export written to a file under EXPORT_ROOT."""
+    
+    REPORT_CHOICES = (
+        ('donations', 'Donations'),
+        ('campaigns', 'Campaigns'),
+        ('donors', 'Donors'),
+    )
+    
+    FORMAT_CHOICES = (
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+        ('parquet', 'Parquet'),
+    )
+    
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='export_jobs')
+    report_type = models.CharField(max_length=20, choices=REPORT_CHOICES)
+    export_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    filters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    
+    # Progress
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    rows_written = models.PositiveIntegerField(default=0)
+    file = models.FileField(storage=ExportStorage(), blank=True)
+    error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'export_jobs'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.report_type} export ({self.export_format}) - {self.status}"
+    
+    @property
+    def progress_percentage(self):
+        """Percentage of rows written so far."""
+        if self.status == 'completed':
+            return 100
+        if self.total_rows:
+            return min(self.rows_written / self.total_rows * 100, 100)
+        return 0
+
+
+class DashboardSnapshot(models.Model):
+    """Precomputed dashboard statistics for the admin view or one alumni user."""
+    
+    GLOBAL_SCOPE = 'global'
+    
+    scope = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='dashboard_snapshots')
+    payload = models.JSONField(default=dict)
+    is_stale = models.BooleanField(default=False)
+    as_of = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'dashboard_snapshots'
+        indexes = [
+            models.Index(fields=['is_stale']),
+        ]
+    
+    def __str__(self):
+        return f"Dashboard snapshot {self.scope} as of {self.as_of}"
+    
+    @classmethod
+    def scope_for(cls, user):
+        """Snapshot scope shown to ``user`` (all admins share the global one)."""
+        if user is None or user.role == 'admin':
+            return cls.GLOBAL_SCOPE
+        return f'user:{user.id}'
+
+
+class DonationSketch(models.Model):
+    """Daily mergeable sketches of completed donations for one campaign."""
+    
+    day = models.DateField()
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='sketches')
+    donors_hll = models.BinaryField()
+    amounts_digest = models.JSONField(default=dict)
+    
+    class Meta:
+        db_table = 'donation_sketches'
+        ordering = ['day']
+        unique_together = ['day', 'campaign']
+    
+    def __str__(self):
+        return f"{self.day} - {self.campaign_id}"
+
+
+class DonorSketch(models.Model):
+    """
+    Monthly HyperLogLog of donors across all campaigns.
+    
+    All-time donor estimates merge one row per month instead of every
+    daily campaign sketch.
+    """
+    
+    month = models.DateField(unique=True)
+    donors_hll = models.BinaryField()
+    
+    class Meta:
+        db_table = 'donor_sketches'
+        ordering = ['month']
+    
+    def __str__(self):
+        return f"Donors {self.month:%Y-%m}"
@@ -0,0 +1,30 @@
+"""
+Query parameter parsing shared by the analytics and donation views.
+"""
+
+# Longest history a ``months`` parameter can ask for
+MAX_MONTHS = 120
+
+
+def int_param(request, name, default=None, minimum=None, maximum=None):
+    """
+    Integer query parameter ``name``, or ``default`` when it is absent,
+    clamped to ``minimum`` and ``maximum`` when they are given.
+    
+    Raises:
+        ValueError: If the parameter is not an integer
+    """
+    
+    value = request.GET.get(name)
+    if not value:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer') from None
+    
+    if minimum is not None:
+        value = max(value, minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
@@ -0,0 +1,102 @@
+"""
+Column-oriented renderers for chart endpoints.
+
+Chart endpoints return a list of rows, or an envelope dictionary holding
+one list of rows. These renderers transpose the rows into one array per
+field, either as JSON or as an Apache Arrow IPC stream. Clients select
+them with the Accept header or ?format=columnar / ?format=arrow.
+"""
+import json
+
+from rest_framework.renderers import JSONRenderer, BaseRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def split_rows(data):
+    """
+    Separate tabular rows from the surrounding envelope.
+    
+    Returns:
+        (rows, envelope, key) where ``key`` is the envelope key that held
+        the rows, or (None, data, None) if the payload is not tabular
+    """
+    
+    if isinstance(data, list):
+        return data, None, None
+    
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, list) and all(isinstance(row, dict) for row in value):
+                envelope = {k: v for k, v in data.items() if k != key}
+                return value, envelope, key
+    
+    return None, data, None
+
+
+def to_columns(rows):
+    """Transpose a list of dictionaries into a dictionary of lists."""
+    
+    fields = []
+    for row in rows:
+        for field in row:
+            if field not in fields:
+                fields.append(field)
+    
+    return {field: [row.get(field) for row in rows] for field in fields}
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """JSON with one array per field instead of one object per row."""
+    
+    media_type = 'application/vnd.nostos.columnar+json'
+    format = 'columnar'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows, envelope, key = split_rows(data)
+        
+        if rows is not None:
+            columnar = {'length': len(rows), 'columns': to_columns(rows)}
+            data = {**envelope, key: columnar} if key else columnar
+        
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class ArrowIPCRenderer(BaseRenderer):
+    """Apache Arrow IPC stream; envelope fields travel in the schema metadata."""
+    
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import pyarrow as pa
+        
+        if data is None:
+            return b''
+        
+        rows, envelope, key = split_rows(data)
+        if rows is None:
+            # Errors and other non-tabular payloads become a single row
+            rows, envelope = [envelope], None
+        
+        # Round-trip through the DRF encoder so dates and decimals become plain values
+        rows = json.loads(json.dumps(rows, cls=JSONEncoder))
+        table = pa.Table.from_pylist(rows)
+        
+        if envelope:
+            metadata = {'envelope': json.dumps(envelope, cls=JSONEncoder), 'rows_key': key}
+            table = table.replace_schema_metadata(metadata)
+        
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        
+        return sink.getvalue().to_pybytes()
+
+
+TABULAR_RENDERER_CLASSES = list(api_settings.DEFAULT_RENDERER_CLASSES) + [
+    ColumnarJSONRenderer,
+    ArrowIPCRenderer,
+]
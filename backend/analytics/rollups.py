@@ -0,0 +1,456 @@
+"""
+Daily donation rollups.
+
+Completed donations are folded into ``DonationRollup`` rows keyed by
+(day, campaign, donor segment). The donation path only queues them as
+``PendingDonation`` rows; fold_pending applies the queue every few
+seconds, so concurrent donations never wait on a rollup row lock. Week,
+month and year series are derived from the daily rows so chart queries
+never touch the donations table.
+
+On PostgreSQL, rebuild_rollups holds an advisory lock that folds and
+imports take shared, so nothing is written to the rollups while it reads
+the donations and swaps the rows in. It reads the queue and the donations
+in one snapshot and drops the queued rows that snapshot already counts.
+"""
+from datetime import datetime, time
+
+from django.db import connection, transaction
+from django.db.models import F, Sum, Min, Max
+from django.db.models.functions import Greatest, Least, TruncWeek, TruncMonth, TruncYear
+from django.utils import timezone
+
+from campaigns.models import Campaign
+from donations.models import ArchivedDonationTotal, Donation
+from .models import DonationRollup, PendingDonation
+from . import approx
+
+# Taken shared by folds and imports, exclusively by a rebuild
+LOCK_ID = 7302
+
+PERIOD_TRUNCATIONS = {
+    'week': TruncWeek,
+    'month': TruncMonth,
+    'year': TruncYear,
+}
+
+
+def donor_segment(donation):
+    """Return the rollup segment for a completed donation."""
+    
+    has_prior = Donation.objects.filter(
+        donor_id=donation.donor_id,
+        status='completed',
+        completed_at__lt=donation.completed_at
+    ).exclude(pk=donation.pk).exists() or ArchivedDonationTotal.objects.filter(
+        donor_id=donation.donor_id,
+        donation_count__gt=0,
+        first_completed_at__lt=donation.completed_at
+    ).exists()
+    
+    return 'repeat' if has_prior else 'first_time'
+
+
+def _stored_segment(donation):
+    """
+    The segment ``donation`` was counted under, computed for donations
+    recorded before segments were stored.
+    """
+    return donation.donor_segment or donor_segment(donation)
+
+
+def _add_to_bucket(buckets, day, campaign_id, category, segment, amount):
+    """Add a signed amount (refunds are negative) to its (day, campaign, segment) bucket."""
+    
+    key = (day, campaign_id, segment)
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = DonationRollup(
+            day=day,
+            campaign_id=campaign_id,
+            category=category,
+            donor_segment=segment,
+            total_amount=0,
+            donation_count=0,
+            min_amount=None,
+            max_amount=None,
+        )
+    
+    bucket.total_amount += amount
+    if amount < 0:
+        bucket.donation_count -= 1
+    else:
+        bucket.donation_count += 1
+        bucket.min_amount = amount if bucket.min_amount is None else min(bucket.min_amount, amount)
+        bucket.max_amount = amount if bucket.max_amount is None else max(bucket.max_amount, amount)
+
+
+def _apply_buckets(buckets, batch_size):
+    """Apply bucket deltas to the stored rollups with one F() update per row."""
+    
+    buckets = [buckets[key] for key in sorted(buckets)]
+    
+    # Missing rows are created empty so every bucket is applied the same way;
+    # a refund whose row no longer exists has nothing to take back
+    DonationRollup.objects.bulk_create([
+        DonationRollup(
+            day=bucket.day,
+            campaign_id=bucket.campaign_id,
+            category=bucket.category,
+            donor_segment=bucket.donor_segment,
+            total_amount=0,
+            donation_count=0,
+            min_amount=bucket.min_amount,
+            max_amount=bucket.max_amount,
+        )
+        for bucket in buckets
+        if bucket.min_amount is not None
+    ], batch_size=batch_size, ignore_conflicts=True)
+    
+    for bucket in buckets:
+        updates = {
+            'total_amount': F('total_amount') + bucket.total_amount,
+            'donation_count': F('donation_count') + bucket.donation_count,
+        }
+        if bucket.min_amount is not None:
+            updates['min_amount'] = Least('min_amount', bucket.min_amount)
+            updates['max_amount'] = Greatest('max_amount', bucket.max_amount)
+        
+        DonationRollup.objects.filter(
+            day=bucket.day,
+            campaign_id=bucket.campaign_id,
+            donor_segment=bucket.donor_segment,
+        ).update(**updates)
+
+
+def _lock_shared(wait=True):
+    """
+    Take the rollup lock shared for the current transaction.
+    
+    Returns:
+        False if ``wait`` is False and a rebuild holds the lock
+    """
+    
+    if connection.vendor != 'postgresql':
+        return True
+    
+    function = 'pg_advisory_xact_lock_shared' if wait else 'pg_try_advisory_xact_lock_shared'
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s)', [LOCK_ID])
+        return wait or cursor.fetchone()[0]
+
+
+def _queue(donation, segment, amount):
+    PendingDonation.objects.create(
+        day=timezone.localdate(donation.completed_at),
+        campaign_id=donation.campaign_id,
+        category=donation.campaign.category,
+        donor_segment=segment,
+        donor_id=donation.donor_id,
+        amount=amount,
+    )
+
+
+def record_donation(donation):
+    """
+    Queue a completed donation for its daily rollup and sketch, storing the
+    segment on the donation so a refund takes it out of the same row.
+    
+    Nothing is locked here; fold_pending applies the queue in the background.
+    """
+    
+    segment = donor_segment(donation)
+    
+    with transaction.atomic():
+        Donation.objects.filter(pk=donation.pk).update(donor_segment=segment)
+        donation.donor_segment = segment
+        _queue(donation, segment, donation.amount)
+
+
+def _first_completions(donor_ids, batch_size):
+    """Earliest completion of each donor, live or archived."""
+    
+    first = {}
+    donor_ids = list(donor_ids)
+    for start in range(0, len(donor_ids), batch_size):
+        chunk = donor_ids[start:start + batch_size]
+        live = Donation.objects.filter(
+            donor_id__in=chunk, status='completed', completed_at__isnull=False
+        ).values('donor_id').annotate(first=Min('completed_at')).values_list('donor_id', 'first')
+        archived = ArchivedDonationTotal.objects.filter(
+            donor_id__in=chunk, donation_count__gt=0, first_completed_at__isnull=False
+        ).values('donor_id').annotate(first=Min('first_completed_at')).values_list('donor_id', 'first')
+        
+        for donor_id, first_at in [*live, *archived]:
+            if donor_id not in first or first_at < first[donor_id]:
+                first[donor_id] = first_at
+    
+    return first
+
+
+def record_donations(donations, batch_size=1000):
+    """
+    Add a batch of completed donations (an import) to their daily rollups.
+    
+    The batch is grouped per (day, campaign, segment) and each row gets one
+    F() update, so history is not rescanned and concurrent folds are kept.
+    Segments are stored on the donations like record_donation does.
+    """
+    
+    if not donations:
+        return
+    
+    first = _first_completions({donation.donor_id for donation in donations}, batch_size)
+    categories = dict(
+        Campaign.objects.filter(pk__in={donation.campaign_id for donation in donations}).values_list('id', 'category')
+    )
+    buckets = {}
+    segments = {'first_time': [], 'repeat': []}
+    
+    for donation in donations:
+        is_repeat = first.get(donation.donor_id, donation.completed_at) < donation.completed_at
+        donation.donor_segment = 'repeat' if is_repeat else 'first_time'
+        segments[donation.donor_segment].append(donation.pk)
+        _add_to_bucket(
+            buckets, timezone.localdate(donation.completed_at), donation.campaign_id,
+            categories[donation.campaign_id], donation.donor_segment, donation.amount
+        )
+    
+    with transaction.atomic():
+        # Waits for a running rebuild, which would otherwise replace these updates
+        _lock_shared()
+        for segment, ids in segments.items():
+            for start in range(0, len(ids), batch_size):
+                Donation.objects.filter(pk__in=ids[start:start + batch_size]).update(donor_segment=segment)
+        _apply_buckets(buckets, batch_size)
+
+
+def remove_donation(donation):
+    """
+    Queue a refunded donation to be taken out of the daily rollup row it
+    was counted in.
+    
+    The row's min and max amounts are left as they were; rebuild_rollups
+    recomputes them exactly.
+    """
+    
+    _queue(donation, _stored_segment(donation), -donation.amount)
+
+
+def _record_sketches(pending):
+    # Sketches cannot remove values; refunds only reach them through rebuild_sketches
+    approx.record_values(
+        (day, campaign_id, donor_id, amount)
+        for pk, day, campaign_id, category, segment, donor_id, amount in pending
+        if amount > 0
+    )
+
+
+def fold_pending(batch_size=5000):
+    """
+    Apply queued donations to the daily rollups and sketches.
+    
+    Rows locked by another fold are skipped and picked up by the next one.
+    While a rebuild runs nothing is folded; the queue is applied after it.
+    
+    Returns:
+        Number of queued donations applied
+    """
+    
+    total = 0
+    while True:
+        with transaction.atomic():
+            if not _lock_shared(wait=False):
+                return total
+            pending = list(
+                PendingDonation.objects.select_for_update(skip_locked=True).values_list(
+                    'pk', 'day', 'campaign_id', 'category', 'donor_segment', 'donor_id', 'amount'
+                )[:batch_size]
+            )
+            if not pending:
+                return total
+            
+            buckets = {}
+            for pk, day, campaign_id, category, segment, donor_id, amount in pending:
+                _add_to_bucket(buckets, day, campaign_id, category, segment, amount)
+            _apply_buckets(buckets, batch_size)
+            
+            _record_sketches(pending)
+            PendingDonation.objects.filter(pk__in=[row[0] for row in pending]).delete()
+        
+        total += len(pending)
+
+
+def rollup_series(start_date, end_date, period='month', **filters):
+    """
+    Aggregate daily rollups into a time series.
+    
+    Args:
+        start_date: First day (inclusive)
+        end_date: Last day (inclusive)
+        period: One of day, week, month, year
+        filters: Extra lookups on DonationRollup (campaign_id, category, ...)
+    
+    Returns:
+        List of dictionaries ordered by period
+    """
+    
+    rollups = DonationRollup.objects.filter(day__gte=start_date, day__lte=end_date, **filters)
+    
+    trunc_func = PERIOD_TRUNCATIONS.get(period)
+    if trunc_func:
+        rollups = rollups.annotate(period=trunc_func('day'))
+    else:
+        rollups = rollups.annotate(period=F('day'))
+    
+    series = rollups.values('period').annotate(
+        total_amount=Sum('total_amount'),
+        donation_count=Sum('donation_count'),
+        min_amount=Min('min_amount'),
+        max_amount=Max('max_amount'),
+    ).order_by('period')
+    
+    return [
+        {
+            'period': item['period'],
+            'total_amount': item['total_amount'],
+            'donation_count': item['donation_count'],
+            'avg_amount': item['total_amount'] / item['donation_count'] if item['donation_count'] else 0,
+            'min_amount': item['min_amount'],
+            'max_amount': item['max_amount'],
+        }
+        for item in series
+    ]
+
+
+def _compute_rollups(batch_size, since):
+    """
+    Daily buckets of completed donations.
+    
+    Returns:
+        (rollups the buckets replace, buckets, ids of unsegmented donations per segment)
+    """
+    
+    buckets = {}
+    completed = Donation.objects.filter(status='completed', completed_at__isnull=False)
+    # Rollups of archived campaigns are kept: their donations are no longer in the table
+    rollups = DonationRollup.objects.filter(campaign__archived_at__isnull=True)
+    seen_donors = set()
+    first_archived = dict(
+        ArchivedDonationTotal.objects.filter(donation_count__gt=0).values('donor_id').annotate(
+            first=Min('first_completed_at')
+        ).values_list('donor_id', 'first')
+    )
+    
+    if since is not None:
+        start = timezone.make_aware(datetime.combine(since, time.min))
+        # Donors who gave before the window are repeat donors inside it
+        seen_donors = set(
+            completed.filter(completed_at__lt=start).values_list('donor_id', flat=True).distinct()
+        )
+        completed = completed.completed_between(start)
+        rollups = rollups.filter(day__gte=since)
+    
+    donations = completed.order_by(
+        'completed_at', 'id'
+    ).values_list('id', 'completed_at', 'campaign_id', 'campaign__category', 'donor_id', 'amount', 'donor_segment')
+    unsegmented = {'first_time': [], 'repeat': []}
+    
+    for pk, completed_at, campaign_id, category, donor_id, amount, segment in donations.iterator(
+        chunk_size=batch_size
+    ):
+        if not segment:
+            is_repeat = donor_id in seen_donors or first_archived.get(donor_id, completed_at) < completed_at
+            segment = 'repeat' if is_repeat else 'first_time'
+            unsegmented[segment].append(pk)
+        seen_donors.add(donor_id)
+        
+        key = (timezone.localdate(completed_at), campaign_id, segment)
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = DonationRollup(
+                day=key[0],
+                campaign_id=campaign_id,
+                category=category,
+                donor_segment=segment,
+                total_amount=amount,
+                donation_count=1,
+                min_amount=amount,
+                max_amount=amount,
+            )
+        else:
+            bucket.total_amount += amount
+            bucket.donation_count += 1
+            bucket.min_amount = min(bucket.min_amount, amount)
+            bucket.max_amount = max(bucket.max_amount, amount)
+    
+    return rollups, buckets, unsegmented
+
+
+def _replace_rollups(rollups, buckets, unsegmented, queued, batch_size):
+    """
+    Swap freshly computed rollups in for ``rollups``.
+    
+    The ``queued`` rows were already in the table the buckets were computed
+    from, so they only go into the sketches and are dropped from the queue.
+    """
+    
+    with transaction.atomic():
+        for segment, ids in unsegmented.items():
+            for start in range(0, len(ids), batch_size):
+                Donation.objects.filter(
+                    pk__in=ids[start:start + batch_size], donor_segment=''
+                ).update(donor_segment=segment)
+        
+        for start in range(0, len(queued), batch_size):
+            pending = PendingDonation.objects.filter(pk__in=queued[start:start + batch_size])
+            _record_sketches(pending.values_list(
+                'pk', 'day', 'campaign_id', 'category', 'donor_segment', 'donor_id', 'amount'
+            ))
+            pending.delete()
+        
+        rollups.delete()
+        DonationRollup.objects.bulk_create(buckets.values(), batch_size=batch_size)
+
+
+def rebuild_rollups(batch_size=5000, since=None):
+    """
+    Recompute rollups from the donations table.
+    
+    Donations keep the segment they were recorded under; segments are only
+    computed (and stored) for donations that have none yet. Donations
+    queued while the rebuild runs stay queued for the next fold.
+    
+    Args:
+        batch_size: Rows fetched and inserted per round trip
+        since: Only rebuild days from this date on (all days if None)
+    
+    Returns:
+        Number of rollup rows written
+    """
+    
+    snapshot = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    if snapshot:
+        # Waits for running folds and imports and keeps new ones out until the swap
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [LOCK_ID])
+    
+    try:
+        with transaction.atomic():
+            if snapshot:
+                # The queue and the donations are read in the same snapshot
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            
+            # Queued rows of the rebuilt days are already counted by the scan
+            queued = PendingDonation.objects.all() if since is None else PendingDonation.objects.filter(day__gte=since)
+            queued = list(queued.values_list('pk', flat=True))
+            rollups, buckets, unsegmented = _compute_rollups(batch_size, since)
+        
+        _replace_rollups(rollups, buckets, unsegmented, queued, batch_size)
+    finally:
+        if snapshot:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [LOCK_ID])
+    
+    return len(buckets)
@@ -0,0 +1,51 @@
+"""
+Serializers for Analytics API.
+"""
+from django.urls import reverse
+from rest_framework import serializers
+from .models import ExportJob
+
+
+class ExportJobCreateSerializer(serializers.ModelSerializer):
+    """Serializer for submitting an export job."""
+    
+    start_date = serializers.DateField(required=False, write_only=True)
+    end_date = serializers.DateField(required=False, write_only=True)
+    campaign = serializers.IntegerField(required=False, write_only=True)
+    status = serializers.CharField(required=False, write_only=True)
+    payment_method = serializers.CharField(required=False, write_only=True)
+    
+    class Meta:
+        model = ExportJob
+        fields = ('report_type', 'export_format', 'start_date', 'end_date', 'campaign', 'status', 'payment_method')
+    
+    def create(self, validated_data):
+        filters = {
+            key: str(validated_data.pop(key))
+            for key in ('start_date', 'end_date', 'campaign', 'status', 'payment_method')
+            if key in validated_data
+        }
+        return ExportJob.objects.create(filters=filters, **validated_data)
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    """Serializer for export job status."""
+    
+    progress_percentage = serializers.ReadOnlyField()
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ExportJob
+        fields = (
+            'id', 'report_type', 'export_format', 'filters', 'status', 'total_rows',
+            'rows_written', 'progress_percentage', 'download_url', 'error',
+            'created_at', 'started_at', 'finished_at'
+        )
+    
+    def get_download_url(self, obj):
+        if obj.status != 'completed' or not obj.file:
+            return None
+        request = self.context.get('request')
+        # Export files are private; they are served by the authenticated download view
+        url = reverse('analytics:export-job-download', args=[obj.id])
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,78 @@
+"""
+Signal receivers keeping analytics aggregates up to date.
+"""
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from campaigns.models import Campaign
+from donations.signals import donation_completed, donation_refunded, donations_imported
+from .dashboard import mark_stale
+from .live import schedule_campaign_push
+from .models import DashboardSnapshot
+from .donors import CACHE_KEY as DONOR_FRAME_CACHE_KEY
+from . import approx, rollups
+
+
+@receiver(donation_completed)
+def update_donation_rollup(sender, donation, **kwargs):
+    """Queue a newly completed donation for the daily rollup and sketches."""
+    rollups.record_donation(donation)
+
+
+@receiver(donation_completed)
+def invalidate_donor_dashboards(sender, donation, **kwargs):
+    """Queue refreshes of the admin dashboard and the donor's own."""
+    mark_stale(DashboardSnapshot.GLOBAL_SCOPE, f'user:{donation.donor_id}')
+
+
+@receiver(donation_completed)
+def push_donation_progress(sender, donation, **kwargs):
+    """Queue a coalesced live progress event for the donation's campaign."""
+    schedule_campaign_push(donation.campaign_id)
+
+
+@receiver(donation_refunded)
+def update_refunded_aggregates(sender, donation, **kwargs):
+    """
+    Take a refunded donation out of its daily rollup and refresh dashboards.
+    
+    Sketches cannot remove values, so approximate figures keep the donation
+    until rebuild_sketches runs.
+    """
+    rollups.remove_donation(donation)
+    mark_stale(DashboardSnapshot.GLOBAL_SCOPE, f'user:{donation.donor_id}')
+    schedule_campaign_push(donation.campaign_id)
+
+
+@receiver(donations_imported)
+def update_imported_aggregates(sender, donations, **kwargs):
+    """Add imported donations to rollups and sketches and refresh dashboards."""
+    
+    rollups.record_donations(donations)
+    approx.record_donations(donations)
+    cache.delete(DONOR_FRAME_CACHE_KEY)
+    
+    # Donor dashboards are picked up by the periodic stale refresh
+    donor_ids = {donation.donor_id for donation in donations}
+    DashboardSnapshot.objects.filter(user_id__in=donor_ids, is_stale=False).update(is_stale=True)
+    mark_stale(DashboardSnapshot.GLOBAL_SCOPE)
+    
+    for campaign_id in {donation.campaign_id for donation in donations}:
+        schedule_campaign_push(campaign_id)
+
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def invalidate_campaign_dashboards(sender, instance, **kwargs):
+    """Queue refreshes of the admin dashboard and the campaign creator's."""
+    scopes = [DashboardSnapshot.GLOBAL_SCOPE]
+    if instance.created_by_id:
+        scopes.append(f'user:{instance.created_by_id}')
+    mark_stale(*scopes)
+
+
+@receiver(post_save, sender=Campaign)
+def push_campaign_progress(sender, instance, **kwargs):
+    """Queue a coalesced live progress event when a campaign changes."""
+    schedule_campaign_push(instance.pk)
@@ -0,0 +1,247 @@
+"""
+Mergeable sketches for approximate analytics.
+
+HyperLogLog estimates distinct counts and t-digest estimates quantiles.
+Both serialize to a few KB and merge losslessly with sketches of the
+same parameters, so daily sketches can be combined over any date range.
+"""
+import bisect
+import hashlib
+import math
+
+import numpy as np
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**precision one-byte registers."""
+    
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+    
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+    
+    def add(self, value):
+        hashed = self._hash(value)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge HyperLogLog sketches of different precision')
+        return self.merge_registers([other.registers])
+    
+    def merge_registers(self, registers):
+        """Merge serialized register arrays (to_bytes() output) in one vectorized pass."""
+        
+        arrays = [np.frombuffer(self.registers, dtype=np.uint8)]
+        for data in registers:
+            array = np.frombuffer(data, dtype=np.uint8)
+            if array.size != self.m:
+                raise ValueError('Cannot merge HyperLogLog sketches of different precision')
+            arrays.append(array)
+        
+        self.registers = bytearray(np.maximum.reduce(arrays).tobytes())
+        return self
+    
+    def count(self):
+        """Estimated number of distinct values added."""
+        
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        estimate = alpha * self.m * self.m / float(np.exp2(-registers.astype(np.float64)).sum())
+        
+        # Linear counting is more accurate for small cardinalities
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        
+        return estimate
+    
+    @property
+    def relative_error(self):
+        """Standard error of count() relative to the true cardinality."""
+        return 1.04 / math.sqrt(self.m)
+    
+    def to_bytes(self):
+        return bytes(self.registers)
+    
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(precision=int(math.log2(len(data))), registers=data)
+
+
+class TDigest:
+    """Merging t-digest for quantile and histogram estimates."""
+    
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.centroids = []  # sorted [mean, weight] pairs
+        self.buffer = []
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    def add(self, value, weight=1.0):
+        value = float(value)
+        self.buffer.append([value, float(weight)])
+        self.total += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.buffer) >= self.compression * 5:
+            self._compress()
+    
+    def merge(self, other):
+        other._compress()
+        self.buffer.extend([mean, weight] for mean, weight in other.centroids)
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+    
+    def _scale(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+    
+    def _compress(self):
+        if not self.buffer:
+            return
+        
+        points = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        
+        merged = [list(points[0])]
+        seen = 0.0
+        k_left = self._scale(0.0)
+        
+        for mean, weight in points[1:]:
+            current = merged[-1]
+            proposed = seen + current[1] + weight
+            if self._scale(proposed / self.total) - k_left <= 1:
+                current[0] += (mean - current[0]) * weight / (current[1] + weight)
+                current[1] += weight
+            else:
+                seen += current[1]
+                k_left = self._scale(seen / self.total)
+                merged.append([mean, weight])
+        
+        self.centroids = merged
+    
+    def _positions(self):
+        """Cumulative rank at each centroid's center, bracketed by min and max."""
+        
+        ranks = [0.0]
+        values = [self.min]
+        cumulative = 0.0
+        for mean, weight in self.centroids:
+            ranks.append(cumulative + weight / 2)
+            values.append(mean)
+            cumulative += weight
+        ranks.append(self.total)
+        values.append(self.max)
+        return ranks, values
+    
+    def quantile(self, q):
+        """Estimated value at quantile ``q`` (0-1)."""
+        
+        self._compress()
+        if not self.centroids:
+            return None
+        
+        ranks, values = self._positions()
+        target = q * self.total
+        index = min(max(bisect.bisect_left(ranks, target), 1), len(ranks) - 1)
+        
+        low_rank, high_rank = ranks[index - 1], ranks[index]
+        low, high = values[index - 1], values[index]
+        if high_rank == low_rank:
+            return high
+        return low + (high - low) * (target - low_rank) / (high_rank - low_rank)
+    
+    def cdf(self, value):
+        """Estimated fraction of weight at or below ``value``."""
+        
+        self._compress()
+        if not self.centroids:
+            return 0.0
+        if value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+        
+        ranks, values = self._positions()
+        index = min(max(bisect.bisect_right(values, value), 1), len(values) - 1)
+        
+        low, high = values[index - 1], values[index]
+        low_rank, high_rank = ranks[index - 1], ranks[index]
+        if high == low:
+            return high_rank / self.total
+        return (low_rank + (high_rank - low_rank) * (value - low) / (high - low)) / self.total
+    
+    def rank_error(self, q):
+        """
+        Approximate rank error of quantile(q), as a fraction of the total.
+        
+        Values inside one centroid are indistinguishable, so the estimate
+        can be off by about half the weight of the centroid covering q.
+        """
+        
+        self._compress()
+        if not self.total:
+            return 0.0
+        
+        target = q * self.total
+        cumulative = 0.0
+        for _, weight in self.centroids:
+            cumulative += weight
+            if cumulative >= target:
+                return weight / 2 / self.total
+        return 0.0
+    
+    def histogram(self, bins=10):
+        """Estimated counts for ``bins`` equal-width buckets between min and max."""
+        
+        self._compress()
+        if not self.centroids:
+            return []
+        
+        width = (self.max - self.min) / bins or 1.0
+        edges = [self.min + width * i for i in range(bins + 1)]
+        cdfs = [0.0] + [self.cdf(edge) for edge in edges[1:-1]] + [1.0]
+        
+        return [
+            {
+                'lower': edges[i],
+                'upper': edges[i + 1],
+                'count': (cdfs[i + 1] - cdfs[i]) * self.total,
+            }
+            for i in range(bins)
+        ]
+    
+    def to_dict(self):
+        self._compress()
+        return {
+            'compression': self.compression,
+            'centroids': self.centroids,
+            'total': self.total,
+            'min': self.min if self.centroids else None,
+            'max': self.max if self.centroids else None,
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        digest = cls(compression=data.get('compression', 100))
+        digest.centroids = [list(centroid) for centroid in data.get('centroids', [])]
+        digest.total = data.get('total', 0.0)
+        if digest.centroids:
+            digest.min = data['min']
+            digest.max = data['max']
+        return digest
@@ -0,0 +1,83 @@
+"""
+Server-Sent Event streams for live campaign and dashboard updates.
+
+These are plain async Django views rather than DRF views so they can
+hold a connection open under the ASGI application. EventSource cannot
+set headers, so the dashboard stream also accepts the JWT access token
+as a ``token`` query parameter.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .dashboard import get_snapshot
+from .live import ALL_CAMPAIGNS, campaign_channel, campaign_progress, dashboard_channel, subscribe
+from .models import DashboardSnapshot
+
+
+def _format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+async def _event_stream(initial, channels):
+    for event, data in initial:
+        yield _format_event(event, data)
+    
+    async for event, data in subscribe(*channels):
+        if event is None:
+            yield ': keepalive\n\n'
+        else:
+            yield _format_event(event, data)
+
+
+def _stream_response(initial, channels):
+    response = StreamingHttpResponse(_event_stream(initial, channels), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _authenticate(request):
+    authenticator = JWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header else request.GET.get('token')
+    if not raw_token:
+        return None
+    
+    try:
+        return authenticator.get_user(authenticator.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+async def campaign_stream(request, campaign_id=None):
+    """Stream progress events for one campaign, or for every campaign."""
+    
+    if campaign_id is None:
+        return _stream_response([], [ALL_CAMPAIGNS])
+    
+    progress = await sync_to_async(campaign_progress)(campaign_id)
+    if progress is None:
+        return JsonResponse({'error': 'Campaign not found'}, status=404)
+    
+    return _stream_response([('campaign.progress', progress)], [campaign_channel(campaign_id)])
+
+
+async def dashboard_stream(request):
+    """Stream the caller's dashboard snapshot followed by deltas as it is refreshed."""
+    
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided.'}, status=401)
+    
+    snapshot = await sync_to_async(get_snapshot)(user)
+    initial = [('dashboard.snapshot', {
+        **snapshot.payload,
+        'as_of': snapshot.as_of,
+        'is_stale': snapshot.is_stale,
+    })]
+    
+    return _stream_response(initial, [dashboard_channel(DashboardSnapshot.scope_for(user))])
@@ -0,0 +1,61 @@
+"""
+Background tasks for Analytics.
+"""
+from celery import shared_task
+from django.utils import timezone
+
+from .dashboard import refresh_snapshot
+from .exports import run_export, count_rows
+from .live import publish_campaign
+from .models import ExportJob, DashboardSnapshot
+from .rollups import fold_pending
+
+
+@shared_task
+def run_export_job(job_id):
+    """Write an export job's report file and record its progress."""
+    
+    try:
+        job = ExportJob.objects.get(pk=job_id, status='queued')
+    except ExportJob.DoesNotExist:
+        return
+    
+    jobs = ExportJob.objects.filter(pk=job.pk)
+    jobs.update(status='running', started_at=timezone.now(), total_rows=count_rows(job))
+    
+    try:
+        path = run_export(job, progress=lambda written: jobs.update(rows_written=written))
+    except Exception as e:
+        jobs.update(status='failed', error=str(e), finished_at=timezone.now())
+        raise
+    
+    jobs.update(status='completed', file=path, finished_at=timezone.now())
+
+
+@shared_task
+def refresh_dashboard_snapshot(scope):
+    """Recompute one dashboard snapshot."""
+    refresh_snapshot(scope)
+
+
+@shared_task
+def refresh_stale_dashboard_snapshots():
+    """Recompute the global snapshot and any snapshot flagged stale."""
+    
+    refresh_snapshot(DashboardSnapshot.GLOBAL_SCOPE)
+    
+    stale_scopes = DashboardSnapshot.objects.filter(is_stale=True).values_list('scope', flat=True)
+    for scope in stale_scopes.iterator():
+        refresh_snapshot(scope)
+
+
+@shared_task
+def publish_campaign_progress(campaign_id):
+    """Publish a campaign's progress at the end of its coalescing window."""
+    publish_campaign(campaign_id)
+
+
+@shared_task
+def fold_pending_donations():
+    """Apply queued donations to the daily rollups and sketches."""
+    fold_pending()
@@ -0,0 +1,670 @@
+"""
+Tests for the Analytics app.
+"""
+import datetime
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import cache
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from campaigns.models import Campaign
+from donations import leaderboards
+from donations.models import Donation
+from users.models import User
+from . import approx, budgets, dashboard, live, renderers, rollups
+from .models import DashboardSnapshot, DonationRollup, DonationSketch, DonorSketch, ExportJob, PendingDonation
+from .tasks import refresh_stale_dashboard_snapshots, run_export_job
+
+# In-process cache and leaderboards, so tests need no Redis; Celery tasks are
+# only queued on commit, which TestCase never reaches
+LOCAL_SERVICES = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    LEADERBOARD_REDIS_URL='',
+)
+
+
+class AnalyticsTestCase(TestCase):
+    """An admin, an alumnus and an active campaign."""
+    
+    def setUp(self):
+        # The in-process cache and boards outlive each test's rollback
+        cache.clear()
+        leaderboards._store = None
+        self.admin = User.objects.create_superuser('admin@example.com', 'password', name='Admin')
+        self.alumnus = User.objects.create_user('alumnus@example.com', 'password', name='Alumnus')
+        self.campaign = Campaign.objects.create(
+            title='Library', description='Books', goal=100000, deadline=datetime.date(2030, 1, 1),
+            status='active', category='Education', created_by=self.admin
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+    
+    def donate(self, amount, donor=None, **fields):
+        fields.setdefault('status', 'completed')
+        return Donation.objects.create(
+            donor=donor or self.alumnus, campaign=self.campaign, amount=amount, payment_method='upi', **fields
+        )
+
+
+@LOCAL_SERVICES
+class QueryParameterTests(AnalyticsTestCase):
+    """Malformed integer query parameters."""
+    
+    def test_non_integer_parameters_are_rejected(self):
+        for url in [
+            '/api/analytics/donation-trends/?campaign=abc',
+            '/api/analytics/donation-trends/?months=abc',
+            '/api/analytics/donation-distribution/?campaign=abc',
+            '/api/analytics/donation-distribution/?bins=abc',
+            '/api/analytics/donor-analytics/?limit=abc',
+            '/api/analytics/cohorts/?start_year=abc',
+            '/api/analytics/cohorts/?end_year=abc',
+        ]:
+            with self.subTest(url=url):
+                response = self.api.get(url)
+                
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('must be an integer', response.data['error'])
+    
+    def test_out_of_range_months_are_clamped(self):
+        for url in [
+            '/api/analytics/donation-trends/?months=100000000000',
+            '/api/analytics/donation-distribution/?months=-5',
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(self.api.get(url).status_code, 200)
+    
+    def test_campaign_filters_trends(self):
+        response = self.api.get(f'/api/analytics/donation-trends/?campaign={self.campaign.pk}')
+        
+        self.assertEqual(response.status_code, 200)
+
+
+@LOCAL_SERVICES
+class RollupTests(AnalyticsTestCase):
+    """Daily rollups fed through the pending donation queue."""
+    
+    def rollup(self, segment='first_time'):
+        return DonationRollup.objects.get(
+            day=timezone.localdate(), campaign=self.campaign, donor_segment=segment
+        )
+    
+    def test_fold_applies_completion_and_refund(self):
+        other = User.objects.create_user('other@example.com', 'password', name='Other')
+        refunded = self.donate(300)
+        self.donate(200, donor=other)
+        
+        self.assertFalse(DonationRollup.objects.exists())
+        self.assertEqual(rollups.fold_pending(), 2)
+        
+        rollup = self.rollup()
+        self.assertEqual(rollup.total_amount, 500)
+        self.assertEqual(rollup.donation_count, 2)
+        self.assertEqual((rollup.min_amount, rollup.max_amount), (200, 300))
+        
+        self.api.post(f'/api/donations/{refunded.pk}/refund/')
+        self.assertEqual(rollups.fold_pending(), 1)
+        
+        rollup = self.rollup()
+        self.assertEqual(rollup.total_amount, 200)
+        self.assertEqual(rollup.donation_count, 1)
+        self.assertFalse(PendingDonation.objects.exists())
+        self.assertEqual(rollups.fold_pending(), 0)
+    
+    def test_rebuild_counts_queued_donations_once(self):
+        self.donate(100)
+        rollups.fold_pending()
+        self.donate(50)
+        self.assertEqual(PendingDonation.objects.count(), 1)
+        
+        rollups.rebuild_rollups()
+        rollups.fold_pending()
+        
+        self.assertFalse(PendingDonation.objects.exists())
+        self.assertEqual(self.rollup('first_time').total_amount, 100)
+        self.assertEqual(self.rollup('repeat').total_amount, 50)
+        self.assertEqual(sum(DonationRollup.objects.values_list('donation_count', flat=True)), 2)
+    
+    def test_donation_queued_during_rebuild_is_folded_once(self):
+        self.donate(100)
+        replace_rollups = rollups._replace_rollups
+        
+        def donate_then_replace(*args):
+            # Completes after the rebuild has read the donations
+            self.donate(70)
+            replace_rollups(*args)
+        
+        with mock.patch.object(rollups, '_replace_rollups', donate_then_replace):
+            rollups.rebuild_rollups()
+        
+        self.assertEqual(self.rollup('first_time').total_amount, 100)
+        self.assertEqual(PendingDonation.objects.count(), 1)
+        
+        rollups.fold_pending()
+        
+        self.assertEqual(self.rollup('repeat').total_amount, 70)
+        self.assertEqual(sum(DonationRollup.objects.values_list('donation_count', flat=True)), 2)
+    
+    def test_partial_rebuild_keeps_earlier_days_queued(self):
+        earlier = timezone.now() - datetime.timedelta(days=3)
+        self.donate(40, completed_at=earlier)
+        
+        rollups.rebuild_rollups(since=timezone.localdate())
+        rollups.fold_pending()
+        
+        self.assertEqual(
+            DonationRollup.objects.get(day=timezone.localdate(earlier), campaign=self.campaign).total_amount, 40
+        )
+
+
+@LOCAL_SERVICES
+class ExportDownloadTests(AnalyticsTestCase):
+    """Export files are private and only served through the download view."""
+    
+    def setUp(self):
+        super().setUp()
+        export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_root)
+        export_settings = override_settings(EXPORT_ROOT=export_root)
+        export_settings.enable()
+        self.addCleanup(export_settings.disable)
+        
+        self.donate(250)
+        self.job = ExportJob.objects.create(requested_by=self.admin, report_type='donations')
+        run_export_job(str(self.job.pk))
+        self.job.refresh_from_db()
+    
+    def test_file_is_written_outside_media_root(self):
+        path = Path(self.job.file.path)
+        
+        self.assertEqual(self.job.status, 'completed')
+        self.assertTrue(path.is_relative_to(settings.EXPORT_ROOT))
+        self.assertFalse(path.is_relative_to(settings.MEDIA_ROOT))
+    
+    def test_requester_downloads_through_the_view(self):
+        response = self.api.get(f'/api/analytics/export-jobs/{self.job.pk}/')
+        
+        self.assertEqual(
+            response.data['download_url'], f'http://testserver/api/analytics/export-jobs/{self.job.pk}/download/'
+        )
+        
+        download = self.api.get(response.data['download_url'])
+        
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(download['Content-Type'], 'text/csv')
+        self.assertIn(b'alumnus@example.com', b''.join(download.streaming_content))
+    
+    def test_other_users_cannot_download(self):
+        url = f'/api/analytics/export-jobs/{self.job.pk}/download/'
+        
+        self.api.force_authenticate(self.alumnus)
+        self.assertEqual(self.api.get(url).status_code, 403)
+        self.api.force_authenticate(None)
+        self.assertEqual(self.api.get(url).status_code, 401)
+    
+    def test_unfinished_export_is_not_served(self):
+        job = ExportJob.objects.create(requested_by=self.admin, report_type='donations')
+        
+        response = self.api.get(f'/api/analytics/export-jobs/{job.pk}/download/')
+        
+        self.assertEqual(response.status_code, 409)
+
+
+@LOCAL_SERVICES
+class SnapshotStalenessTests(AnalyticsTestCase):
+    """Stored dashboard snapshots, their scopes and staleness."""
+    
+    def setUp(self):
+        super().setUp()
+        self.snapshot = dashboard.refresh_snapshot(DashboardSnapshot.GLOBAL_SCOPE)
+        # Creating the campaign already claimed the refresh debounce window
+        cache.clear()
+    
+    def test_flagged_after_commit(self):
+        with mock.patch('analytics.tasks.refresh_dashboard_snapshot.apply_async') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                dashboard.mark_stale(DashboardSnapshot.GLOBAL_SCOPE)
+                self.snapshot.refresh_from_db()
+                
+                self.assertFalse(self.snapshot.is_stale)
+        
+        self.snapshot.refresh_from_db()
+        self.assertTrue(self.snapshot.is_stale)
+        refresh.assert_called_once()
+    
+    def test_rolled_back_write_leaves_snapshot_fresh(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            dashboard.mark_stale(DashboardSnapshot.GLOBAL_SCOPE)
+        callbacks.clear()
+        
+        self.snapshot.refresh_from_db()
+        self.assertFalse(self.snapshot.is_stale)
+    
+    def test_refresh_is_debounced_and_clears_flag(self):
+        with mock.patch('analytics.tasks.refresh_dashboard_snapshot.apply_async') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                dashboard.mark_stale(DashboardSnapshot.GLOBAL_SCOPE)
+                dashboard.mark_stale(DashboardSnapshot.GLOBAL_SCOPE)
+        
+        refresh.assert_called_once()
+        self.donate(400)
+        dashboard.refresh_snapshot(DashboardSnapshot.GLOBAL_SCOPE)
+        
+        self.snapshot.refresh_from_db()
+        self.assertFalse(self.snapshot.is_stale)
+        self.assertEqual(self.snapshot.payload['donations']['total_amount'], 400)
+    
+    
+    def test_view_serves_stored_snapshot_until_refreshed(self):
+        self.donate(400)
+        
+        response = self.api.get('/api/analytics/dashboard/')
+        
+        self.assertEqual(response.data['donations']['total_amount'], 0)
+        self.assertEqual(response.data['as_of'], self.snapshot.as_of.isoformat())
+        
+        with mock.patch('analytics.tasks.refresh_dashboard_snapshot.apply_async'):
+            with self.captureOnCommitCallbacks(execute=True):
+                dashboard.mark_stale(DashboardSnapshot.GLOBAL_SCOPE)
+        self.assertTrue(self.api.get('/api/analytics/dashboard/').data['is_stale'])
+        
+        refresh_stale_dashboard_snapshots()
+        
+        response = self.api.get('/api/analytics/dashboard/')
+        self.assertEqual(response.data['donations']['total_amount'], 400)
+        self.assertFalse(response.data['is_stale'])
+    
+    def test_alumni_get_their_own_snapshot(self):
+        self.donate(250)
+        other = User.objects.create_user('other@example.com', 'password', name='Other')
+        self.donate(100, donor=other)
+        self.api.force_authenticate(self.alumnus)
+        
+        response = self.api.get('/api/analytics/dashboard/')
+        
+        self.assertEqual(response.data['donations']['total_amount'], 250)
+        self.assertTrue(DashboardSnapshot.objects.filter(scope=f'user:{self.alumnus.pk}').exists())
+    
+    def test_admins_share_the_global_snapshot(self):
+        other_admin = User.objects.create_superuser('second@example.com', 'password', name='Second')
+        
+        self.assertIsNone(dashboard.refresh_snapshot(f'user:{other_admin.pk}'))
+        self.assertEqual(dashboard.get_snapshot(other_admin), self.snapshot)
+
+
+@LOCAL_SERVICES
+class DonorSketchTests(AnalyticsTestCase):
+    """All-time donor estimates from the monthly donor sketches."""
+    
+    def setUp(self):
+        super().setUp()
+        other = User.objects.create_user('other@example.com', 'password', name='Other')
+        self.donate(100)
+        self.donate(200)
+        self.donate(300, donor=other)
+        rollups.fold_pending()
+    
+    def test_fold_feeds_monthly_donor_sketch(self):
+        self.assertEqual(DonorSketch.objects.get().month, timezone.localdate().replace(day=1))
+        self.assertEqual(round(approx.merged_donors().count()), 2)
+    
+    def test_approx_dashboard_reads_donor_sketches_only(self):
+        DonationSketch.objects.all().delete()
+        
+        response = self.api.get('/api/analytics/dashboard/?approx=1')
+        
+        self.assertEqual(response.data['approximate']['active_donors']['estimate'], 2)
+    
+    def test_rebuild_recomputes_donor_sketches(self):
+        DonorSketch.objects.all().delete()
+        
+        approx.rebuild_sketches()
+        
+        self.assertEqual(DonorSketch.objects.count(), 1)
+        self.assertEqual(round(approx.merged_donors().count()), 2)
+
+
+@LOCAL_SERVICES
+class DonorAnalyticsTests(AnalyticsTestCase):
+    """RFM scores and keyset pages over the donor frame."""
+    
+    def setUp(self):
+        super().setUp()
+        long_ago = timezone.now() - datetime.timedelta(days=200)
+        self.donors = {}
+        for name, amounts, completed_at in [
+            ('Asha', [20000], None),
+            ('Bala', [100, 100, 100], None),
+            ('Chitra', [500], long_ago),
+            ('Dev', [500], None),
+            ('Esha', [50], long_ago),
+        ]:
+            donor = User.objects.create_user(f'{name.lower()}@example.com', 'password', name=name)
+            for amount in amounts:
+                self.donate(amount, donor=donor, completed_at=completed_at)
+            self.donors[name] = donor.pk
+    
+    def rows(self, **params):
+        response = self.api.get('/api/analytics/donor-analytics/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def test_scores_and_segments(self):
+        data = self.rows()
+        rows = {row['donor_name']: row for row in data['donors']['results']}
+        
+        self.assertEqual(data['total_donors'], 5)
+        self.assertEqual(data['high_value_donors'], 1)
+        self.assertEqual(data['regular_donors'], 1)
+        self.assertEqual(data['active_donors'], 3)
+        self.assertEqual(rows['Asha']['monetary_score'], 5)
+        self.assertEqual(rows['Esha']['monetary_score'], 1)
+        self.assertEqual(rows['Bala']['frequency_score'], 5)
+        # Equal totals share a score
+        self.assertEqual(rows['Chitra']['monetary_score'], rows['Dev']['monetary_score'])
+        self.assertGreater(rows['Dev']['recency_score'], rows['Chitra']['recency_score'])
+        self.assertEqual(
+            [row['donor_name'] for row in self.rows(segment='regular')['donors']['results']], ['Bala']
+        )
+    
+    def test_pages_cover_every_donor_once_across_ties(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'ordering': 'total_donated', 'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.rows(**params)['donors']
+            seen.extend(row['donor_id'] for row in page['results'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        
+        self.assertEqual(
+            seen,
+            [self.donors[name] for name in ('Esha', 'Bala')]
+            + sorted([self.donors['Chitra'], self.donors['Dev']])
+            + [self.donors['Asha']]
+        )
+    
+    def test_invalid_cursor_and_ordering_are_rejected(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'ordering': 'donor_name'}, {'segment': 'lapsed'}):
+            with self.subTest(params=params):
+                response = self.api.get('/api/analytics/donor-analytics/', params)
+                
+                self.assertEqual(response.status_code, 400)
+    
+    def test_alumni_are_refused(self):
+        self.api.force_authenticate(self.alumnus)
+        
+        self.assertEqual(self.api.get('/api/analytics/donor-analytics/').status_code, 403)
+
+
+@LOCAL_SERVICES
+class TabularRendererTests(AnalyticsTestCase):
+    """Column-oriented JSON and Arrow renderings of chart endpoints."""
+    
+    def setUp(self):
+        super().setUp()
+        self.donate(100)
+        self.donate(300)
+        rollups.fold_pending()
+    
+    def test_columnar_json_keeps_the_envelope(self):
+        rows = self.api.get('/api/analytics/donation-trends/').data['data']
+        
+        response = self.api.get('/api/analytics/donation-trends/?format=columnar')
+        
+        self.assertEqual(response['Content-Type'], 'application/vnd.nostos.columnar+json')
+        self.assertEqual(json.loads(response.content), {
+            'period': 'month',
+            'data': {'length': len(rows), 'columns': renderers.to_columns(rows)},
+        })
+    
+    def test_arrow_stream_round_trips_rows_and_envelope(self):
+        import pyarrow as pa
+        
+        response = self.api.get('/api/analytics/donation-trends/', HTTP_ACCEPT='application/vnd.apache.arrow.stream')
+        
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.column('total_amount').to_pylist(), [400.0])
+        self.assertEqual(table.column('donation_count').to_pylist(), [2])
+        self.assertEqual(json.loads(table.schema.metadata[b'envelope']), {'period': 'month'})
+        self.assertEqual(table.schema.metadata[b'rows_key'], b'data')
+    
+    def test_errors_render_as_a_single_arrow_row(self):
+        import pyarrow as pa
+        
+        response = self.api.get('/api/analytics/donation-trends/?months=abc&format=arrow')
+        
+        self.assertEqual(response.status_code, 400)
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.to_pylist(), [{'error': 'months must be an integer'}])
+    
+    def test_split_rows_finds_the_row_list(self):
+        self.assertEqual(renderers.split_rows([{'a': 1}]), ([{'a': 1}], None, None))
+        self.assertEqual(
+            renderers.split_rows({'period': 'month', 'data': [{'a': 1}]}),
+            ([{'a': 1}], {'period': 'month'}, 'data')
+        )
+        self.assertEqual(renderers.split_rows({'error': 'x'}), (None, {'error': 'x'}, None))
+
+
+@LOCAL_SERVICES
+class CohortAnalyticsTests(AnalyticsTestCase):
+    """Participation, yearly giving and retention per graduation year."""
+    
+    def setUp(self):
+        super().setUp()
+        self.classmates = {}
+        for name, year in [('Asha', '2010'), ('Bala', '2010'), ('Chitra', '2010'), ('Dev', '2015')]:
+            self.classmates[name] = User.objects.create_user(
+                f'{name.lower()}@example.com', 'password', name=name, graduation_year=year, department='Physics'
+            )
+        for name, amount, year in [
+            ('Asha', 100, 2022),
+            ('Asha', 150, 2023),
+            ('Bala', 200, 2022),
+            ('Dev', 500, 2023),
+        ]:
+            self.give(name, amount, year)
+    
+    def give(self, name, amount, year):
+        completed_at = timezone.make_aware(datetime.datetime(year, 6, 1))
+        self.donate(amount, donor=self.classmates[name], completed_at=completed_at, created_at=completed_at)
+    
+    def cohorts(self, **params):
+        response = self.api.get('/api/analytics/cohorts/', {'start_year': 2022, 'end_year': 2023, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data['cohorts']
+    
+    def test_participation_growth_and_retention(self):
+        cohorts = self.cohorts(group_by='graduation_year')
+        
+        self.assertEqual([cohort['graduation_year'] for cohort in cohorts], ['2015', '2010'])
+        class_of_2010 = cohorts[1]
+        self.assertEqual((class_of_2010['alumni_count'], class_of_2010['donor_count']), (3, 2))
+        self.assertAlmostEqual(class_of_2010['participation_rate'], 2 / 3)
+        self.assertEqual(class_of_2010['total_donated'], 450)
+        self.assertEqual(class_of_2010['average_gift'], 150)
+        self.assertEqual(
+            [(year['year'], year['total_donated'], year['yoy_growth']) for year in class_of_2010['yearly']],
+            [(2022, 300, None), (2023, 150, -0.5)]
+        )
+        # Both donors started in 2022 and one of them gave again in 2023
+        self.assertEqual(class_of_2010['retention'], [1.0, 0.5])
+        # Dev's first gift falls in the last year, so there is nothing to retain yet
+        self.assertEqual(cohorts[0]['retention'], [1.0])
+    
+    def test_years_outside_the_period_are_left_out(self):
+        self.give('Chitra', 1000, 2021)
+        
+        cohorts = self.cohorts(group_by='graduation_year', graduation_year='2010')
+        
+        self.assertEqual(len(cohorts), 1)
+        self.assertEqual(cohorts[0]['donor_count'], 2)
+        self.assertEqual(cohorts[0]['total_donated'], 450)
+    
+    def test_grouping_by_both_keys(self):
+        self.classmates['Chitra'].department = 'History'
+        self.classmates['Chitra'].save()
+        self.give('Chitra', 50, 2023)
+        
+        cohorts = self.cohorts(graduation_year='2010')
+        
+        self.assertEqual(
+            {(cohort['department'], cohort['alumni_count'], cohort['donor_count']) for cohort in cohorts},
+            {('Physics', 2, 2), ('History', 1, 1)}
+        )
+    
+    def test_invalid_grouping_and_period_are_rejected(self):
+        for params in ({'group_by': 'campaign'}, {'start_year': 2024, 'end_year': 2023}):
+            with self.subTest(params=params):
+                response = self.api.get('/api/analytics/cohorts/', params)
+                
+                self.assertEqual(response.status_code, 400)
+    
+    def test_alumni_are_refused(self):
+        self.api.force_authenticate(self.alumnus)
+        
+        self.assertEqual(self.api.get('/api/analytics/cohorts/').status_code, 403)
+
+
+@LOCAL_SERVICES
+@mock.patch('analytics.live.publish')
+class LiveProgressTests(AnalyticsTestCase):
+    """Coalesced campaign progress events and dashboard deltas."""
+    
+    def setUp(self):
+        super().setUp()
+        # Creating the campaign already claimed its coalescing window
+        cache.clear()
+    
+    def test_donations_in_one_window_queue_one_push(self, publish):
+        with mock.patch('analytics.tasks.refresh_dashboard_snapshot.apply_async'):
+            with mock.patch('analytics.tasks.publish_campaign_progress.apply_async') as apply_async:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.donate(100)
+                    self.donate(200)
+        
+        apply_async.assert_called_once_with(
+            args=[self.campaign.pk], countdown=settings.LIVE_UPDATES_COALESCE_SECONDS
+        )
+    
+    def test_progress_includes_unfolded_donations(self, publish):
+        self.donate(100)
+        self.donate(300)
+        
+        live.publish_campaign(self.campaign.pk)
+        
+        self.assertEqual(
+            [call.args[0] for call in publish.call_args_list],
+            [live.campaign_channel(self.campaign.pk), live.ALL_CAMPAIGNS]
+        )
+        event, progress = publish.call_args.args[1:]
+        self.assertEqual(event, 'campaign.progress')
+        self.assertEqual((progress['raised'], progress['donation_count'], progress['donor_count']), (400, 2, 1))
+        self.assertEqual(progress['progress_percentage'], 0.4)
+    
+    def test_missing_campaign_publishes_nothing(self, publish):
+        live.publish_campaign(self.campaign.pk + 1)
+        
+        publish.assert_not_called()
+    
+    def test_dashboard_refresh_publishes_only_changed_figures(self, publish):
+        dashboard.refresh_snapshot(DashboardSnapshot.GLOBAL_SCOPE)
+        publish.reset_mock()
+        self.donate(250)
+        
+        dashboard.refresh_snapshot(DashboardSnapshot.GLOBAL_SCOPE)
+        
+        channel, event, delta = publish.call_args.args
+        self.assertEqual((channel, event), (live.dashboard_channel('global'), 'dashboard.delta'))
+        self.assertEqual(set(delta), {'donations', 'alumni', 'as_of'})
+        self.assertEqual(delta['donations']['total_amount'], 250)
+        self.assertEqual(delta['alumni'], {'active_donors': 1})
+        
+        publish.reset_mock()
+        dashboard.refresh_snapshot(DashboardSnapshot.GLOBAL_SCOPE)
+        publish.assert_not_called()
+    
+    def test_payload_delta_recurses_into_sections(self, publish):
+        old = {'donations': {'total': 1, 'count': 1}, 'campaigns': {'total': 2}, 'top_campaign': None}
+        new = {'donations': {'total': 5, 'count': 1}, 'campaigns': {'total': 2}, 'top_campaign': {'id': 3}}
+        
+        self.assertEqual(live.payload_delta(old, new), {'donations': {'total': 5}, 'top_campaign': {'id': 3}})
+        self.assertEqual(live.payload_delta(None, {'a': 1}), {'a': 1})
+    
+    def test_streams_refuse_missing_campaigns_and_anonymous_dashboards(self, publish):
+        self.assertEqual(self.client.get(f'/api/analytics/live/campaigns/{self.campaign.pk + 1}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/analytics/live/dashboard/').status_code, 401)
+        self.assertEqual(self.client.get('/api/analytics/live/dashboard/?token=bogus').status_code, 401)
+
+
+def slow_query():
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT pg_sleep(5)')
+        else:
+            cursor.execute(
+                'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) '
+                'SELECT count(*) FROM n'
+            )
+
+
+@LOCAL_SERVICES
+class QueryBudgetTests(AnalyticsTestCase):
+    """Statement timeouts and the stale fallback served when they fire."""
+    
+    url = '/api/analytics/cohorts/?start_year=2022&end_year=2023'
+    
+    def timed_out(self):
+        return mock.patch('analytics.views.get_cohorts', side_effect=OperationalError('interrupted'))
+    
+    def test_slow_statement_is_cancelled(self):
+        started = time.monotonic()
+        
+        with self.assertRaises(OperationalError) as raised:
+            budgets._run_with_timeout(0.05, slow_query)
+        
+        self.assertTrue(budgets._is_timeout(raised.exception))
+        self.assertLess(time.monotonic() - started, 3)
+    
+    def test_last_good_response_is_served_stale(self):
+        fresh = self.api.get(self.url)
+        
+        with self.timed_out():
+            response = self.api.get(self.url)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cohorts'], fresh.data['cohorts'])
+        self.assertTrue(response.data['is_stale'])
+        self.assertEqual(response['X-Data-Stale'], 'true')
+        self.assertEqual(response['Retry-After'], str(settings.ANALYTICS_RETRY_AFTER))
+    
+    def test_retry_is_asked_for_without_a_fallback(self):
+        self.api.get(self.url)
+        # Fallbacks are kept per user
+        self.api.force_authenticate(User.objects.create_superuser('other@example.com', 'password', name='Other'))
+        
+        with self.timed_out():
+            response = self.api.get(self.url)
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(settings.ANALYTICS_RETRY_AFTER))
+        self.assertNotIn('X-Data-Stale', response)
+    
+    def test_other_database_errors_are_raised(self):
+        with mock.patch('analytics.views.get_cohorts', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                self.api.get(self.url)
@@ -9,8 +9,13 @@ from .views import (
     donor_analytics,
     sentiment_analysis_report,
     category_breakdown,
-    export_report
+    donation_distribution,
+    cohort_analytics,
+    export_report,
+    export_job_status,
+    export_job_download
 )
+from .streams import campaign_stream, dashboard_stream
 
 app_name = 'analytics'
 
@@ -21,5 +26,12 @@ urlpatterns = [
     path('donor-analytics/', donor_analytics, name='donor-analytics'),
     path('sentiment-report/', sentiment_analysis_report, name='sentiment-report'),
     path('category-breakdown/', category_breakdown, name='category-breakdown'),
+    path('donation-distribution/', donation_distribution, name='donation-distribution'),
+    path('cohorts/', cohort_analytics, name='cohort-analytics'),
     path('export-report/', export_report, name='export-report'),
+    path('export-jobs/<uuid:job_id>/', export_job_status, name='export-job-status'),
+    path('export-jobs/<uuid:job_id>/download/', export_job_download, name='export-job-download'),
+    path('live/campaigns/', campaign_stream, name='live-campaigns'),
+    path('live/campaigns/<int:campaign_id>/', campaign_stream, name='live-campaign'),
+    path('live/dashboard/', dashboard_stream, name='live-dashboard'),
 ]
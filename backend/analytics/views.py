@@ -3,126 +3,120 @@ Views for Analytics API.
 """
 from rest_framework import permissions, status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from django.db.models import Sum, Count, Avg, Q
-from django.db.models.functions import TruncMonth, TruncWeek, TruncDay
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.pagination import PageNumberPagination
+from django.db import transaction
+from django.db.models import Sum, Count, Avg
+from django.db.models.functions import TruncMonth, TruncWeek, TruncDay, TruncYear, Length
+from django.http import FileResponse
+from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, timedelta
 
 from users.models import User
 from campaigns.models import Campaign, CampaignTestimonial
-from donations.models import Donation
+from donations.models import ArchivedDonationTotal, Donation, DonorStats
+from .models import ExportJob
+from .serializers import ExportJobCreateSerializer, ExportJobSerializer
+from .tasks import run_export_job
+from .approx import (
+    is_approx,
+    merged_donors,
+    merged_sketches,
+    sketch_series,
+    distinct_estimate,
+    percentile_estimates
+)
+from .dashboard import get_snapshot
+from .renderers import TABULAR_RENDERER_CLASSES
+from .rollups import rollup_series
+from .donors import get_donor_frame, donor_page, segment_totals
+from .cohorts import GROUPINGS, get_cohorts
+from .distribution import distribution
+from .exports import CONTENT_TYPES
+from .budgets import query_budget
+from .params import MAX_MONTHS, int_param
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def dashboard_statistics(request):
-    """Get overall dashboard statistics."""
+    """Get overall dashboard statistics from the stored snapshot."""
     
-    user = request.user
-    
-    # Admin sees all data, alumni see their own
-    if user.role == 'admin':
-        donations = Donation.objects.filter(status='completed')
-        campaigns = Campaign.objects.all()
-        alumni = User.objects.filter(role='alumni')
-    else:
-        donations = Donation.objects.filter(donor=user, status='completed')
-        campaigns = Campaign.objects.filter(created_by=user)
-        alumni = User.objects.filter(id=user.id)
-    
-    # Calculate statistics
-    total_donations = donations.aggregate(
-        total_amount=Sum('amount'),
-        count=Count('id')
-    )
-    
-    campaign_stats = campaigns.aggregate(
-        total_campaigns=Count('id'),
-        active_campaigns=Count('id', filter=Q(status='active')),
-        completed_campaigns=Count('id', filter=Q(status='completed')),
-        total_goal=Sum('goal'),
-        total_raised=Sum('raised')
-    )
-    
-    # Recent activity (last 30 days)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    recent_donations = donations.filter(completed_at__gte=thirty_days_ago)
-    recent_amount = recent_donations.aggregate(total=Sum('amount'))['total'] or 0
-    recent_count = recent_donations.count()
+    snapshot = get_snapshot(request.user)
+    data = {
+        **snapshot.payload,
+        'as_of': snapshot.as_of.isoformat(),
+        'is_stale': snapshot.is_stale
+    }
     
-    # Top campaign
-    top_campaign = campaigns.filter(status__in=['active', 'completed']).order_by('-raised').first()
+    if is_approx(request) and request.user.role == 'admin':
+        donors = merged_donors()
+        active_donors = distinct_estimate(donors)
+        data['alumni'] = {**data['alumni'], 'active_donors': active_donors['estimate']}
+        data['approximate'] = {'active_donors': active_donors}
     
-    return Response({
-        'donations': {
-            'total_amount': float(total_donations['total_amount'] or 0),
-            'total_count': total_donations['count'],
-            'recent_amount': float(recent_amount),
-            'recent_count': recent_count,
-        },
-        'campaigns': {
-            'total': campaign_stats['total_campaigns'],
-            'active': campaign_stats['active_campaigns'],
-            'completed': campaign_stats['completed_campaigns'],
-            'total_goal': float(campaign_stats['total_goal'] or 0),
-            'total_raised': float(campaign_stats['total_raised'] or 0),
-        },
-        'alumni': {
-            'total_count': alumni.count(),
-            'active_donors': donations.values('donor').distinct().count()
-        },
-        'top_campaign': {
-            'id': top_campaign.id,
-            'title': top_campaign.title,
-            'raised': float(top_campaign.raised)
-        } if top_campaign else None
-    })
+    return Response(data)
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@renderer_classes(TABULAR_RENDERER_CLASSES)
+@query_budget()
 def donation_trends(request):
     """Get donation trends over time."""
     
     user = request.user
-    period = request.GET.get('period', 'month')  # day, week, month
-    months = int(request.GET.get('months', 12))
+    period = request.GET.get('period', 'month')  # day, week, month, year
+    try:
+        months = int_param(request, 'months', 12, minimum=1, maximum=MAX_MONTHS)
+        campaign_id = int_param(request, 'campaign')
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Calculate date range
     end_date = timezone.now()
     start_date = end_date - timedelta(days=30 * months)
     
-    # Get donations
     if user.role == 'admin':
-        donations = Donation.objects.filter(
-            status='completed',
-            completed_at__gte=start_date,
-            completed_at__lte=end_date
+        # Admins read the daily rollups instead of scanning donations
+        filters = {}
+        if campaign_id is not None:
+            filters['campaign_id'] = campaign_id
+        if request.GET.get('category'):
+            filters['category'] = request.GET['category']
+        
+        trends = rollup_series(
+            timezone.localdate(start_date),
+            timezone.localdate(end_date),
+            period,
+            **filters
         )
     else:
-        donations = Donation.objects.filter(
+        donations = Donation.objects.completed_between(start_date, end_date).filter(
             donor=user,
-            status='completed',
-            completed_at__gte=start_date,
-            completed_at__lte=end_date
+            status='completed'
         )
-    
-    # Group by period
-    if period == 'day':
-        trunc_func = TruncDay('completed_at')
-    elif period == 'week':
-        trunc_func = TruncWeek('completed_at')
-    else:
-        trunc_func = TruncMonth('completed_at')
-    
-    trends = donations.annotate(
-        period=trunc_func
-    ).values('period').annotate(
-        total_amount=Sum('amount'),
-        donation_count=Count('id'),
-        avg_amount=Avg('amount')
-    ).order_by('period')
+        
+        # Group by period
+        if period == 'day':
+            trunc_func = TruncDay('completed_at')
+        elif period == 'week':
+            trunc_func = TruncWeek('completed_at')
+        elif period == 'year':
+            trunc_func = TruncYear('completed_at')
+        else:
+            trunc_func = TruncMonth('completed_at')
+        
+        trends = donations.annotate(
+            period=trunc_func
+        ).values('period').annotate(
+            total_amount=Sum('amount'),
+            donation_count=Count('id'),
+            avg_amount=Avg('amount')
+        ).order_by('period')
     
     # Format response
     trend_data = []
@@ -134,6 +128,20 @@ def donation_trends(request):
             'avg_amount': float(item['avg_amount'])
         })
     
+    if is_approx(request) and user.role == 'admin':
+        # Distinct donors and amount percentiles per period from the sketches
+        sketches = sketch_series(
+            timezone.localdate(start_date),
+            timezone.localdate(end_date),
+            period,
+            **{('campaign__category' if key == 'category' else key): value for key, value in filters.items()}
+        )
+        for item in trend_data:
+            donors, amounts = sketches.get(date.fromisoformat(item['period']), (None, None))
+            if donors is not None:
+                item['distinct_donors'] = distinct_estimate(donors)
+                item['amount_percentiles'] = percentile_estimates(amounts)
+    
     return Response({
         'period': period,
         'data': trend_data
@@ -142,6 +150,8 @@ def donation_trends(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@renderer_classes(TABULAR_RENDERER_CLASSES)
+@query_budget(5)
 def campaign_performance(request):
     """Get campaign performance metrics."""
     
@@ -152,18 +162,13 @@ def campaign_performance(request):
     else:
         campaigns = Campaign.objects.filter(created_by=user)
     
-    # Calculate performance metrics for each campaign
+    # Calculate performance metrics for each campaign from stored counters
     performance_data = []
+    today = timezone.now().date()
     
     for campaign in campaigns:
-        donations = Donation.objects.filter(campaign=campaign, status='completed')
-        
-        total_donated = donations.aggregate(total=Sum('amount'))['total'] or 0
-        donor_count = donations.values('donor').distinct().count()
-        avg_donation = donations.aggregate(avg=Avg('amount'))['avg'] or 0
-        
-        days_active = (timezone.now().date() - campaign.created_at.date()).days
-        daily_rate = float(total_donated) / max(days_active, 1)
+        days_active = (today - campaign.created_at.date()).days
+        daily_rate = float(campaign.raised) / max(days_active, 1)
         
         performance_data.append({
             'campaign_id': campaign.id,
@@ -171,14 +176,14 @@ def campaign_performance(request):
             'category': campaign.category,
             'status': campaign.status,
             'goal': float(campaign.goal),
-            'raised': float(total_donated),
+            'raised': float(campaign.raised),
             'progress_percentage': campaign.progress_percentage,
-            'donor_count': donor_count,
-            'avg_donation': float(avg_donation),
+            'donor_count': campaign.donor_count,
+            'avg_donation': float(campaign.average_donation),
             'days_active': days_active,
             'daily_donation_rate': daily_rate,
-            'update_count': campaign.updates.count(),
-            'testimonial_count': campaign.testimonials.filter(is_approved=True).count()
+            'update_count': campaign.update_count,
+            'testimonial_count': campaign.testimonial_count
         })
     
     # Sort by performance
@@ -189,77 +194,43 @@ def campaign_performance(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@query_budget(5)
 def donor_analytics(request):
-    """Get donor behavior analytics."""
+    """Get donor behavior analytics with RFM segmentation."""
     
     if request.user.role != 'admin':
         return Response({
             'error': 'Admin access required'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    # Get all donors
-    donors = User.objects.filter(role='alumni')
-    
-    # Donor segments
-    active_donors = set()
-    regular_donors = set()
-    high_value_donors = set()
-    
-    donor_data = []
-    
-    for donor in donors:
-        donations = Donation.objects.filter(donor=donor, status='completed')
-        
-        if not donations.exists():
-            continue
-        
-        total_donated = donations.aggregate(total=Sum('amount'))['total'] or 0
-        donation_count = donations.count()
-        avg_donation = total_donated / donation_count if donation_count > 0 else 0
-        
-        last_donation = donations.order_by('-completed_at').first()
-        days_since_last = (timezone.now() - last_donation.completed_at).days if last_donation else 365
-        
-        campaigns_supported = donations.values('campaign').distinct().count()
-        
-        # Categorize donors
-        if days_since_last < 90:
-            active_donors.add(donor.id)
-        
-        if donation_count >= 3:
-            regular_donors.add(donor.id)
-        
-        if total_donated > 10000:
-            high_value_donors.add(donor.id)
-        
-        donor_data.append({
-            'donor_id': donor.id,
-            'donor_name': donor.name,
-            'total_donated': float(total_donated),
-            'donation_count': donation_count,
-            'avg_donation': float(avg_donation),
-            'campaigns_supported': campaigns_supported,
-            'days_since_last_donation': days_since_last,
-            'is_active': days_since_last < 90,
-            'is_regular': donation_count >= 3,
-            'is_high_value': total_donated > 10000
-        })
-    
-    # Sort by total donated
-    donor_data.sort(key=lambda x: x['total_donated'], reverse=True)
+    frame = get_donor_frame(refresh=request.GET.get('refresh') == '1')
+    
+    try:
+        page = donor_page(
+            frame,
+            ordering=request.GET.get('ordering', '-total_donated'),
+            segment=request.GET.get('segment'),
+            min_total=float(request.GET['min_total']) if request.GET.get('min_total') else None,
+            max_total=float(request.GET['max_total']) if request.GET.get('max_total') else None,
+            search=request.GET.get('search'),
+            cursor=request.GET.get('cursor'),
+            limit=int_param(request, 'limit', 50)
+        )
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     return Response({
-        'total_donors': len(donor_data),
-        'active_donors': len(active_donors),
-        'regular_donors': len(regular_donors),
-        'high_value_donors': len(high_value_donors),
-        'top_donors': donor_data[:20],  # Top 20 donors
-        'all_donors': donor_data
+        **segment_totals(frame),
+        'top_donors': donor_page(frame, limit=20)['results'],
+        'donors': page
     })
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@query_budget()
 def sentiment_analysis_report(request):
     """Get sentiment analysis report for testimonials."""
     
@@ -269,66 +240,60 @@ def sentiment_analysis_report(request):
         testimonials = CampaignTestimonial.objects.filter(is_approved=True)
     else:
         # Get testimonials for user's campaigns
-        user_campaigns = Campaign.objects.filter(created_by=user)
         testimonials = CampaignTestimonial.objects.filter(
-            campaign__in=user_campaigns,
+            campaign__created_by=user,
             is_approved=True
         )
     
-    # Analyze sentiment (using simple keyword-based approach)
-    positive_count = 0
-    neutral_count = 0
-    negative_count = 0
-    
-    positive_keywords = ['great', 'excellent', 'amazing', 'wonderful', 'thank', 'grateful', 'love', 'best']
-    negative_keywords = ['bad', 'poor', 'disappointing', 'waste', 'unfortunate', 'issue', 'problem']
-    
-    testimonial_data = []
-    
-    for testimonial in testimonials:
-        message_lower = testimonial.message.lower()
-        
-        positive_score = sum(1 for word in positive_keywords if word in message_lower)
-        negative_score = sum(1 for word in negative_keywords if word in message_lower)
-        
-        if positive_score > negative_score:
-            sentiment = 'positive'
-            positive_count += 1
-        elif negative_score > positive_score:
-            sentiment = 'negative'
-            negative_count += 1
-        else:
-            sentiment = 'neutral'
-            neutral_count += 1
-        
-        testimonial_data.append({
-            'campaign_id': testimonial.campaign.id,
-            'campaign_title': testimonial.campaign.title,
-            'donor_name': testimonial.donor.name,
-            'rating': testimonial.rating,
-            'sentiment': sentiment,
-            'message_length': len(testimonial.message),
-            'created_at': testimonial.created_at.isoformat()
-        })
-    
-    total = len(testimonial_data)
+    # Sentiment is stored at write time, so the distribution is one GROUP BY
+    distribution = {'positive': 0, 'neutral': 0, 'negative': 0, 'pending': 0}
+    for item in testimonials.values('sentiment').annotate(count=Count('id')).order_by():
+        distribution[item['sentiment'] or 'pending'] += item['count']
+    
+    total = sum(distribution.values())
+    analyzed = total - distribution['pending']
+    
+    details = testimonials.annotate(
+        message_length=Length('message')
+    ).values(
+        'campaign_id', 'campaign__title', 'donor__name', 'rating', 'sentiment',
+        'sentiment_score', 'quality_score', 'message_length', 'created_at'
+    ).order_by('-created_at', '-id')
+    
+    paginator = PageNumberPagination()
+    page = paginator.paginate_queryset(details, request)
+    
+    testimonial_data = [
+        {
+            'campaign_id': item['campaign_id'],
+            'campaign_title': item['campaign__title'],
+            'donor_name': item['donor__name'],
+            'rating': item['rating'],
+            'sentiment': item['sentiment'] or 'pending',
+            'sentiment_score': item['sentiment_score'],
+            'quality_score': item['quality_score'],
+            'message_length': item['message_length'],
+            'created_at': item['created_at'].isoformat()
+        }
+        for item in page
+    ]
     
     return Response({
         'total_testimonials': total,
         'sentiment_distribution': {
-            'positive': positive_count,
-            'neutral': neutral_count,
-            'negative': negative_count,
-            'positive_percentage': (positive_count / total * 100) if total > 0 else 0,
-            'neutral_percentage': (neutral_count / total * 100) if total > 0 else 0,
-            'negative_percentage': (negative_count / total * 100) if total > 0 else 0,
+            **distribution,
+            'positive_percentage': (distribution['positive'] / analyzed * 100) if analyzed > 0 else 0,
+            'neutral_percentage': (distribution['neutral'] / analyzed * 100) if analyzed > 0 else 0,
+            'negative_percentage': (distribution['negative'] / analyzed * 100) if analyzed > 0 else 0,
         },
-        'testimonials': testimonial_data
+        'testimonials': paginator.get_paginated_response(testimonial_data).data
     })
 
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@renderer_classes(TABULAR_RENDERER_CLASSES)
+@query_budget()
 def category_breakdown(request):
     """Get breakdown of campaigns and donations by category."""
     
@@ -344,26 +309,18 @@ def category_breakdown(request):
         campaign_count=Count('id'),
         total_goal=Sum('goal'),
         total_raised=Sum('raised'),
+        donation_count=Sum('donation_count'),
         avg_progress=Avg('raised') * 100 / Avg('goal')
     ).order_by('-total_raised')
     
-    # Get donation count per category
     result = []
     for item in category_data:
-        category = item['category']
-        category_campaigns = campaigns.filter(category=category)
-        
-        donation_count = Donation.objects.filter(
-            campaign__in=category_campaigns,
-            status='completed'
-        ).count()
-        
         result.append({
-            'category': category,
+            'category': item['category'],
             'campaign_count': item['campaign_count'],
             'total_goal': float(item['total_goal'] or 0),
             'total_raised': float(item['total_raised'] or 0),
-            'donation_count': donation_count,
+            'donation_count': item['donation_count'] or 0,
             'avg_progress': float(item['avg_progress'] or 0)
         })
     
@@ -372,31 +329,159 @@ def category_breakdown(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@query_budget()
+def donation_distribution(request):
+    """Get distinct donors, amount percentiles and a histogram of donations."""
+    
+    if request.user.role != 'admin':
+        return Response({
+            'error': 'Admin access required'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        months = int_param(request, 'months', 12, minimum=1, maximum=MAX_MONTHS)
+        # Both histogram paths need at least one bucket
+        bins = int_param(request, 'bins', 10, minimum=1, maximum=100)
+        campaign_id = int_param(request, 'campaign')
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    end_date = timezone.localdate()
+    start_date = end_date - timedelta(days=30 * months)
+    
+    if is_approx(request):
+        filters = {'campaign_id': campaign_id} if campaign_id is not None else {}
+        donors, amounts = merged_sketches(start_date, end_date, **filters)
+        
+        return Response({
+            'approximate': True,
+            'donation_count': round(amounts.total),
+            'distinct_donors': distinct_estimate(donors),
+            'percentiles': percentile_estimates(amounts),
+            'histogram': amounts.histogram(bins)
+        })
+    
+    donations = Donation.objects.completed_between(start_date, end_date + timedelta(days=1)).filter(
+        status='completed'
+    )
+    if campaign_id is not None:
+        donations = donations.filter(campaign_id=campaign_id)
+    
+    return Response({'approximate': False, **distribution(donations, bins)})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@query_budget()
+def cohort_analytics(request):
+    """Get participation, retention, average gift and growth per alumni cohort."""
+    
+    if request.user.role != 'admin':
+        return Response({
+            'error': 'Admin access required'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    group_by = request.GET.get('group_by', 'both')
+    if group_by not in GROUPINGS:
+        return Response({
+            'error': f'group_by must be one of: {", ".join(GROUPINGS)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        end_year = int_param(request, 'end_year', timezone.localdate().year)
+        start_year = int_param(request, 'start_year', end_year - 4)
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if start_year > end_year:
+        return Response({
+            'error': 'start_year must not be after end_year'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    cohorts = get_cohorts(start_year, end_year, group_by)
+    
+    graduation_year = request.GET.get('graduation_year')
+    department = request.GET.get('department')
+    if graduation_year:
+        cohorts = [cohort for cohort in cohorts if cohort.get('graduation_year') == graduation_year]
+    if department:
+        cohorts = [cohort for cohort in cohorts if cohort.get('department') == department]
+    
+    return Response({
+        'group_by': group_by,
+        'start_year': start_year,
+        'end_year': end_year,
+        'cohorts': cohorts
+    })
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([permissions.IsAuthenticated])
 def export_report(request):
-    """Export comprehensive analytics report."""
+    """
+    Export analytics report.
+    
+    GET returns the summary report inline. POST submits a background
+    export job for the donations, campaigns or donors report.
+    """
     
     if request.user.role != 'admin':
         return Response({
             'error': 'Admin access required'
         }, status=status.HTTP_403_FORBIDDEN)
     
+    if request.method == 'POST':
+        serializer = ExportJobCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save(requested_by=request.user)
+        
+        transaction.on_commit(lambda: run_export_job.delay(str(job.id)))
+        
+        return Response({
+            **ExportJobSerializer(job, context={'request': request}).data,
+            'status_url': request.build_absolute_uri(
+                reverse('analytics:export-job-status', args=[job.id])
+            )
+        }, status=status.HTTP_202_ACCEPTED)
+    
     report_type = request.GET.get('type', 'summary')
     
+    if report_type != 'summary':
+        return Response({
+            'error': f'The {report_type} report is exported asynchronously; submit it with POST'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
     # Generate comprehensive report
     total_donations = Donation.objects.filter(status='completed')
+    archived_donations = ArchivedDonationTotal.objects.filter(donation_count__gt=0)
     total_campaigns = Campaign.objects.all()
     total_alumni = User.objects.filter(role='alumni')
     
+    if is_approx(request):
+        donors = merged_donors()
+        active_donors = distinct_estimate(donors)['estimate']
+    else:
+        active_donors = total_donations.values('donor').order_by().union(
+            archived_donations.values('donor').order_by()
+        ).count()
+    
+    donation_totals = total_donations.aggregate(amount=Sum('amount'), count=Count('id'))
+    archived_totals = archived_donations.aggregate(amount=Sum('total_amount'), count=Sum('donation_count'))
+    
     report = {
         'generated_at': timezone.now().isoformat(),
         'report_type': report_type,
         'summary': {
-            'total_donations_amount': float(total_donations.aggregate(total=Sum('amount'))['total'] or 0),
-            'total_donation_count': total_donations.count(),
+            'total_donations_amount': float((donation_totals['amount'] or 0) + (archived_totals['amount'] or 0)),
+            'total_donation_count': donation_totals['count'] + (archived_totals['count'] or 0),
             'total_campaigns': total_campaigns.count(),
             'active_campaigns': total_campaigns.filter(status='active').count(),
             'total_alumni': total_alumni.count(),
-            'active_donors': total_donations.values('donor').distinct().count()
+            'active_donors': active_donors
         },
         'top_campaigns': [],
         'top_donors': [],
@@ -413,17 +498,65 @@ def export_report(request):
             'progress': campaign.progress_percentage
         })
     
-    # Top donors
-    donor_totals = total_donations.values('donor__id', 'donor__name').annotate(
-        total=Sum('amount'),
-        count=Count('id')
-    ).order_by('-total')[:10]
+    # Top donors; DonorStats also covers archived donations
+    top_donors = DonorStats.objects.filter(donation_count__gt=0).select_related('donor').order_by('-total_amount')[:10]
     
-    for donor in donor_totals:
+    for stats in top_donors:
         report['top_donors'].append({
-            'name': donor['donor__name'],
-            'total_donated': float(donor['total']),
-            'donation_count': donor['count']
+            'name': stats.donor.name,
+            'total_donated': float(stats.total_amount),
+            'donation_count': stats.donation_count
         })
     
     return Response(report)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_job_status(request, job_id):
+    """Get progress and download link for an export job."""
+    
+    try:
+        job = ExportJob.objects.get(id=job_id)
+    except ExportJob.DoesNotExist:
+        return Response({
+            'error': 'Export job not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    if request.user.role != 'admin' and job.requested_by_id != request.user.id:
+        return Response({
+            'error': 'Permission denied'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    return Response(ExportJobSerializer(job, context={'request': request}).data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_job_download(request, job_id):
+    """Download a completed export job's file."""
+    
+    try:
+        job = ExportJob.objects.get(id=job_id)
+    except ExportJob.DoesNotExist:
+        return Response({
+            'error': 'Export job not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    # Exports hold donor names and emails; only admins and the requester may read them
+    if request.user.role != 'admin' and not request.user.is_staff and job.requested_by_id != request.user.id:
+        return Response({
+            'error': 'Permission denied'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    if job.status != 'completed' or not job.file:
+        return Response({
+            'error': 'Export is not ready'
+        }, status=status.HTTP_409_CONFLICT)
+    
+    return FileResponse(
+        job.file.open('rb'),
+        as_attachment=True,
+        filename=job.file.name,
+        content_type=CONTENT_TYPES[job.export_format]
+    )
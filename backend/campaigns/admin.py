@@ -3,6 +3,7 @@ Admin configuration for Campaigns app.
 """
 from django.contrib import admin
 from .models import Campaign, CampaignUpdate, CampaignTestimonial
+from .counters import refresh_counters
 
 
 @admin.register(Campaign)
@@ -12,7 +13,7 @@ class CampaignAdmin(admin.ModelAdmin):
     list_display = ('title', 'category', 'goal', 'raised', 'progress_percentage', 'deadline', 'status', 'created_at')
     list_filter = ('status', 'category', 'deadline')
     search_fields = ('title', 'description')
-    readonly_fields = ('raised', 'created_at', 'updated_at', 'progress_percentage')
+    readonly_fields = ('raised', 'created_at', 'updated_at', 'progress_percentage') + Campaign.COUNTER_FIELDS
     date_hierarchy = 'created_at'
     
     fieldsets = (
@@ -25,6 +26,9 @@ class CampaignAdmin(admin.ModelAdmin):
         ('Status & Timeline', {
             'fields': ('status', 'deadline')
         }),
+        ('Engagement', {
+            'fields': Campaign.COUNTER_FIELDS
+        }),
         ('Metadata', {
             'fields': ('created_by', 'created_at', 'updated_at')
         }),
@@ -53,8 +57,10 @@ class CampaignTestimonialAdmin(admin.ModelAdmin):
     
     def approve_testimonials(self, request, queryset):
         queryset.update(is_approved=True)
+        refresh_counters(queryset.values_list('campaign_id', flat=True).distinct())
     approve_testimonials.short_description = "Approve selected testimonials"
     
     def reject_testimonials(self, request, queryset):
         queryset.update(is_approved=False)
+        refresh_counters(queryset.values_list('campaign_id', flat=True).distinct())
     reject_testimonials.short_description = "Reject selected testimonials"
@@ -0,0 +1,292 @@
+"""
+Denormalized campaign engagement counters.
+
+Write paths adjust the counters with single UPDATE statements inside the
+writing transaction, so list and analytics endpoints can read them
+straight off the campaign row.
+
+Completed donations are the hot path: they increment (and refunds
+decrement) one of SHARD_COUNT counter shards with database-side
+arithmetic instead of the campaign row, so concurrent donations to one
+campaign do not serialize on its lock.
+fold_shards() moves the shard totals into ``raised``, ``donation_count``,
+``donor_count`` and ``average_donation``; only the periodic task calls it.
+Request paths add the unfolded totals on read with pending_totals().
+
+Whether a donation is its donor's first (or a refund their last) for the
+campaign is decided on the donor's ``CampaignDonor`` row, which is locked
+for the duration, so ``donor_count`` stays exact under concurrent
+donations from the same donor.
+
+Every path takes its locks in the same order, so they cannot deadlock:
+``CampaignDonor`` rows, then counter shards, then the campaign row.
+"""
+import random
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    Avg, Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+)
+from django.db.models.functions import Coalesce, NullIf
+
+from .models import Campaign, CampaignCounterShard, CampaignDonor, CampaignUpdate, CampaignTestimonial
+
+SHARD_COUNT = 8
+
+
+def _ensure_shards(campaign_ids):
+    """Create any missing shard rows so increments never need an INSERT."""
+    
+    CampaignCounterShard.objects.bulk_create(
+        [
+            CampaignCounterShard(campaign_id=campaign_id, shard=shard)
+            for campaign_id in campaign_ids
+            for shard in range(SHARD_COUNT)
+        ],
+        ignore_conflicts=True
+    )
+
+
+def _adjust_donor(donation, delta):
+    """
+    Add ``delta`` to the donor's completed donation count for the campaign.
+    
+    Returns:
+        The count before the adjustment
+    """
+    
+    with transaction.atomic():
+        # get_or_create retries the lookup if a concurrent first donation inserted the row
+        member, created = CampaignDonor.objects.select_for_update().get_or_create(
+            campaign_id=donation.campaign_id,
+            donor_id=donation.donor_id
+        )
+        previous = member.donation_count
+        CampaignDonor.objects.filter(pk=member.pk).update(donation_count=max(previous + delta, 0))
+        return previous
+
+
+def record_completed_donation(donation):
+    """Count a newly completed donation against a random shard of its campaign."""
+    
+    is_new_donor = _adjust_donor(donation, 1) == 0
+    
+    shard = CampaignCounterShard.objects.filter(
+        campaign_id=donation.campaign_id,
+        shard=random.randrange(SHARD_COUNT)
+    )
+    increments = {
+        'amount': F('amount') + donation.amount,
+        'donation_count': F('donation_count') + 1,
+        'donor_count': F('donor_count') + int(is_new_donor),
+    }
+    
+    if not shard.update(**increments):
+        _ensure_shards([donation.campaign_id])
+        shard.update(**increments)
+
+
+def record_refunded_donation(donation):
+    """Take a refunded donation back out of its campaign's counters via a random shard."""
+    
+    was_only_donation = _adjust_donor(donation, -1) == 1
+    
+    shard = CampaignCounterShard.objects.filter(
+        campaign_id=donation.campaign_id,
+        shard=random.randrange(SHARD_COUNT)
+    )
+    decrements = {
+        'amount': F('amount') - donation.amount,
+        'donation_count': F('donation_count') - 1,
+        'donor_count': F('donor_count') - int(was_only_donation),
+    }
+    
+    if not shard.update(**decrements):
+        _ensure_shards([donation.campaign_id])
+        shard.update(**decrements)
+
+
+def record_imported_donations(donations):
+    """Apply one raised delta per campaign for bulk-imported donations and recount."""
+    
+    totals = {}
+    for donation in donations:
+        totals[donation.campaign_id] = totals.get(donation.campaign_id, Decimal(0)) + donation.amount
+    
+    refresh_counters(list(totals))
+    
+    # After the recount, which locks the shards before the campaign rows
+    for campaign_id, amount in totals.items():
+        Campaign.objects.filter(pk=campaign_id).update(raised=F('raised') + amount)
+
+
+def fold_shards(campaign_ids=None):
+    """
+    Move pending shard totals into their campaigns.
+    
+    Shards locked by in-flight donations are skipped and picked up by the
+    next fold, so folding never waits on the donation path.
+    
+    Args:
+        campaign_ids: Restrict the fold to these campaigns (all if None)
+    
+    Returns:
+        Number of campaigns updated
+    """
+    
+    with transaction.atomic():
+        shards = CampaignCounterShard.objects.select_for_update(skip_locked=True).exclude(
+            amount=0, donation_count=0, donor_count=0
+        )
+        if campaign_ids is not None:
+            shards = shards.filter(campaign_id__in=campaign_ids)
+        
+        pending = {}
+        shard_ids = []
+        for shard_id, campaign_id, amount, donations, donors in shards.values_list(
+            'pk', 'campaign_id', 'amount', 'donation_count', 'donor_count'
+        ):
+            shard_ids.append(shard_id)
+            totals = pending.setdefault(campaign_id, [Decimal(0), 0, 0])
+            totals[0] += amount
+            totals[1] += donations
+            totals[2] += donors
+        
+        if not shard_ids:
+            return 0
+        
+        CampaignCounterShard.objects.filter(pk__in=shard_ids).update(amount=0, donation_count=0, donor_count=0)
+        
+        for campaign_id, (amount, donations, donors) in pending.items():
+            average = F('average_donation')
+            if donations:
+                # Refunds can take the count back to zero
+                average = Coalesce(
+                    ExpressionWrapper(
+                        (F('average_donation') * F('donation_count') + amount)
+                        / NullIf(F('donation_count') + donations, 0),
+                        output_field=DecimalField(max_digits=12, decimal_places=2)
+                    ),
+                    Value(0),
+                    output_field=DecimalField(max_digits=12, decimal_places=2)
+                )
+            
+            Campaign.objects.filter(pk=campaign_id).update(
+                raised=F('raised') + amount,
+                average_donation=average,
+                donation_count=F('donation_count') + donations,
+                donor_count=F('donor_count') + donors,
+            )
+        
+        return len(pending)
+
+
+def pending_totals(campaign_id):
+    """
+    Shard (amount, donation count, donor count) not yet folded into the
+    campaign, read without locking.
+    """
+    
+    totals = CampaignCounterShard.objects.filter(campaign_id=campaign_id).aggregate(
+        amount=Sum('amount'), donations=Sum('donation_count'), donors=Sum('donor_count')
+    )
+    return totals['amount'] or Decimal(0), totals['donations'] or 0, totals['donors'] or 0
+
+
+def with_pending_totals(campaign):
+    """
+    Add unfolded shard totals to ``campaign``'s counters in memory.
+    
+    For responses only: the instance must not be saved afterwards.
+    """
+    
+    amount, donations, donors = pending_totals(campaign.pk)
+    if amount or donations or donors:
+        count = campaign.donation_count + donations
+        campaign.average_donation = (
+            round((campaign.average_donation * campaign.donation_count + amount) / count, 2) if count else Decimal(0)
+        )
+        campaign.raised += amount
+        campaign.donation_count = count
+        campaign.donor_count += donors
+    return campaign
+
+
+def adjust_update_count(campaign_id, delta):
+    """Add ``delta`` to a campaign's update_count."""
+    Campaign.objects.filter(pk=campaign_id).update(update_count=F('update_count') + delta)
+
+
+def adjust_testimonial_count(campaign_id, delta):
+    """Add ``delta`` to a campaign's approved testimonial_count."""
+    Campaign.objects.filter(pk=campaign_id).update(testimonial_count=F('testimonial_count') + delta)
+
+
+def _count_subquery(queryset, expression):
+    return Coalesce(
+        Subquery(
+            queryset.values('campaign').annotate(value=expression).values('value')[:1]
+        ),
+        Value(0)
+    )
+
+
+def refresh_counters(campaign_ids=None):
+    """
+    Recompute counters from the source tables in one UPDATE.
+    
+    Args:
+        campaign_ids: Restrict the refresh to these campaigns (all if None)
+    
+    Returns:
+        Number of campaigns updated
+    """
+    
+    from donations.models import Donation
+    
+    completed = Donation.objects.filter(campaign=OuterRef('pk'), status='completed').order_by()
+    updates = CampaignUpdate.objects.filter(campaign=OuterRef('pk')).order_by()
+    testimonials = CampaignTestimonial.objects.filter(campaign=OuterRef('pk'), is_approved=True).order_by()
+    
+    # Archived campaigns no longer have donations to count; their counters are final
+    campaigns = Campaign.objects.filter(archived_at__isnull=True)
+    if campaign_ids is not None:
+        campaigns = campaigns.filter(pk__in=campaign_ids)
+    
+    with transaction.atomic():
+        # Rebuild the per-donor rows the live counts are decided on, covering
+        # donations that did not go through record_completed_donation (imports).
+        # They are locked before the shards, like the donation path does
+        members = CampaignDonor.objects.filter(campaign__in=campaigns)
+        list(members.select_for_update().values_list('pk', flat=True))
+        members.delete()
+        CampaignDonor.objects.bulk_create(
+            [
+                CampaignDonor(campaign_id=campaign_id, donor_id=donor_id, donation_count=count)
+                for campaign_id, donor_id, count in Donation.objects.filter(
+                    campaign__in=campaigns, status='completed'
+                ).values('campaign', 'donor').annotate(count=Count('id')).values_list(
+                    'campaign', 'donor', 'count'
+                ).order_by()
+            ],
+            batch_size=5000
+        )
+        
+        # Pending shard counts are included in the recount; lock and clear them
+        _ensure_shards(campaigns.values_list('pk', flat=True))
+        shards = CampaignCounterShard.objects.filter(campaign__in=campaigns)
+        list(shards.select_for_update().values_list('pk', flat=True))
+        shards.update(donation_count=0, donor_count=0)
+        
+        return campaigns.update(
+            donor_count=_count_subquery(completed, Count('donor', distinct=True)),
+            donation_count=_count_subquery(completed, Count('id')),
+            average_donation=Coalesce(
+                Subquery(completed.values('campaign').annotate(value=Avg('amount')).values('value')[:1]),
+                Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            ),
+            update_count=_count_subquery(updates, Count('id')),
+            testimonial_count=_count_subquery(testimonials, Count('id')),
+        )
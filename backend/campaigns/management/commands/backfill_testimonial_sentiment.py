@@ -0,0 +1,40 @@
+"""
+Compute stored sentiment for testimonials that have not been analyzed.
+"""
+from django.core.management.base import BaseCommand
+
+from campaigns.models import CampaignTestimonial
+from campaigns.tasks import score_testimonial
+
+
+class Command(BaseCommand):
+    help = 'Compute sentiment, subjectivity and quality scores for testimonials'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-analyze testimonials that already have scores')
+        parser.add_argument('--batch-size', type=int, default=500)
+    
+    def handle(self, *args, **options):
+        testimonials = CampaignTestimonial.objects.only('id', 'message').order_by('id')
+        if not options['all']:
+            testimonials = testimonials.filter(analyzed_at__isnull=True)
+        
+        fields = ['sentiment', 'sentiment_score', 'subjectivity', 'quality_score', 'analyzed_at']
+        batch = []
+        total = 0
+        
+        for testimonial in testimonials.iterator(chunk_size=options['batch_size']):
+            for field, value in score_testimonial(testimonial.message).items():
+                setattr(testimonial, field, value)
+            batch.append(testimonial)
+            
+            if len(batch) >= options['batch_size']:
+                CampaignTestimonial.objects.bulk_update(batch, fields)
+                total += len(batch)
+                batch = []
+        
+        if batch:
+            CampaignTestimonial.objects.bulk_update(batch, fields)
+            total += len(batch)
+        
+        self.stdout.write(self.style.SUCCESS(f'Analyzed {total} testimonials'))
@@ -0,0 +1,18 @@
+"""
+Recompute denormalized campaign counters from source tables.
+"""
+from django.core.management.base import BaseCommand
+
+from campaigns.counters import fold_shards, refresh_counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute donor, donation, update and testimonial counters for campaigns'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_ids', nargs='*', type=int)
+    
+    def handle(self, *args, **options):
+        fold_shards(options['campaign_ids'] or None)
+        count = refresh_counters(options['campaign_ids'] or None)
+        self.stdout.write(self.style.SUCCESS(f'Refreshed counters for {count} campaigns'))
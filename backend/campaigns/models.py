@@ -1,7 +1,7 @@
 """
 Models for Campaigns.
 """
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from users.models import User
 
@@ -37,9 +37,21 @@ class Campaign(models.Model):
     image = models.ImageField(upload_to='campaigns/', blank=True, null=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_campaigns')
     
+    # Engagement counters (maintained by campaigns.counters)
+    donor_count = models.PositiveIntegerField(default=0)
+    donation_count = models.PositiveIntegerField(default=0)
+    update_count = models.PositiveIntegerField(default=0)
+    testimonial_count = models.PositiveIntegerField(default=0)
+    average_donation = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    # Set once the campaign's donations have been moved to the Parquet archive
+    archived_at = models.DateTimeField(null=True, blank=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    COUNTER_FIELDS = ('donor_count', 'donation_count', 'update_count', 'testimonial_count', 'average_donation')
+    
     class Meta:
         db_table = 'campaigns'
         ordering = ['-created_at']
@@ -51,6 +63,15 @@ class Campaign(models.Model):
     def __str__(self):
         return self.title
     
+    def save(self, *args, **kwargs):
+        # Counters and raised are updated in place; never overwrite them from a stale instance
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS + ('raised',)
+            ]
+        super().save(*args, **kwargs)
+    
     @property
     def progress_percentage(self):
         """Calculate progress percentage."""
@@ -62,11 +83,51 @@ class Campaign(models.Model):
     def is_active(self):
         """Check if campaign is active and not expired."""
         return self.status == 'active' and self.deadline >= timezone.now().date()
+
+
+class CampaignCounterShard(models.Model):
+    """
+    One of several partial counters for a campaign.
+    
+    Completed donations add to a random shard so concurrent donations to
+    the same campaign rarely contend for a row lock. The shards are folded
+    into the campaign's raised amount and counters periodically and on
+    read (see campaigns.counters).
+    """
+    
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='counter_shards')
+    shard = models.PositiveSmallIntegerField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    donation_count = models.IntegerField(default=0)
+    donor_count = models.IntegerField(default=0)
     
-    @property
-    def donor_count(self):
-        """Get total number of donors."""
-        return self.donations.values('donor').distinct().count()
+    class Meta:
+        db_table = 'campaign_counter_shards'
+        unique_together = ['campaign', 'shard']
+    
+    def __str__(self):
+        return f"{self.campaign.title} shard {self.shard}: ₹{self.amount}"
+
+
+class CampaignDonor(models.Model):
+    """
+    A donor's completed donation count for one campaign.
+    
+    The unique (campaign, donor) row decides whether a completed donation
+    is the donor's first and a refund their last, so concurrent donations
+    from the same donor cannot both count towards ``donor_count``.
+    """
+    
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='+')
+    donor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    donation_count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'campaign_donors'
+        unique_together = ['campaign', 'donor']
+    
+    def __str__(self):
+        return f"{self.campaign_id} - {self.donor_id} ({self.donation_count})"
 
 
 class CampaignUpdate(models.Model):
@@ -84,11 +145,22 @@ class CampaignUpdate(models.Model):
     
     def __str__(self):
         return f"{self.campaign.title} - {self.title}"
+    
+    def save(self, *args, **kwargs):
+        # Keep the campaign's update_count in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 
 class CampaignTestimonial(models.Model):
     """Campaign testimonial/review model."""
     
+    SENTIMENT_CHOICES = (
+        ('positive', 'Positive'),
+        ('neutral', 'Neutral'),
+        ('negative', 'Negative'),
+    )
+    
     campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='testimonials')
     donor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='testimonials')
     message = models.TextField()
@@ -96,10 +168,42 @@ class CampaignTestimonial(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_approved = models.BooleanField(default=True)
     
+    # Sentiment (computed in the background by campaigns.tasks)
+    sentiment = models.CharField(max_length=10, choices=SENTIMENT_CHOICES, blank=True)
+    sentiment_score = models.FloatField(null=True, blank=True)
+    subjectivity = models.FloatField(null=True, blank=True)
+    quality_score = models.PositiveSmallIntegerField(null=True, blank=True)
+    analyzed_at = models.DateTimeField(null=True, blank=True)
+    
     class Meta:
         db_table = 'campaign_testimonials'
         ordering = ['-created_at']
         unique_together = ['campaign', 'donor']
+        indexes = [
+            models.Index(fields=['is_approved', 'sentiment']),
+        ]
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Approval state and message as last read from / written to the database
+        self._saved_is_approved = self.__dict__.get('is_approved') if self.pk else None
+        self._saved_message = self.__dict__.get('message') if self.pk else None
     
     def __str__(self):
         return f"{self.donor.name} - {self.campaign.title}"
+    
+    def save(self, *args, **kwargs):
+        # Stale scores are cleared until the background analysis catches up
+        self._message_changed = self.message != self._saved_message
+        if self._message_changed:
+            self.sentiment = ''
+            self.sentiment_score = None
+            self.subjectivity = None
+            self.quality_score = None
+            self.analyzed_at = None
+        
+        # Keep the campaign's testimonial_count in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._saved_is_approved = self.is_approved
+        self._saved_message = self.message
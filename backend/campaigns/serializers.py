@@ -10,7 +10,6 @@ class CampaignSerializer(serializers.ModelSerializer):
     """Serializer for Campaign."""
     
     progress_percentage = serializers.ReadOnlyField()
-    donor_count = serializers.ReadOnlyField()
     created_by = UserProfileSerializer(read_only=True)
     
     class Meta:
@@ -18,16 +17,16 @@ class CampaignSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'title', 'description', 'category', 'goal', 'raised',
             'deadline', 'status', 'image', 'progress_percentage',
-            'donor_count', 'created_by', 'created_at', 'updated_at'
+            'donor_count', 'donation_count', 'update_count', 'testimonial_count',
+            'average_donation', 'created_by', 'created_at', 'updated_at'
         )
-        read_only_fields = ('id', 'raised', 'created_at', 'updated_at')
+        read_only_fields = ('id', 'raised', 'created_at', 'updated_at') + Campaign.COUNTER_FIELDS
 
 
 class CampaignListSerializer(serializers.ModelSerializer):
     """Serializer for Campaign list (minimal fields)."""
     
     progress_percentage = serializers.ReadOnlyField()
-    donor_count = serializers.ReadOnlyField()
     
     class Meta:
         model = Campaign
@@ -36,6 +35,7 @@ class CampaignListSerializer(serializers.ModelSerializer):
             'deadline', 'status', 'image', 'progress_percentage',
             'donor_count', 'created_at'
         )
+        read_only_fields = ('donor_count',)
 
 
 class CampaignUpdateSerializer(serializers.ModelSerializer):
@@ -56,5 +56,8 @@ class CampaignTestimonialSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = CampaignTestimonial
-        fields = ('id', 'campaign', 'donor', 'message', 'rating', 'created_at', 'is_approved')
-        read_only_fields = ('id', 'created_at', 'is_approved')
+        fields = (
+            'id', 'campaign', 'donor', 'message', 'rating', 'created_at', 'is_approved',
+            'sentiment', 'sentiment_score', 'quality_score'
+        )
+        read_only_fields = ('id', 'created_at', 'is_approved', 'sentiment', 'sentiment_score', 'quality_score')
@@ -0,0 +1,56 @@
+"""
+Signal receivers maintaining campaign counters and testimonial sentiment.
+"""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from donations.signals import donation_completed, donation_refunded, donations_imported
+from .models import CampaignUpdate, CampaignTestimonial
+from .tasks import analyze_testimonial_sentiment
+from . import counters
+
+
+@receiver(donation_completed)
+def count_completed_donation(sender, donation, **kwargs):
+    counters.record_completed_donation(donation)
+
+
+@receiver(donations_imported)
+def count_imported_donations(sender, donations, **kwargs):
+    counters.record_imported_donations(donations)
+
+
+@receiver(donation_refunded)
+def uncount_refunded_donation(sender, donation, **kwargs):
+    counters.record_refunded_donation(donation)
+
+
+@receiver(post_save, sender=CampaignUpdate)
+def count_campaign_update(sender, instance, created, **kwargs):
+    if created:
+        counters.adjust_update_count(instance.campaign_id, 1)
+
+
+@receiver(post_delete, sender=CampaignUpdate)
+def uncount_campaign_update(sender, instance, **kwargs):
+    counters.adjust_update_count(instance.campaign_id, -1)
+
+
+@receiver(post_save, sender=CampaignTestimonial)
+def count_testimonial(sender, instance, created, **kwargs):
+    was_approved = bool(instance._saved_is_approved) and not created
+    if instance.is_approved != was_approved:
+        counters.adjust_testimonial_count(instance.campaign_id, 1 if instance.is_approved else -1)
+
+
+@receiver(post_save, sender=CampaignTestimonial)
+def queue_testimonial_sentiment(sender, instance, **kwargs):
+    if getattr(instance, '_message_changed', False):
+        transaction.on_commit(lambda: analyze_testimonial_sentiment.delay(instance.pk))
+
+
+@receiver(post_delete, sender=CampaignTestimonial)
+def uncount_testimonial(sender, instance, **kwargs):
+    if instance.is_approved:
+        counters.adjust_testimonial_count(instance.campaign_id, -1)
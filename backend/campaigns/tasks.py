@@ -0,0 +1,52 @@
+"""
+Background tasks for Campaigns.
+"""
+from celery import shared_task
+from django.utils import timezone
+
+from .counters import fold_shards
+from .models import CampaignTestimonial
+
+
+def score_testimonial(message):
+    """
+    Compute the stored sentiment fields for a testimonial message.
+    
+    Returns:
+        Dictionary of CampaignTestimonial field values
+    """
+    
+    from ai_engine.sentiment import analyze_sentiment, analyze_testimonial_quality
+    
+    sentiment = analyze_sentiment(message)
+    quality = analyze_testimonial_quality(message, sentiment=sentiment)
+    
+    return {
+        'sentiment': sentiment['sentiment'],
+        'sentiment_score': sentiment['scores']['vader_compound'],
+        'subjectivity': sentiment['scores']['textblob_subjectivity'],
+        'quality_score': quality['quality_score'],
+        'analyzed_at': timezone.now(),
+    }
+
+
+@shared_task
+def analyze_testimonial_sentiment(testimonial_id):
+    """Analyze a testimonial and store its sentiment scores."""
+    
+    try:
+        testimonial = CampaignTestimonial.objects.get(pk=testimonial_id)
+    except CampaignTestimonial.DoesNotExist:
+        return
+    
+    # Skip the write if the message was edited meanwhile; that edit queues its own run
+    CampaignTestimonial.objects.filter(
+        pk=testimonial.pk,
+        message=testimonial.message
+    ).update(**score_testimonial(testimonial.message))
+
+
+@shared_task
+def fold_counter_shards():
+    """Fold pending donation shard totals into campaign counters."""
+    fold_shards()
@@ -0,0 +1,237 @@
+"""
+Tests for the Campaigns app.
+"""
+import datetime
+import io
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from donations import imports, leaderboards
+from donations.models import Donation
+from users.models import User
+from . import counters, tasks
+from .models import Campaign, CampaignDonor, CampaignTestimonial, CampaignUpdate
+
+# In-process cache and leaderboards, so tests need no Redis; Celery tasks are
+# only queued on commit, which TestCase never reaches
+LOCAL_SERVICES = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    LEADERBOARD_REDIS_URL='',
+)
+
+
+class CampaignTestCase(TestCase):
+    """An admin, an alumnus and an active campaign."""
+    
+    def setUp(self):
+        # The in-process cache and boards outlive each test's rollback
+        cache.clear()
+        leaderboards._store = None
+        self.admin = User.objects.create_superuser('admin@example.com', 'password', name='Admin')
+        self.alumnus = User.objects.create_user('alumnus@example.com', 'password', name='Alumnus')
+        self.campaign = self.create_campaign('Library')
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+    
+    def create_campaign(self, title):
+        return Campaign.objects.create(
+            title=title, description='Books', goal=100000, deadline=datetime.date(2030, 1, 1),
+            status='active', category='Education', created_by=self.admin
+        )
+    
+    def donate(self, amount, donor=None, **fields):
+        fields.setdefault('status', 'completed')
+        return Donation.objects.create(
+            donor=donor or self.alumnus, campaign=self.campaign, amount=amount, payment_method='upi', **fields
+        )
+
+
+@LOCAL_SERVICES
+class EngagementCounterTests(CampaignTestCase):
+    """Update and testimonial counters kept on the campaign row."""
+    
+    def test_updates_are_counted_and_uncounted(self):
+        update = CampaignUpdate.objects.create(campaign=self.campaign, title='News', message='Shelves are up')
+        CampaignUpdate.objects.create(campaign=self.campaign, title='More news', message='Books arrived')
+        update.delete()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.update_count, 1)
+    
+    def test_only_approved_testimonials_are_counted(self):
+        testimonial = CampaignTestimonial.objects.create(
+            campaign=self.campaign, donor=self.alumnus, message='Great cause'
+        )
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.testimonial_count, 1)
+        
+        testimonial.is_approved = False
+        testimonial.save()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.testimonial_count, 0)
+        
+        testimonial.delete()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.testimonial_count, 0)
+    
+    def test_saving_a_stale_instance_keeps_counters(self):
+        stale = Campaign.objects.get(pk=self.campaign.pk)
+        CampaignUpdate.objects.create(campaign=self.campaign, title='News', message='Shelves are up')
+        
+        stale.title = 'Library wing'
+        stale.save()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.title, 'Library wing')
+        self.assertEqual(self.campaign.update_count, 1)
+    
+    def test_refresh_recomputes_drifted_counters(self):
+        CampaignUpdate.objects.create(campaign=self.campaign, title='News', message='Shelves are up')
+        self.donate(100)
+        self.donate(300)
+        Campaign.objects.filter(pk=self.campaign.pk).update(update_count=7, donation_count=9, donor_count=4)
+        
+        self.assertEqual(counters.refresh_counters([self.campaign.pk]), 1)
+        counters.fold_shards()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.update_count, 1)
+        self.assertEqual(self.campaign.donation_count, 2)
+        self.assertEqual(self.campaign.donor_count, 1)
+        self.assertEqual(self.campaign.average_donation, 200)
+    
+    def test_list_reads_counters_without_a_query_per_campaign(self):
+        self.api.get('/api/campaigns/')
+        for title in ('Gym', 'Lab', 'Garden'):
+            self.create_campaign(title)
+        
+        with self.assertNumQueries(2):
+            response = self.api.get('/api/campaigns/')
+        
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertIn('donor_count', response.data['results'][0])
+
+
+@LOCAL_SERVICES
+class ShardedRaisedTests(CampaignTestCase):
+    """Raised amounts counted in shards and folded into the campaign."""
+    
+    def test_detail_adds_unfolded_shards(self):
+        self.donate(100)
+        self.donate(300)
+        
+        response = self.api.get(f'/api/campaigns/{self.campaign.pk}/')
+        
+        self.assertEqual(float(response.data['raised']), 400)
+        self.assertEqual(response.data['donation_count'], 2)
+        self.assertEqual(response.data['donor_count'], 1)
+        self.assertEqual(float(response.data['average_donation']), 200)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.raised, 0)
+    
+    def test_refund_after_fold_averages_remaining_donations(self):
+        refunded = self.donate(100)
+        self.donate(300)
+        counters.fold_shards()
+        
+        refunded.status = 'refunded'
+        refunded.save()
+        counters.fold_shards()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.raised, 300)
+        self.assertEqual(self.campaign.donation_count, 1)
+        self.assertEqual(self.campaign.average_donation, 300)
+    
+    def test_import_recount_folds_with_live_donations(self):
+        self.donate(100)
+        rows = [
+            'donor_email,campaign_id,amount,completed_at',
+            f'admin@example.com,{self.campaign.pk},50,2024-02-01',
+        ]
+        
+        imports.import_donations(io.StringIO('\n'.join(rows)))
+        counters.fold_shards()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.raised, 150)
+        self.assertEqual(self.campaign.donation_count, 2)
+        self.assertEqual(self.campaign.donor_count, 2)
+        self.assertEqual(CampaignDonor.objects.filter(campaign=self.campaign).count(), 2)
+
+
+def fake_scores(message):
+    return {
+        'sentiment': 'negative' if 'slow' in message else 'positive',
+        'sentiment_score': -0.5 if 'slow' in message else 0.8,
+        'subjectivity': 0.5,
+        'quality_score': len(message),
+        'analyzed_at': timezone.now(),
+    }
+
+
+@LOCAL_SERVICES
+@mock.patch('campaigns.management.commands.backfill_testimonial_sentiment.score_testimonial', fake_scores)
+@mock.patch.object(tasks, 'score_testimonial', fake_scores)
+class TestimonialSentimentTests(CampaignTestCase):
+    """Sentiment stored on testimonials and backfilled in batches."""
+    
+    def setUp(self):
+        super().setUp()
+        self.testimonials = [
+            CampaignTestimonial.objects.create(
+                campaign=self.campaign, message=message,
+                donor=User.objects.create_user(f'donor{i}@example.com', 'password', name='Donor')
+            )
+            for i, message in enumerate(['Great cause', 'Payment was slow', 'Lovely library'])
+        ]
+    
+    def test_backfill_scores_unanalyzed_testimonials_in_batches(self):
+        tasks.analyze_testimonial_sentiment(self.testimonials[0].pk)
+        analyzed_at = CampaignTestimonial.objects.get(pk=self.testimonials[0].pk).analyzed_at
+        out = io.StringIO()
+        
+        call_command('backfill_testimonial_sentiment', batch_size=1, stdout=out)
+        
+        self.assertIn('Analyzed 2 testimonials', out.getvalue())
+        self.assertEqual(
+            dict(CampaignTestimonial.objects.values_list('message', 'sentiment')),
+            {'Great cause': 'positive', 'Payment was slow': 'negative', 'Lovely library': 'positive'}
+        )
+        self.assertEqual(CampaignTestimonial.objects.get(pk=self.testimonials[0].pk).analyzed_at, analyzed_at)
+    
+    def test_backfill_all_rescores_analyzed_testimonials(self):
+        call_command('backfill_testimonial_sentiment', stdout=io.StringIO())
+        out = io.StringIO()
+        
+        call_command('backfill_testimonial_sentiment', '--all', stdout=out)
+        
+        self.assertIn('Analyzed 3 testimonials', out.getvalue())
+    
+    def test_edited_message_clears_scores_until_reanalyzed(self):
+        call_command('backfill_testimonial_sentiment', stdout=io.StringIO())
+        testimonial = CampaignTestimonial.objects.get(pk=self.testimonials[0].pk)
+        
+        testimonial.message = 'Great cause, but slow'
+        testimonial.save()
+        
+        testimonial.refresh_from_db()
+        self.assertEqual((testimonial.sentiment, testimonial.analyzed_at), ('', None))
+        
+        tasks.analyze_testimonial_sentiment(testimonial.pk)
+        testimonial.refresh_from_db()
+        self.assertEqual(testimonial.sentiment, 'negative')
+    
+    def test_report_counts_unanalyzed_testimonials_as_pending(self):
+        tasks.analyze_testimonial_sentiment(self.testimonials[1].pk)
+        
+        response = self.api.get('/api/analytics/sentiment-report/')
+        
+        distribution = response.data['sentiment_distribution']
+        self.assertEqual((distribution['negative'], distribution['pending']), (1, 2))
+        self.assertEqual(distribution['negative_percentage'], 100)
@@ -6,9 +6,10 @@ from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db import models
-from django.db.models import Q, Sum
+from django.db.models import ProtectedError, Q, Sum
 
 from .models import Campaign, CampaignUpdate, CampaignTestimonial
+from .counters import with_pending_totals
 from .serializers import (
     CampaignSerializer,
     CampaignListSerializer,
@@ -52,6 +53,30 @@ class CampaignDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Campaign.objects.all()
     serializer_class = CampaignSerializer
     permission_classes = [IsAdminOrReadOnly]
+    
+    def get_object(self):
+        campaign = super().get_object()
+        # Reads include unfolded donation shards; only the periodic task folds them
+        if self.request.method in permissions.SAFE_METHODS:
+            with_pending_totals(campaign)
+        return campaign
+    
+    def destroy(self, request, *args, **kwargs):
+        campaign = self.get_object()
+        if campaign.archived_at is not None:
+            # Its archive files and archived totals are still counted in aggregates
+            return Response({
+                'error': 'Archived campaigns cannot be deleted'
+            }, status=status.HTTP_409_CONFLICT)
+        
+        try:
+            self.perform_destroy(campaign)
+        except ProtectedError:
+            # Ledger entries keep the campaign's money history
+            return Response({
+                'error': 'Campaigns with recorded donations cannot be deleted; mark them completed instead'
+            }, status=status.HTTP_409_CONFLICT)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class CampaignUpdateListCreateView(generics.ListCreateAPIView):
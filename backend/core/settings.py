@@ -74,6 +74,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
 
 # Database
 DATABASES = {
@@ -120,6 +121,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Report export files; outside MEDIA_ROOT, so they are only served through
+# the authenticated export download view
+EXPORT_ROOT = config('EXPORT_ROOT', default=str(BASE_DIR / 'exports'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -181,6 +186,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
     'x-csrftoken',
@@ -208,10 +214,108 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'refresh-dashboard-snapshots': {
+        'task': 'analytics.tasks.refresh_stale_dashboard_snapshots',
+        'schedule': 60.0,
+    },
+    'fold-campaign-counter-shards': {
+        'task': 'campaigns.tasks.fold_counter_shards',
+        'schedule': 5.0,
+    },
+    'fold-donation-rollup-queue': {
+        'task': 'analytics.tasks.fold_pending_donations',
+        'schedule': 5.0,
+    },
+    'drain-payment-events': {
+        'task': 'donations.tasks.drain_payment_events',
+        'schedule': 30.0,
+    },
+    'rebuild-leaderboards': {
+        'task': 'donations.tasks.rebuild_leaderboards',
+        'schedule': 86400.0,
+    },
+    'checkpoint-donation-ledger': {
+        'task': 'donations.tasks.checkpoint_ledger',
+        'schedule': 300.0,
+    },
+    'create-donation-partitions': {
+        'task': 'donations.tasks.create_donation_partitions',
+        'schedule': 86400.0,
+    },
+    'archive-donations': {
+        'task': 'donations.tasks.archive_donations',
+        'schedule': 604800.0,
+    },
+    'charge-due-pledges': {
+        'task': 'donations.tasks.charge_due_pledges',
+        'schedule': 60.0,
+    },
+}
+CELERY_TASK_ROUTES = {
+    'donations.tasks.drain_payment_events': {'queue': 'webhooks'},
+    'donations.tasks.generate_receipts': {'queue': 'receipts'},
+    'donations.tasks.charge_pledge_donations': {'queue': 'pledges'},
+}
+
+# Cache Configuration (shared: Idempotency-Key claims rely on it; empty keeps a per-process cache for tests)
+CACHE_URL = config('CACHE_URL', default=config('REDIS_URL', default='redis://localhost:6379/0'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    } if CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Analytics query budgets (seconds)
+ANALYTICS_STATEMENT_TIMEOUT = config('ANALYTICS_STATEMENT_TIMEOUT', default=10, cast=int)
+ANALYTICS_RETRY_AFTER = config('ANALYTICS_RETRY_AFTER', default=30, cast=int)
+
+# Live Updates (Server-Sent Events)
+LIVE_UPDATES_REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+LIVE_UPDATES_COALESCE_SECONDS = config('LIVE_UPDATES_COALESCE_SECONDS', default=1, cast=int)
+
+# Leaderboards (sorted sets in Redis; empty keeps them in process memory for tests)
+LEADERBOARD_REDIS_URL = config('LEADERBOARD_REDIS_URL', default=config('REDIS_URL', default=''))
 
 # Payment Gateway Configuration
 RAZORPAY_KEY_ID = config('RAZORPAY_KEY_ID', default='')
 RAZORPAY_KEY_SECRET = config('RAZORPAY_KEY_SECRET', default='')
+RAZORPAY_WEBHOOK_SECRET = config('RAZORPAY_WEBHOOK_SECRET', default='')
+# 'razorpay', or 'stub' to settle payments locally (development, tests, load runs)
+PAYMENT_GATEWAY = config('PAYMENT_GATEWAY', default='razorpay' if RAZORPAY_KEY_ID else 'stub')
+PAYMENT_GATEWAY_TIMEOUT = config('PAYMENT_GATEWAY_TIMEOUT', default=10, cast=int)
+PAYMENT_STUB_SECRET = config('PAYMENT_STUB_SECRET', default='stub-webhook-secret')
+PAYMENT_STUB_OUTCOME = config('PAYMENT_STUB_OUTCOME', default='captured')
+
+# Donations partitioning (PostgreSQL): monthly partitions created ahead of
+# time, and the longest a donation may take to settle after it is created
+DONATION_PARTITION_MONTHS_AHEAD = config('DONATION_PARTITION_MONTHS_AHEAD', default=3, cast=int)
+DONATION_SETTLEMENT_DAYS = config('DONATION_SETTLEMENT_DAYS', default=7, cast=int)
+
+# Cold archive: donations of campaigns completed more than the horizon ago
+# are moved to Parquet files under DONATION_ARCHIVE_ROOT
+DONATION_ARCHIVE_ROOT = config('DONATION_ARCHIVE_ROOT', default=str(BASE_DIR / 'archive' / 'donations'))
+DONATION_ARCHIVE_HORIZON_DAYS = config('DONATION_ARCHIVE_HORIZON_DAYS', default=730, cast=int)
+
+# Recurring pledges: pledges claimed per charging task, concurrent gateway
+# calls per task, and consecutive failed charges before a pledge is paused
+PLEDGE_BATCH_SIZE = config('PLEDGE_BATCH_SIZE', default=200, cast=int)
+PLEDGE_CHARGE_CONCURRENCY = config('PLEDGE_CHARGE_CONCURRENCY', default=8, cast=int)
+PLEDGE_MAX_FAILURES = config('PLEDGE_MAX_FAILURES', default=3, cast=int)
+
+# Receipt numbers run per financial year (April-March by default)
+FINANCIAL_YEAR_START_MONTH = config('FINANCIAL_YEAR_START_MONTH', default=4, cast=int)
+# Numbers each process reserves at a time; unused numbers become gaps
+RECEIPT_NUMBER_BLOCK_SIZE = config('RECEIPT_NUMBER_BLOCK_SIZE', default=100, cast=int)
+
+# PDF receipts (optional TrueType fonts and logo; built-in Helvetica otherwise)
+RECEIPT_ORGANIZATION = config('RECEIPT_ORGANIZATION', default='NOSTOS Alumni Association')
+RECEIPT_LOGO_PATH = config('RECEIPT_LOGO_PATH', default='')
+RECEIPT_FONT_PATH = config('RECEIPT_FONT_PATH', default='')
+RECEIPT_BOLD_FONT_PATH = config('RECEIPT_BOLD_FONT_PATH', default='')
 
 # API Documentation
 SPECTACULAR_SETTINGS = {
@@ -2,7 +2,7 @@
 Admin configuration for Donations app.
 """
 from django.contrib import admin
-from .models import Donation, DonationReceipt
+from .models import ArchiveSegment, Donation, DonationReceipt, LedgerEntry, PaymentEvent, RecurringPledge
 
 
 @admin.register(Donation)
@@ -38,3 +38,58 @@ class DonationReceiptAdmin(admin.ModelAdmin):
     list_display = ('donation', 'generated_at')
     search_fields = ('donation__transaction_id', 'donation__donor__name')
     readonly_fields = ('generated_at',)
+
+
+@admin.register(RecurringPledge)
+class RecurringPledgeAdmin(admin.ModelAdmin):
+    """Recurring pledge admin."""
+    
+    list_display = ('donor', 'campaign', 'amount', 'frequency', 'status', 'next_charge_at', 'failure_count')
+    list_filter = ('status', 'frequency', 'payment_method')
+    search_fields = ('donor__name', 'donor__email', 'campaign__title')
+    readonly_fields = ('last_charged_at', 'created_at', 'updated_at')
+    raw_id_fields = ('donor', 'campaign')
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    """Payment gateway event admin."""
+    
+    list_display = (
+        'gateway', 'event_id', 'order_id', 'outcome', 'received_at', 'processed_at', 'orphaned', 'attempts'
+    )
+    list_filter = ('gateway', 'outcome', 'orphaned', 'processed_at')
+    search_fields = ('event_id', 'order_id', 'payment_id')
+    readonly_fields = ('received_at', 'processed_at', 'retry_at', 'attempts', 'error')
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    """Read-only admin for the append-only donation ledger."""
+    
+    list_display = ('id', 'kind', 'campaign', 'donor', 'amount', 'created_at')
+    list_filter = ('kind', 'created_at')
+    search_fields = ('donation__transaction_id', 'note')
+    raw_id_fields = ('campaign', 'donor', 'donation', 'created_by')
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchiveSegment)
+class ArchiveSegmentAdmin(admin.ModelAdmin):
+    """Read-only admin for the Parquet files of archived donations."""
+    
+    list_display = ('path', 'campaign', 'month', 'row_count', 'created_at')
+    list_filter = ('month',)
+    search_fields = ('path', 'campaign__title')
+    raw_id_fields = ('campaign',)
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -5,3 +5,6 @@ class DonationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'donations'
     verbose_name = 'Donation Management'
+    
+    def ready(self):
+        from . import receivers  # noqa: F401
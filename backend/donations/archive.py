@@ -0,0 +1,369 @@
+"""
+Cold archive of donations in Parquet.
+
+``archive()`` moves the donations of campaigns completed more than
+DONATION_ARCHIVE_HORIZON_DAYS ago out of the donations table into
+zstd-compressed Parquet files under DONATION_ARCHIVE_ROOT, one file per
+campaign and month of creation (``year=YYYY/month=MM/campaign=ID.parquet``).
+A campaign is archived as a whole in one transaction: its files are
+registered as ArchiveSegment rows, each donor's completed giving is kept in
+an ArchivedDonationTotal row, and the donations are deleted.
+
+Campaign counters and DonorStats keep their values, and the rebuilds that
+recompute aggregates from donations add the archived totals back. Donor
+history and donation exports read archived rows with ``page()``,
+``donations()`` and ``rows()``, which only open the segments that can match.
+"""
+import functools
+import json
+import logging
+import operator
+from datetime import timedelta
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from campaigns.models import Campaign
+from .models import ArchivedDonationTotal, ArchiveSegment, Donation, DonationReceipt
+
+logger = logging.getLogger(__name__)
+
+# Columns of an archive file and the Donation values() lookup each comes from
+COLUMNS = (
+    ('id', 'id', pa.int64()),
+    ('transaction_id', 'transaction_id', pa.string()),
+    ('donor_id', 'donor_id', pa.int64()),
+    ('campaign_id', 'campaign_id', pa.int64()),
+    ('pledge_id', 'pledge_id', pa.int64()),
+    ('amount', 'amount', pa.decimal128(10, 2)),
+    ('payment_method', 'payment_method', pa.string()),
+    ('status', 'status', pa.string()),
+    ('payment_gateway_id', 'payment_gateway_id', pa.string()),
+    ('payment_gateway_response', 'payment_gateway_response', pa.string()),
+    ('message', 'message', pa.string()),
+    ('is_anonymous', 'is_anonymous', pa.bool_()),
+    ('receipt_number', 'receipt_number', pa.string()),
+    ('receipt_sent', 'receipt_sent', pa.bool_()),
+    ('receipt_file', 'receipt__receipt_file', pa.string()),
+    ('created_at', 'created_at', pa.timestamp('us', tz='UTC')),
+    ('completed_at', 'completed_at', pa.timestamp('us', tz='UTC')),
+)
+
+SCHEMA = pa.schema([(name, arrow_type) for name, _, arrow_type in COLUMNS])
+
+# Files are streamed one row group at a time, so archiving holds at most this
+# many rows in memory. Rows are read ordered by donor within each month, so
+# per-donor reads skip most row groups.
+ROW_GROUP_SIZE = 50000
+
+
+class ArchiveError(Exception):
+    """A campaign could not be archived consistently."""
+
+
+def archive_root():
+    return Path(settings.DONATION_ARCHIVE_ROOT)
+
+
+def eligible_campaigns(horizon_days=None):
+    """Completed campaigns whose deadline is further back than the horizon and are not archived yet."""
+    
+    horizon_days = settings.DONATION_ARCHIVE_HORIZON_DAYS if horizon_days is None else horizon_days
+    cutoff = timezone.localdate() - timedelta(days=horizon_days)
+    return Campaign.objects.filter(status='completed', archived_at__isnull=True, deadline__lt=cutoff)
+
+
+def _row(values):
+    row = {name: values[lookup] for name, lookup, _ in COLUMNS}
+    row['transaction_id'] = str(row['transaction_id'])
+    row['receipt_file'] = row['receipt_file'] or None
+    if row['payment_gateway_response'] is not None:
+        row['payment_gateway_response'] = json.dumps(row['payment_gateway_response'])
+    return row
+
+
+class _SegmentWriter:
+    """Streams one campaign-month file, a row group at a time, under a .partial name until closed."""
+    
+    def __init__(self, campaign, month):
+        relative_path = f'year={month.year}/month={month.month:02d}/campaign={campaign.pk}.parquet'
+        self.path = archive_root() / relative_path
+        self.partial = self.path.with_name(f'{self.path.name}.partial')
+        self.partial.parent.mkdir(parents=True, exist_ok=True)
+        self.writer = pq.ParquetWriter(self.partial, SCHEMA, compression='zstd')
+        self.segment = ArchiveSegment(campaign=campaign, month=month, path=relative_path, row_count=0)
+        self.rows = []
+    
+    def add(self, row):
+        segment = self.segment
+        segment.min_id = row['id'] if segment.row_count == 0 else min(segment.min_id, row['id'])
+        segment.max_id = row['id'] if segment.row_count == 0 else max(segment.max_id, row['id'])
+        segment.row_count += 1
+        
+        self.rows.append(row)
+        if len(self.rows) >= ROW_GROUP_SIZE:
+            self._flush()
+    
+    def _flush(self):
+        if self.rows:
+            self.writer.write_table(pa.Table.from_pylist(self.rows, schema=SCHEMA), row_group_size=ROW_GROUP_SIZE)
+            self.rows = []
+    
+    def close(self):
+        """Finish the file and move it into place; returns its unsaved ArchiveSegment."""
+        
+        self._flush()
+        self.writer.close()
+        self.partial.replace(self.path)
+        return self.segment
+    
+    def abort(self):
+        self.writer.close()
+        self.partial.unlink(missing_ok=True)
+
+
+def _totals(campaign):
+    """One ArchivedDonationTotal per donor (and anonymity) with donations in ``campaign``."""
+    
+    rows = Donation.objects.filter(campaign=campaign).values('donor_id', 'is_anonymous').annotate(
+        count=Count('id', filter=Q(status='completed')),
+        total=Sum('amount', filter=Q(status='completed')),
+        first=Min('completed_at', filter=Q(status='completed')),
+        last=Max('completed_at', filter=Q(status='completed')),
+    ).order_by()
+    return [
+        ArchivedDonationTotal(
+            campaign=campaign,
+            donor_id=row['donor_id'],
+            is_anonymous=row['is_anonymous'],
+            donation_count=row['count'],
+            total_amount=row['total'] or 0,
+            first_completed_at=row['first'],
+            last_completed_at=row['last'],
+        )
+        for row in rows
+    ]
+
+
+def archive_campaign(campaign):
+    """
+    Move every donation of ``campaign`` to the archive.
+    
+    Returns:
+        Number of donations archived
+    """
+    
+    # Month by month, so each file is streamed and closed before the next one starts
+    donations = Donation.objects.filter(campaign=campaign).order_by(
+        TruncMonth('created_at'), 'donor_id', 'created_at'
+    ).values(*(lookup for _, lookup, _ in COLUMNS))
+    
+    segments = []
+    written = []
+    current = None
+    try:
+        for values in donations.iterator(chunk_size=5000):
+            row = _row(values)
+            month = timezone.localdate(row['created_at']).replace(day=1)
+            if current is None or current.segment.month != month:
+                if current is not None:
+                    segments.append(current.close())
+                    written.append(current.path)
+                if any(segment.month == month for segment in segments):
+                    raise ArchiveError(f'Donations of campaign {campaign.pk} were not read in month order')
+                current = _SegmentWriter(campaign, month)
+            current.add(row)
+        
+        if current is not None:
+            segments.append(current.close())
+            written.append(current.path)
+            current = None
+        archived = sum(segment.row_count for segment in segments)
+        
+        with transaction.atomic():
+            Campaign.objects.select_for_update().filter(pk=campaign.pk).update(archived_at=timezone.now())
+            ArchiveSegment.objects.bulk_create(segments)
+            ArchivedDonationTotal.objects.bulk_create(_totals(campaign))
+            DonationReceipt.objects.filter(donation__campaign=campaign).delete()
+            _, deleted = Donation.objects.filter(campaign=campaign).delete()
+            if deleted.get(Donation._meta.label, 0) != archived:
+                raise ArchiveError(f'Donations of campaign {campaign.pk} changed while it was being archived')
+    except Exception:
+        if current is not None:
+            current.abort()
+        for path in written:
+            path.unlink(missing_ok=True)
+        raise
+    
+    return archived
+
+
+def archive(horizon_days=None):
+    """
+    Archive every eligible campaign, one transaction per campaign.
+    
+    Returns:
+        Tuple of (campaigns archived, donations archived)
+    """
+    
+    campaigns = 0
+    donations = 0
+    for campaign in eligible_campaigns(horizon_days):
+        donations += archive_campaign(campaign)
+        campaigns += 1
+        logger.info('Archived donations of campaign %s', campaign.pk)
+    return campaigns, donations
+
+
+def _segments(donor_id=None, campaign_id=None, pk=None, status=None, payment_method=None, start=None, end=None):
+    """Segments that can hold matching rows; ``status`` and ``payment_method`` are only known inside the files."""
+    
+    segments = ArchiveSegment.objects.all()
+    if donor_id is not None:
+        segments = segments.filter(
+            campaign__in=ArchivedDonationTotal.objects.filter(donor_id=donor_id).values('campaign')
+        )
+    if campaign_id is not None:
+        segments = segments.filter(campaign_id=campaign_id)
+    if pk is not None:
+        segments = segments.filter(min_id__lte=pk, max_id__gte=pk)
+    if start is not None:
+        segments = segments.filter(month__gte=timezone.localdate(start).replace(day=1))
+    if end is not None:
+        segments = segments.filter(month__lte=timezone.localdate(end))
+    return segments
+
+
+def _expression(donor_id=None, campaign_id=None, pk=None, status=None, payment_method=None, start=None, end=None):
+    conditions = []
+    if donor_id is not None:
+        conditions.append(ds.field('donor_id') == donor_id)
+    if campaign_id is not None:
+        conditions.append(ds.field('campaign_id') == campaign_id)
+    if pk is not None:
+        conditions.append(ds.field('id') == pk)
+    if status is not None:
+        conditions.append(ds.field('status') == status)
+    if payment_method is not None:
+        conditions.append(ds.field('payment_method') == payment_method)
+    if start is not None:
+        conditions.append(ds.field('created_at') >= start)
+    if end is not None:
+        conditions.append(ds.field('created_at') < end)
+    return functools.reduce(operator.and_, conditions) if conditions else None
+
+
+def _dataset(**filters):
+    paths = [str(archive_root() / path) for path in _segments(**filters).values_list('path', flat=True)]
+    return ds.dataset(paths, schema=SCHEMA, format='parquet') if paths else None
+
+
+def read(columns=None, **filters):
+    """
+    Archived donations matching ``filters`` (donor_id, campaign_id, pk,
+    status, payment_method, and a created_at range ``start`` <= created_at < ``end``).
+    
+    Returns:
+        pyarrow Table
+    """
+    
+    dataset = _dataset(**filters)
+    if dataset is None:
+        table = SCHEMA.empty_table()
+        return table.select(columns) if columns else table
+    return dataset.to_table(columns=columns, filter=_expression(**filters))
+
+
+def count(**filters):
+    dataset = _dataset(**filters)
+    return dataset.count_rows(filter=_expression(**filters)) if dataset is not None else 0
+
+
+def rows(columns, chunk_size=5000, **filters):
+    """Archived donations as chunks of value tuples in ``columns`` order."""
+    
+    dataset = _dataset(**filters)
+    if dataset is None:
+        return
+    for batch in dataset.to_batches(columns=columns, filter=_expression(**filters), batch_size=chunk_size):
+        if batch.num_rows:
+            yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def page(limit, position=None, reverse=False, **filters):
+    """
+    Up to ``limit`` archived donations matching ``filters``, newest first on
+    (created_at, id) after the cursor ``position`` (created_at, id), or
+    oldest first with ``reverse``.
+    
+    Segments are read a month at a time moving away from the cursor, and
+    reading stops at the first month that completes the page.
+    
+    Returns:
+        List of unsaved Donation instances, each marked ``archived``
+    """
+    
+    segments = _segments(**filters)
+    expression = _expression(**filters)
+    if position is not None:
+        created_at, pk = position
+        month = timezone.localdate(created_at).replace(day=1)
+        if reverse:
+            segments = segments.filter(month__gte=month)
+            beyond = (ds.field('created_at') > created_at) | (
+                (ds.field('created_at') == created_at) & (ds.field('id') > pk)
+            )
+        else:
+            segments = segments.filter(month__lte=month)
+            beyond = (ds.field('created_at') < created_at) | (
+                (ds.field('created_at') == created_at) & (ds.field('id') < pk)
+            )
+        expression = beyond if expression is None else expression & beyond
+    
+    months = {}
+    for month, path in segments.order_by('month' if reverse else '-month').values_list('month', 'path'):
+        months.setdefault(month, []).append(str(archive_root() / path))
+    
+    tables = []
+    found = 0
+    for paths in months.values():
+        tables.append(ds.dataset(paths, schema=SCHEMA, format='parquet').to_table(filter=expression))
+        found += tables[-1].num_rows
+        # Every later month is further from the cursor than the rows already found
+        if found >= limit:
+            break
+    if not tables:
+        return []
+    
+    order = 'ascending' if reverse else 'descending'
+    return _instances(pa.concat_tables(tables).sort_by([('created_at', order), ('id', order)]).slice(0, limit))
+
+
+def _instances(table):
+    result = []
+    for row in table.to_pylist():
+        row.pop('receipt_file')
+        response = row.pop('payment_gateway_response')
+        donation = Donation(**row, payment_gateway_response=json.loads(response) if response else None)
+        donation.archived = True
+        result.append(donation)
+    return result
+
+
+def donations(**filters):
+    """
+    Archived donations matching ``filters`` as unsaved Donation instances,
+    each marked ``archived``.
+    """
+    return _instances(read(**filters))
+
+
+def has_donations(donor_id):
+    return ArchivedDonationTotal.objects.filter(donor_id=donor_id).exists()
@@ -0,0 +1,153 @@
+"""
+Per-donor aggregates (DonorStats).
+
+Each completion or refund updates the donor's row inside the transaction
+that changes the donation, under a row lock, so readers get count, total,
+distinct campaigns and last donation date from a single primary-key
+fetch. Bulk imports and ``rebuild_donor_stats`` recompute whole rows from
+the donations table, plus the totals of archived donations, with grouped
+queries per chunk of donors.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Max, Min, Sum
+
+from .models import ArchivedDonationTotal, Donation, DonorStats
+
+REBUILD_CHUNK_SIZE = 2000
+
+
+def _locked_stats(donor_id):
+    DonorStats.objects.get_or_create(donor_id=donor_id)
+    return DonorStats.objects.select_for_update().get(donor_id=donor_id)
+
+
+def _other_completed(donation):
+    return Donation.objects.filter(donor_id=donation.donor_id, status='completed').exclude(pk=donation.pk)
+
+
+def record_completed(donation):
+    """Add a newly completed donation to its donor's stats."""
+    
+    stats = _locked_stats(donation.donor_id)
+    stats.donation_count += 1
+    stats.total_amount += Decimal(str(donation.amount))
+    if not _other_completed(donation).filter(campaign_id=donation.campaign_id).exists():
+        stats.campaigns_supported += 1
+    
+    completed_at = donation.completed_at
+    if stats.first_donation_at is None or completed_at < stats.first_donation_at:
+        stats.first_donation_at = completed_at
+    if stats.last_donation_at is None or completed_at > stats.last_donation_at:
+        stats.last_donation_at = completed_at
+    stats.save()
+
+
+def record_refunded(donation):
+    """Take a refunded donation back out of its donor's stats."""
+    
+    stats = _locked_stats(donation.donor_id)
+    others = _other_completed(donation)
+    stats.donation_count = max(stats.donation_count - 1, 0)
+    stats.total_amount -= Decimal(str(donation.amount))
+    if not others.filter(campaign_id=donation.campaign_id).exists():
+        stats.campaigns_supported = max(stats.campaigns_supported - 1, 0)
+    
+    # Only re-derive the date bounds when the refunded donation was one of them
+    if donation.completed_at in (stats.first_donation_at, stats.last_donation_at):
+        bounds = _combine(
+            others.aggregate(first=Min('completed_at'), last=Max('completed_at')),
+            ArchivedDonationTotal.objects.filter(donor_id=donation.donor_id, donation_count__gt=0).aggregate(
+                first=Min('first_completed_at'), last=Max('last_completed_at')
+            )
+        )
+        stats.first_donation_at = bounds['first']
+        stats.last_donation_at = bounds['last']
+    stats.save()
+
+
+def _combine(row, archived):
+    """Merge a donor's aggregates over live and archived donations (disjoint campaigns)."""
+    
+    firsts = [value for value in (row.get('first'), archived.get('first')) if value]
+    lasts = [value for value in (row.get('last'), archived.get('last')) if value]
+    return {
+        'count': row.get('count', 0) + (archived.get('count') or 0),
+        'total': (row.get('total') or 0) + (archived.get('total') or 0),
+        'campaigns': row.get('campaigns', 0) + archived.get('campaigns', 0),
+        'first': min(firsts, default=None),
+        'last': max(lasts, default=None),
+    }
+
+
+def refresh(donor_ids):
+    """Recompute the stats rows of ``donor_ids`` from their completed and archived donations."""
+    
+    donor_ids = list(donor_ids)
+    rows = {
+        row['donor_id']: row
+        for row in Donation.objects.filter(donor_id__in=donor_ids, status='completed').values('donor_id').annotate(
+            count=Count('id'),
+            total=Sum('amount'),
+            campaigns=Count('campaign', distinct=True),
+            first=Min('completed_at'),
+            last=Max('completed_at')
+        ).order_by()
+    }
+    archived = {
+        row['donor_id']: row
+        for row in ArchivedDonationTotal.objects.filter(
+            donor_id__in=donor_ids,
+            donation_count__gt=0
+        ).values('donor_id').annotate(
+            count=Sum('donation_count'),
+            total=Sum('total_amount'),
+            campaigns=Count('campaign', distinct=True),
+            first=Min('first_completed_at'),
+            last=Max('last_completed_at')
+        ).order_by()
+    }
+    
+    stats = []
+    for donor_id in donor_ids:
+        row = _combine(rows.get(donor_id, {}), archived.get(donor_id, {}))
+        stats.append(DonorStats(
+            donor_id=donor_id,
+            donation_count=row['count'],
+            total_amount=row['total'],
+            campaigns_supported=row['campaigns'],
+            first_donation_at=row['first'],
+            last_donation_at=row['last'],
+        ))
+    
+    DonorStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['donor'],
+        update_fields=[
+            'donation_count', 'total_amount', 'campaigns_supported',
+            'first_donation_at', 'last_donation_at', 'updated_at'
+        ]
+    )
+
+
+def record_imported(donations):
+    """Recompute the stats of every donor with imported donations."""
+    refresh({donation.donor_id for donation in donations})
+
+
+def rebuild(chunk_size=REBUILD_CHUNK_SIZE):
+    """
+    Recompute every donor's stats from the donations table and archived totals.
+    
+    Returns:
+        Number of donors refreshed
+    """
+    donor_ids = sorted(
+        set(Donation.objects.values_list('donor_id', flat=True).distinct())
+        | set(ArchivedDonationTotal.objects.values_list('donor_id', flat=True).distinct())
+        | set(DonorStats.objects.values_list('donor_id', flat=True))
+    )
+    for start in range(0, len(donor_ids), chunk_size):
+        refresh(donor_ids[start:start + chunk_size])
+    return len(donor_ids)
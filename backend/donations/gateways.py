@@ -0,0 +1,270 @@
+"""
+Payment gateway adapters.
+
+A gateway creates an order for a pending donation and turns verified
+webhook bodies into normalized payment events. Both run off the request
+path: orders are created by a Celery task and webhooks are only verified
+and recorded by the view, then drained in batches on the webhooks queue.
+
+Gateways that charge pledges against a stored mandate (``requires_mandate``)
+take the first instalment of a pledge through checkout as an authorisation
+payment; the mandate it creates is stored on the pledge when the payment
+settles, and only pledges holding one are charged.
+
+``StubGateway`` stands in for Razorpay in development, tests and load
+runs. It creates orders locally and immediately reports their outcome
+through the same event pipeline a real webhook would use.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import urllib.error
+import urllib.request
+import uuid
+
+from django.conf import settings
+
+
+class GatewayError(Exception):
+    """A gateway call failed and may be retried."""
+
+
+class GatewayRejected(GatewayError):
+    """The gateway refused the request; repeating it would be refused again."""
+
+
+class GatewayOutcomeUnknown(GatewayError):
+    """
+    The request may have reached the gateway but no answer came back, so
+    whether it took effect is only known from a later webhook.
+    """
+
+
+class PaymentGateway:
+    """Interface implemented by each gateway."""
+    
+    name = None
+    signature_header = None
+    
+    # Pledges are charged against a mandate the donor authorised at checkout
+    requires_mandate = False
+    # Payment methods a pledge can be charged with
+    recurring_methods = None
+    
+    # Gateway event names mapped to PaymentEvent outcomes
+    OUTCOMES = {
+        'payment.captured': 'captured',
+        'payment.failed': 'failed',
+    }
+    
+    def create_order(self, donation):
+        """Create a gateway order; returns a dict containing at least ``id``."""
+        raise NotImplementedError
+    
+    def checkout(self, donation):
+        """Details the client needs to open the gateway's checkout for ``donation``."""
+        return {
+            'gateway': self.name,
+            'order_id': donation.payment_gateway_id,
+            'amount': int(donation.amount * 100),
+            'currency': 'INR',
+        }
+    
+    def charge_order(self, donation, pledge, order):
+        """
+        Charge a pledge instalment against its ``order`` without the donor present.
+        
+        The outcome arrives as a payment event like any other payment.
+        Requests carry an idempotency key derived from the donation's
+        transaction_id, so repeating a call never charges twice.
+        """
+    
+    def after_order(self, donation, order):
+        """Hook run once the order is stored on the donation."""
+    
+    def mandate(self, payment):
+        """
+        The recurring mandate created by a captured payment, if any.
+        
+        Returns:
+            Tuple of (customer id, token), or None
+        """
+        return None
+    
+    def webhook_secret(self):
+        raise NotImplementedError
+    
+    def sign(self, body):
+        return hmac.new(self.webhook_secret().encode(), body, hashlib.sha256).hexdigest()
+    
+    def verify_webhook(self, body, signature):
+        return bool(signature) and hmac.compare_digest(self.sign(body), signature)
+    
+    def parse_webhook(self, payload):
+        """
+        Normalize a webhook payload.
+        
+        Returns:
+            List of dicts with event_id, order_id, payment_id, outcome
+            ('captured' or 'failed') and payload
+        """
+        raise NotImplementedError
+
+
+class RazorpayGateway(PaymentGateway):
+    name = 'razorpay'
+    signature_header = 'X-Razorpay-Signature'
+    api_url = 'https://api.razorpay.com/v1'
+    
+    requires_mandate = True
+    recurring_methods = ('card', 'upi', 'netbanking')
+    
+    def _post(self, path, payload, idempotency_key=None):
+        credentials = f'{settings.RAZORPAY_KEY_ID}:{settings.RAZORPAY_KEY_SECRET}'
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': 'Basic ' + base64.b64encode(credentials.encode()).decode(),
+        }
+        if idempotency_key:
+            headers['X-Idempotency-Key'] = idempotency_key
+        request = urllib.request.Request(
+            f'{self.api_url}{path}',
+            data=json.dumps(payload).encode(),
+            headers=headers,
+            method='POST'
+        )
+        
+        try:
+            with urllib.request.urlopen(request, timeout=settings.PAYMENT_GATEWAY_TIMEOUT) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # The gateway answered: a 4xx other than rate limiting rejects the request itself
+            if 400 <= e.code < 500 and e.code != 429:
+                raise GatewayRejected(str(e)) from e
+            raise GatewayError(str(e)) from e
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise GatewayOutcomeUnknown(str(e)) from e
+    
+    def create_order(self, donation):
+        payload = {
+            'amount': int(donation.amount * 100),
+            'currency': 'INR',
+            'receipt': str(donation.transaction_id)[:40],
+            'notes': {'donation_id': donation.id},
+        }
+        
+        pledge = donation.pledge
+        if pledge is not None and not pledge.payment_gateway_token:
+            # The pledge's first instalment authorises the mandate later instalments are charged against
+            customer = self._post('/customers', {
+                'name': donation.donor.name,
+                'email': donation.donor.email,
+                'contact': donation.donor.phone,
+                'fail_existing': '0',
+            }, idempotency_key=f'customer-{donation.donor_id}')
+            payload.update({
+                'customer_id': customer['id'],
+                'method': 'emandate' if pledge.payment_method == 'netbanking' else pledge.payment_method,
+                'token': {'max_amount': payload['amount'], 'frequency': 'as_presented'},
+                'notes': {**payload['notes'], 'pledge_id': pledge.id},
+            })
+        
+        return self._post('/orders', payload, idempotency_key=f'order-{donation.transaction_id}')
+    
+    def charge_order(self, donation, pledge, order):
+        if not pledge.payment_gateway_customer_id or not pledge.payment_gateway_token:
+            raise GatewayError('Pledge has no recurring payment mandate')
+        
+        self._post('/payments/create/recurring', {
+            'email': donation.donor.email,
+            'contact': donation.donor.phone,
+            'amount': order['amount'],
+            'currency': 'INR',
+            'order_id': order['id'],
+            'customer_id': pledge.payment_gateway_customer_id,
+            'token': pledge.payment_gateway_token,
+            'recurring': '1',
+            'notes': {'donation_id': donation.id, 'pledge_id': pledge.id},
+        }, idempotency_key=f'charge-{donation.transaction_id}')
+    
+    def checkout(self, donation):
+        details = {**super().checkout(donation), 'key_id': settings.RAZORPAY_KEY_ID}
+        customer_id = (donation.payment_gateway_response or {}).get('order', {}).get('customer_id')
+        if customer_id:
+            details.update({'customer_id': customer_id, 'recurring': '1'})
+        return details
+    
+    def mandate(self, payment):
+        if payment.get('customer_id') and payment.get('token_id'):
+            return payment['customer_id'], payment['token_id']
+        return None
+    
+    def webhook_secret(self):
+        return settings.RAZORPAY_WEBHOOK_SECRET
+    
+    def parse_webhook(self, payload):
+        outcome = self.OUTCOMES.get(payload.get('event'))
+        payment = payload.get('payload', {}).get('payment', {}).get('entity', {})
+        if outcome is None or not payment.get('order_id'):
+            return []
+        
+        return [{
+            'event_id': f"{payload['event']}:{payment['id']}",
+            'order_id': payment['order_id'],
+            'payment_id': payment['id'],
+            'outcome': outcome,
+            'payload': payment,
+        }]
+
+
+class StubGateway(PaymentGateway):
+    name = 'stub'
+    signature_header = 'X-Stub-Signature'
+    
+    def create_order(self, donation):
+        return {
+            'id': f'stub_order_{uuid.uuid4().hex[:16]}',
+            'amount': int(donation.amount * 100),
+            'currency': 'INR',
+            'status': 'created',
+        }
+    
+    def after_order(self, donation, order):
+        from .payments import record_events
+        
+        # Report the configured outcome as if the donor had paid
+        payment_id = f'stub_pay_{uuid.uuid4().hex[:16]}'
+        record_events(self, self.parse_webhook({
+            'event': f'payment.{settings.PAYMENT_STUB_OUTCOME}',
+            'order_id': order['id'],
+            'payment_id': payment_id,
+        }))
+    
+    def webhook_secret(self):
+        return settings.PAYMENT_STUB_SECRET
+    
+    def parse_webhook(self, payload):
+        outcome = self.OUTCOMES.get(payload.get('event'))
+        if outcome is None or not payload.get('order_id'):
+            return []
+        
+        payment_id = payload.get('payment_id', '')
+        return [{
+            'event_id': f"{payload['event']}:{payment_id or payload['order_id']}",
+            'order_id': payload['order_id'],
+            'payment_id': payment_id,
+            'outcome': outcome,
+            'payload': payload,
+        }]
+
+
+GATEWAYS = {
+    RazorpayGateway.name: RazorpayGateway,
+    StubGateway.name: StubGateway,
+}
+
+
+def get_gateway(name=None):
+    """Return the named gateway, or the configured PAYMENT_GATEWAY."""
+    return GATEWAYS[name or settings.PAYMENT_GATEWAY]()
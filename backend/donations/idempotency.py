@@ -0,0 +1,99 @@
+"""
+Idempotency-Key support for donation creation.
+
+The first request with a key claims it in the cache and, once it
+succeeds, stores its response together with a fingerprint of the request.
+Retries with the same key and body replay the stored response without
+touching the database; a key reused with a different body is rejected.
+"""
+import functools
+import hashlib
+import json
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# How long a completed response is replayed, and how long an in-flight
+# claim blocks retries if its worker dies before finishing
+RESPONSE_TTL = 86400
+IN_PROGRESS_TTL = 60
+
+
+def _cache_key(request, key):
+    return f'idempotency:{request.user.pk}:{request.path}:{key}'
+
+
+def fingerprint(request):
+    """Hash of the request body, independent of key order."""
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def idempotent(create):
+    """
+    Wrap a view's ``create(request, ...)`` so requests carrying an
+    Idempotency-Key header are processed at most once per user and key.
+    """
+    
+    @functools.wraps(create)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return create(self, request, *args, **kwargs)
+        
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({
+                'error': f'{HEADER} must be 1-{MAX_KEY_LENGTH} characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        cache_key = _cache_key(request, key)
+        request_fingerprint = fingerprint(request)
+        
+        if not cache.add(cache_key, {'fingerprint': request_fingerprint}, IN_PROGRESS_TTL):
+            return _replay(cache.get(cache_key), request_fingerprint)
+        
+        try:
+            response = create(self, request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        
+        if status.is_success(response.status_code):
+            cache.set(cache_key, {
+                'fingerprint': request_fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+            }, RESPONSE_TTL)
+        else:
+            # Failed requests did not write anything; let the client retry with the same key
+            cache.delete(cache_key)
+        
+        return response
+    
+    return wrapper
+
+
+def _replay(stored, request_fingerprint):
+    if stored is None:
+        # The claim expired between add() and get(); the client can simply retry
+        stored = {'fingerprint': request_fingerprint}
+    
+    if stored['fingerprint'] != request_fingerprint:
+        return Response({
+            'error': f'{HEADER} was already used with a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    
+    if 'status' not in stored:
+        response = Response({
+            'error': 'A request with this Idempotency-Key is still being processed'
+        }, status=status.HTTP_409_CONFLICT)
+        response['Retry-After'] = '1'
+        return response
+    
+    response = Response(stored['data'], status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
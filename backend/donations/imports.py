@@ -0,0 +1,269 @@
+"""
+Bulk import of offline donations (cheques, bank transfers, event collections).
+
+Rows are read from CSV or NDJSON in a single streaming pass, validated
+against lookup tables loaded up front, and inserted with bulk_create in
+large batches. Column names match the donations export, so an export can
+be edited and re-imported. Because bulk_create bypasses Donation.save(),
+the imported donations are announced once through ``donations_imported``
+and receivers apply their aggregates per campaign instead of per row.
+"""
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from users.models import User
+from campaigns.models import Campaign
+from .models import Donation
+from .receipt_numbers import allocate_receipt_number
+from .signals import donations_imported
+
+BATCH_SIZE = 2000
+
+FORMATS = ('csv', 'ndjson')
+
+DEFAULT_PAYMENT_METHOD = 'bank_transfer'
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+FALSE_VALUES = ('', '0', 'false', 'no', 'n')
+
+AMOUNT_LIMIT = Decimal('100000000')
+
+
+class ImportReport:
+    """Outcome of an import: counts plus per-row errors keyed by line number."""
+    
+    def __init__(self):
+        self.total_rows = 0
+        self.imported = 0
+        self.errors = []
+        self.campaign_totals = {}
+    
+    @property
+    def failed(self):
+        return len(self.errors)
+    
+    def add_error(self, row_number, errors):
+        self.errors.append({'row': row_number, 'errors': errors})
+    
+    def to_dict(self, max_errors=None):
+        errors = self.errors if max_errors is None else self.errors[:max_errors]
+        return {
+            'total_rows': self.total_rows,
+            'imported': self.imported,
+            'failed': self.failed,
+            'campaign_totals': {
+                campaign_id: float(amount) for campaign_id, amount in self.campaign_totals.items()
+            },
+            'errors': errors,
+            'errors_truncated': len(errors) < self.failed,
+        }
+
+
+def read_rows(stream, file_format):
+    """
+    Yield (row number, dict) pairs from a binary or text stream.
+    
+    Row numbers are 1-based data rows (the CSV header is not counted).
+    """
+    
+    if isinstance(stream.read(0), bytes):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    
+    if file_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, row
+    elif file_format == 'ndjson':
+        for row_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, e
+                continue
+            yield row_number, row if isinstance(row, dict) else ValueError('Expected a JSON object')
+    else:
+        raise ValueError(f'Unsupported format: {file_format}')
+
+
+def _text(row, field):
+    value = row.get(field)
+    return '' if value is None else str(value).strip()
+
+
+def _parse_completed_at(value, now):
+    if not value:
+        return now
+    
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('Expected an ISO date or datetime')
+        parsed = datetime.combine(day, time(12))
+    
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    if parsed > now:
+        raise ValueError('Cannot be in the future')
+    return parsed
+
+
+class RowValidator:
+    """Validate import rows against donors and campaigns loaded once up front."""
+    
+    def __init__(self):
+        self.now = timezone.now()
+        self.donors = {
+            email.lower(): donor_id
+            for donor_id, email in User.objects.values_list('id', 'email').iterator()
+        }
+        self.campaigns = set(Campaign.objects.filter(archived_at__isnull=True).values_list('id', flat=True))
+        self.payment_methods = {choice for choice, _ in Donation.PAYMENT_METHOD_CHOICES}
+        self.transaction_ids = set()
+    
+    def validate(self, row):
+        """
+        Build an unsaved Donation from ``row``.
+        
+        Returns:
+            (Donation or None, dictionary of field errors)
+        """
+        
+        errors = {}
+        
+        donor_id = self.donors.get(_text(row, 'donor_email').lower())
+        if donor_id is None:
+            errors['donor_email'] = 'No user with this email'
+        
+        try:
+            campaign_id = int(_text(row, 'campaign_id'))
+            if campaign_id not in self.campaigns:
+                errors['campaign_id'] = 'Campaign does not exist or is archived'
+        except ValueError:
+            errors['campaign_id'] = 'Expected an integer campaign id'
+        
+        try:
+            amount = Decimal(_text(row, 'amount'))
+            if not amount.is_finite() or amount <= 0:
+                errors['amount'] = 'Amount must be greater than 0'
+            elif amount >= AMOUNT_LIMIT or amount.as_tuple().exponent < -2:
+                errors['amount'] = 'Amount must have at most 8 digits and 2 decimal places'
+        except InvalidOperation:
+            errors['amount'] = 'Expected a number'
+        
+        payment_method = _text(row, 'payment_method') or DEFAULT_PAYMENT_METHOD
+        if payment_method not in self.payment_methods:
+            errors['payment_method'] = f'Must be one of: {", ".join(sorted(self.payment_methods))}'
+        
+        try:
+            completed_at = _parse_completed_at(_text(row, 'completed_at'), self.now)
+        except ValueError as e:
+            errors['completed_at'] = str(e)
+        
+        is_anonymous = _text(row, 'is_anonymous').lower()
+        if is_anonymous not in TRUE_VALUES + FALSE_VALUES:
+            errors['is_anonymous'] = 'Expected true or false'
+        
+        # A supplied transaction id (e.g. the bank reference) makes re-imports idempotent
+        transaction_id = _text(row, 'transaction_id') or str(uuid.uuid4())
+        if len(transaction_id) > 100:
+            errors['transaction_id'] = 'At most 100 characters'
+        elif transaction_id in self.transaction_ids:
+            errors['transaction_id'] = 'Duplicate transaction id in file'
+        
+        if errors:
+            return None, errors
+        
+        self.transaction_ids.add(transaction_id)
+        return Donation(
+            transaction_id=transaction_id,
+            donor_id=donor_id,
+            campaign_id=campaign_id,
+            amount=amount,
+            payment_method=payment_method,
+            payment_gateway_id=_text(row, 'reference')[:100],
+            status='completed',
+            message=_text(row, 'message'),
+            is_anonymous=is_anonymous in TRUE_VALUES,
+            created_at=completed_at,
+            completed_at=completed_at,
+        ), {}
+
+
+def _flush(batch, report, dry_run, created):
+    """Insert one validated batch, rejecting transaction ids that already exist."""
+    
+    existing = set(
+        Donation.objects.filter(
+            transaction_id__in=[donation.transaction_id for _, donation in batch]
+        ).values_list('transaction_id', flat=True)
+    )
+    
+    donations = []
+    for row_number, donation in batch:
+        if donation.transaction_id in existing:
+            report.add_error(row_number, {'transaction_id': 'A donation with this transaction id already exists'})
+            continue
+        donations.append(donation)
+        report.campaign_totals[donation.campaign_id] = (
+            report.campaign_totals.get(donation.campaign_id, Decimal(0)) + donation.amount
+        )
+    
+    if not dry_run:
+        for donation in donations:
+            donation.receipt_number = allocate_receipt_number(donation.completed_at)
+        created.extend(Donation.objects.bulk_create(donations, batch_size=BATCH_SIZE))
+    report.imported += len(donations)
+
+
+def import_donations(stream, file_format='csv', batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Validate and insert offline donations from a CSV or NDJSON stream.
+    
+    Valid rows are imported and invalid rows are reported; with
+    ``dry_run`` nothing is written.
+    
+    Returns:
+        ImportReport
+    """
+    
+    report = ImportReport()
+    validator = RowValidator()
+    created = []
+    batch = []
+    
+    with transaction.atomic():
+        for row_number, row in read_rows(stream, file_format):
+            report.total_rows += 1
+            
+            if isinstance(row, Exception):
+                report.add_error(row_number, {'row': str(row)})
+                continue
+            
+            donation, errors = validator.validate(row)
+            if errors:
+                report.add_error(row_number, errors)
+                continue
+            
+            batch.append((row_number, donation))
+            if len(batch) >= batch_size:
+                _flush(batch, report, dry_run, created)
+                batch = []
+        
+        if batch:
+            _flush(batch, report, dry_run, created)
+        
+        if created:
+            donations_imported.send(sender=Donation, donations=created)
+    
+    report.errors.sort(key=lambda error: error['row'])
+    return report
@@ -0,0 +1,375 @@
+"""
+Donation leaderboards kept in sorted sets.
+
+Every completed donation adds its amount to the boards it belongs to, and
+a refund subtracts it again, so reading the top N is a sorted-set range
+(O(log n + N)) however many donations there are. Boards rank:
+
+* donors within a campaign, overall, within a department and within a
+  graduation year (anonymous donations are left out of these), and
+* departments and graduation years against each other.
+
+Boards live in Redis (LEADERBOARD_REDIS_URL). Without a URL they are
+kept in process memory, which is only meant for tests and development.
+``rebuild_leaderboards`` recomputes every board from the database, e.g.
+after Redis has been flushed or donors changed department.
+
+Every increment is also appended to a journal, so a rebuild does not lose
+changes made while it runs. The rebuild notes the journal's watermark,
+reads the database in one snapshot and builds the boards under temporary
+keys. It then replays the journaled changes the snapshot does not include
+and renames the temporary keys over the live ones in one transaction.
+"""
+import heapq
+import json
+import logging
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from users.models import User
+from .models import ArchivedDonationTotal, Donation
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'nostos:leaderboard:'
+# Outside KEY_PREFIX, so neither is mistaken for a board
+JOURNAL_KEY = 'nostos:leaderboard-journal'
+REBUILD_PREFIX = 'nostos:leaderboard-rebuild:'
+
+# Journal entries kept; a rebuild only replays those written while it ran
+JOURNAL_LENGTH = 100000
+
+MAX_LIMIT = 100
+
+# Boards ranking groups of donors, and the donor attribute each groups by
+GROUP_SCOPES = {'departments': 'department', 'graduation_years': 'graduation_year'}
+
+
+def board_key(scope, key=None):
+    return f'{KEY_PREFIX}{scope}' if key is None else f'{KEY_PREFIX}{scope}:{key}'
+
+
+class RedisStore:
+    """Boards as Redis sorted sets, with donation counts in a hash beside each."""
+    
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+    
+    @staticmethod
+    def _increment(pipe, deltas, prefix=''):
+        for (key, member), (amount, count) in deltas.items():
+            pipe.zincrby(prefix + key, float(amount), member)
+            pipe.hincrby(f'{prefix}{key}:counts', member, count)
+            if amount < 0:
+                # Drop members refunded down to nothing
+                pipe.zremrangebyscore(prefix + key, '-inf', 0)
+    
+    def increment(self, deltas, journal):
+        # One transaction, so a rebuild sees the change either in its replay or not at all
+        pipe = self.client.pipeline()
+        self._increment(pipe, deltas)
+        pipe.xadd(JOURNAL_KEY, {'entry': json.dumps(journal)}, maxlen=JOURNAL_LENGTH, approximate=True)
+        pipe.execute()
+    
+    def top(self, key, limit):
+        rows = self.client.zrevrange(key, 0, limit - 1, withscores=True)
+        if not rows:
+            return []
+        counts = self.client.hmget(f'{key}:counts', [member for member, _ in rows])
+        return [(member, score, int(count or 0)) for (member, score), count in zip(rows, counts)]
+    
+    def watermark(self):
+        """Id of the last journal entry."""
+        last = self.client.xrevrange(JOURNAL_KEY, count=1)
+        return last[0][0] if last else '0-0'
+    
+    def replace(self, boards, watermark, replay):
+        """
+        Swap in freshly computed boards and delete boards that no longer exist.
+        
+        The boards are written under temporary keys, ``replay`` turns the
+        journal entries after ``watermark`` into deltas applied on top, and
+        the temporary keys are renamed over the live ones in one MULTI. The
+        journal is watched meanwhile; entries added before the swap are
+        replayed and the swap retried.
+        """
+        
+        prefix = f'{REBUILD_PREFIX}{uuid.uuid4().hex}:'
+        names = {name for key in boards for name in (key, f'{key}:counts')}
+        pipe = self.client.pipeline(transaction=False)
+        for key, entries in boards.items():
+            pipe.zadd(prefix + key, {member: float(amount) for member, (amount, count) in entries.items()})
+            pipe.hset(f'{prefix}{key}:counts', mapping={member: count for member, (amount, count) in entries.items()})
+        pipe.execute()
+        
+        try:
+            with self.client.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(JOURNAL_KEY)
+                        journal = [
+                            (entry_id, json.loads(fields['entry']))
+                            for entry_id, fields in pipe.xrange(JOURNAL_KEY, min=watermark)
+                            if entry_id != watermark
+                        ]
+                        if journal:
+                            deltas = replay([entry for _, entry in journal])
+                            replayed = self.client.pipeline(transaction=False)
+                            self._increment(replayed, deltas, prefix)
+                            replayed.execute()
+                            names |= {name for key, _ in deltas for name in (key, f'{key}:counts')}
+                            watermark = journal[-1][0]
+                        
+                        # Boards refunded down to nothing were dropped while replaying
+                        ordered = sorted(names)
+                        exists = self.client.pipeline(transaction=False)
+                        for name in ordered:
+                            exists.exists(prefix + name)
+                        built = {name for name, found in zip(ordered, exists.execute()) if found}
+                        stale = set(self.client.scan_iter(f'{KEY_PREFIX}*')) - built
+                        
+                        pipe.multi()
+                        for name in built:
+                            pipe.rename(prefix + name, name)
+                        if stale:
+                            pipe.delete(*stale)
+                        pipe.execute()
+                        return
+                    except redis.WatchError:
+                        continue
+        finally:
+            leftover = list(self.client.scan_iter(f'{prefix}*'))
+            if leftover:
+                self.client.delete(*leftover)
+
+
+class MemoryStore:
+    """In-process stand-in for RedisStore (tests and development only)."""
+    
+    def __init__(self):
+        self.boards = defaultdict(dict)
+        self.journal = []
+    
+    @staticmethod
+    def _increment(boards, deltas):
+        for (key, member), (amount, count) in deltas.items():
+            score, total = boards[key].get(member, (0.0, 0))
+            score += float(amount)
+            if score > 0:
+                boards[key][member] = (score, total + count)
+            else:
+                boards[key].pop(member, None)
+    
+    def increment(self, deltas, journal):
+        self._increment(self.boards, deltas)
+        self.journal.append(journal)
+        del self.journal[:-JOURNAL_LENGTH]
+    
+    def top(self, key, limit):
+        rows = heapq.nlargest(limit, self.boards.get(key, {}).items(), key=lambda item: item[1][0])
+        return [(member, score, count) for member, (score, count) in rows]
+    
+    def watermark(self):
+        return len(self.journal)
+    
+    def replace(self, boards, watermark, replay):
+        boards = defaultdict(dict, {
+            key: {member: (float(amount), count) for member, (amount, count) in entries.items()}
+            for key, entries in boards.items()
+        })
+        journal = self.journal[watermark:]
+        if journal:
+            self._increment(boards, replay(journal))
+        self.boards = boards
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        url = settings.LEADERBOARD_REDIS_URL
+        _store = RedisStore(url) if url else MemoryStore()
+    return _store
+
+
+def _entries(campaign_id, donor_id, is_anonymous, groups):
+    """Boards and members a donation counts towards; ``groups`` holds the donor's GROUP_SCOPES fields."""
+    
+    member = str(donor_id)
+    entries = []
+    if not is_anonymous:
+        entries += [(board_key('campaign', campaign_id), member), (board_key('donors'), member)]
+    
+    # Donors without a department or graduation year are not grouped
+    for group_scope, field in GROUP_SCOPES.items():
+        if groups.get(field):
+            entries.append((board_key(group_scope), groups[field]))
+            if not is_anonymous:
+                entries.append((board_key(field, groups[field]), member))
+    return entries
+
+
+def _rows(donations):
+    """(id, amount, boards and members) of each of ``donations``."""
+    
+    donors = {
+        donor['id']: donor
+        for donor in User.objects.filter(
+            pk__in={donation.donor_id for donation in donations}
+        ).values('id', 'department', 'graduation_year')
+    }
+    
+    return [
+        (
+            donation.pk,
+            Decimal(str(donation.amount)),
+            _entries(donation.campaign_id, donation.donor_id, donation.is_anonymous, donors.get(donation.donor_id, {}))
+        )
+        for donation in donations
+    ]
+
+
+def _deltas(rows, sign, deltas=None):
+    """Per-(board, member) amount and count changes for ``rows`` from ``_rows``."""
+    
+    deltas = deltas if deltas is not None else defaultdict(lambda: [Decimal(0), 0])
+    for _, amount, entries in rows:
+        for entry in entries:
+            deltas[tuple(entry)][0] += sign * Decimal(amount)
+            deltas[tuple(entry)][1] += sign
+    return deltas
+
+
+def _apply(donations, sign):
+    rows = _rows(donations)
+    deltas = _deltas(rows, sign)
+    journal = {'sign': sign, 'donations': [[pk, str(amount), entries] for pk, amount, entries in rows]}
+    
+    def write():
+        try:
+            get_store().increment(deltas, journal)
+        except redis.RedisError:
+            logger.exception('Leaderboard update failed; run rebuild_leaderboards to resync')
+    
+    # Boards are not transactional, so only apply changes that were committed
+    transaction.on_commit(write)
+
+
+def record_donations(donations):
+    """Add completed donations to their boards once the transaction commits."""
+    _apply(donations, 1)
+
+
+def remove_donations(donations):
+    """Take refunded donations off their boards once the transaction commits."""
+    _apply(donations, -1)
+
+
+def top(scope, key=None, limit=10):
+    """
+    Top ``limit`` entries of a board.
+    
+    Returns:
+        List of (member, total amount, donation count), highest amount first
+    """
+    rows = get_store().top(board_key(scope, key), min(limit, MAX_LIMIT))
+    return [(member, round(score, 2), count) for member, score, count in rows]
+
+
+def compute_boards():
+    """Every board, recomputed from completed donations in the database."""
+    
+    boards = defaultdict(dict)
+    completed = Donation.objects.filter(status='completed')
+    named = completed.filter(is_anonymous=False)
+    
+    grouped = (
+        ('campaign', 'campaign_id'),
+        ('donors', None),
+        ('department', 'donor__department'),
+        ('graduation_year', 'donor__graduation_year'),
+    )
+    for scope, field in grouped:
+        fields = ['donor_id'] + ([field] if field else [])
+        rows = named.values(*fields).annotate(total=Sum('amount'), count=Count('id')).order_by()
+        for row in rows.iterator():
+            key = row[field] if field else None
+            if key == '':
+                continue
+            boards[board_key(scope, key)][str(row['donor_id'])] = (row['total'], row['count'])
+    
+    for scope, field in GROUP_SCOPES.items():
+        rows = completed.exclude(**{f'donor__{field}': ''}).values(f'donor__{field}').annotate(
+            total=Sum('amount'), count=Count('id')
+        ).order_by()
+        for row in rows:
+            boards[board_key(scope)][row[f'donor__{field}']] = (row['total'], row['count'])
+    
+    _add_archived(boards)
+    return boards
+
+
+def _add_archived(boards):
+    """Add archived giving (ArchivedDonationTotal) to freshly computed boards."""
+    
+    totals = ArchivedDonationTotal.objects.filter(donation_count__gt=0).values(
+        'campaign_id', 'donor_id', 'is_anonymous', 'donation_count', 'total_amount',
+        'donor__department', 'donor__graduation_year'
+    )
+    for row in totals.iterator():
+        groups = {field: row[f'donor__{field}'] for field in GROUP_SCOPES.values()}
+        for key, member in _entries(row['campaign_id'], row['donor_id'], row['is_anonymous'], groups):
+            amount, count = boards[key].get(member, (Decimal(0), 0))
+            boards[key][member] = (amount + row['total_amount'], count + row['donation_count'])
+
+
+def _replay(journal):
+    """
+    Deltas of the journaled changes the rebuild's database snapshot does not
+    include; must run inside the snapshot's transaction.
+    """
+    
+    statuses = dict(Donation.objects.filter(
+        pk__in={row[0] for entry in journal for row in entry['donations']}
+    ).values_list('pk', 'status'))
+    
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for entry in journal:
+        # The snapshot counted a completion if the donation is completed or
+        # refunded in it, and a refund only if it is refunded
+        counted = ('completed', 'refunded') if entry['sign'] > 0 else ('refunded',)
+        rows = [row for row in entry['donations'] if statuses.get(row[0]) not in counted]
+        _deltas(rows, entry['sign'], deltas)
+    return deltas
+
+
+def rebuild():
+    """
+    Replace every board with one recomputed from the database, keeping
+    changes made while it runs.
+    
+    Returns:
+        Number of boards written
+    """
+    
+    store = get_store()
+    snapshot = connection.vendor == 'postgresql' and not connection.in_atomic_block
+    with transaction.atomic():
+        if snapshot:
+            # Every query below reads the same snapshot
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        
+        # Taken before the snapshot: entries after it are replayed unless the snapshot already has them
+        watermark = store.watermark()
+        boards = compute_boards()
+        store.replace(boards, watermark, _replay)
+    return len(boards)
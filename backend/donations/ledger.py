@@ -0,0 +1,198 @@
+"""
+Append-only donation ledger.
+
+Every money movement is written as a LedgerEntry in the transaction that
+causes it: a completion when a donation completes (or is imported), a
+negative refund when it is refunded, and an admin correction otherwise.
+Entries are never updated or deleted.
+
+``checkpoint()`` periodically records the running balance of each campaign
+and donor with new entries. A balance is its latest checkpoint plus the
+entries after it, so reads never scan the full history, and a
+point-in-time balance starts from the latest checkpoint before that time.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from campaigns.models import Campaign
+from .models import Donation, LedgerCheckpoint, LedgerEntry
+
+# Entries younger than this stay in the tail: a transaction still in
+# flight may commit an entry with a lower id than ones already visible
+CHECKPOINT_LAG_SECONDS = 60
+
+SCOPES = ('campaign', 'donor')
+
+
+def record_completion(donation):
+    LedgerEntry.objects.create(
+        kind='completion',
+        campaign_id=donation.campaign_id,
+        donor_id=donation.donor_id,
+        donation=donation,
+        amount=donation.amount,
+    )
+
+
+def record_completions(donations):
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(
+            kind='completion',
+            campaign_id=donation.campaign_id,
+            donor_id=donation.donor_id,
+            donation=donation,
+            amount=donation.amount,
+        )
+        for donation in donations
+    ], batch_size=2000)
+
+
+def record_refund(donation):
+    LedgerEntry.objects.create(
+        kind='refund',
+        campaign_id=donation.campaign_id,
+        donor_id=donation.donor_id,
+        donation=donation,
+        amount=-Decimal(str(donation.amount)),
+    )
+
+
+def record_correction(campaign_id, amount, note, created_by=None, donor_id=None):
+    """
+    Record a manual adjustment and apply it to the campaign's raised total.
+    
+    Returns:
+        The new LedgerEntry
+    """
+    
+    with transaction.atomic():
+        entry = LedgerEntry.objects.create(
+            kind='correction',
+            campaign_id=campaign_id,
+            donor_id=donor_id,
+            amount=amount,
+            note=note,
+            created_by=created_by,
+        )
+        Campaign.objects.filter(pk=campaign_id).update(raised=F('raised') + amount)
+    return entry
+
+
+def balance(scope, object_id, as_of=None):
+    """
+    Ledger balance of a campaign or donor, now or at ``as_of``.
+    
+    Returns:
+        Dictionary with balance, entry_count and the checkpoint it started from
+    """
+    
+    checkpoints = LedgerCheckpoint.objects.filter(**{f'{scope}_id': object_id})
+    entries = LedgerEntry.objects.filter(**{f'{scope}_id': object_id})
+    if as_of is not None:
+        checkpoints = checkpoints.filter(as_of__lte=as_of)
+        entries = entries.filter(created_at__lte=as_of)
+    
+    checkpoint = checkpoints.order_by('-last_entry_id').first()
+    if checkpoint is not None:
+        entries = entries.filter(pk__gt=checkpoint.last_entry_id)
+    tail = entries.aggregate(total=Sum('amount'), count=Count('id'))
+    
+    return {
+        'balance': (checkpoint.balance if checkpoint else Decimal(0)) + (tail['total'] or 0),
+        'entry_count': (checkpoint.entry_count if checkpoint else 0) + tail['count'],
+        'checkpoint_entry_id': checkpoint.last_entry_id if checkpoint else None,
+        'tail_entries': tail['count'],
+    }
+
+
+def _checkpoint_scope(scope, watermark):
+    """Checkpoint every campaign or donor with entries after its latest checkpoint."""
+    
+    latest = LedgerCheckpoint.objects.filter(**{scope: OuterRef(f'{scope}_id')}).order_by('-last_entry_id')
+    rows = LedgerEntry.objects.filter(
+        pk__lte=watermark,
+        **{f'{scope}__isnull': False}
+    ).annotate(
+        covered=Coalesce(Subquery(latest.values('last_entry_id')[:1]), Value(0))
+    ).filter(
+        pk__gt=F('covered')
+    ).values(f'{scope}_id').annotate(
+        total=Sum('amount'),
+        count=Count('id'),
+        last_entry_id=Max('id'),
+        as_of=Max('created_at'),
+        previous_balance=Subquery(latest.values('balance')[:1]),
+        previous_count=Subquery(latest.values('entry_count')[:1]),
+        previous_as_of=Subquery(latest.values('as_of')[:1]),
+    ).order_by()
+    
+    checkpoints = [
+        LedgerCheckpoint(
+            **{f'{scope}_id': row[f'{scope}_id']},
+            last_entry_id=row['last_entry_id'],
+            balance=(row['previous_balance'] or 0) + row['total'],
+            entry_count=(row['previous_count'] or 0) + row['count'],
+            # Backfilled entries can be dated before the previous checkpoint
+            as_of=max(filter(None, (row['as_of'], row['previous_as_of']))),
+        )
+        for row in rows
+    ]
+    LedgerCheckpoint.objects.bulk_create(checkpoints, batch_size=2000)
+    return len(checkpoints)
+
+
+def checkpoint(lag_seconds=CHECKPOINT_LAG_SECONDS):
+    """
+    Record new checkpoints for campaigns and donors with entries older than the lag.
+    
+    Returns:
+        Number of checkpoints written
+    """
+    
+    cutoff = timezone.now() - timedelta(seconds=lag_seconds)
+    watermark = LedgerEntry.objects.filter(created_at__lte=cutoff).aggregate(last=Max('id'))['last']
+    if watermark is None:
+        return 0
+    
+    with transaction.atomic():
+        return sum(_checkpoint_scope(scope, watermark) for scope in SCOPES)
+
+
+def backfill(batch_size=2000):
+    """
+    Write the entries of donations completed or refunded before the ledger
+    existed, dated when the donation completed.
+    
+    Returns:
+        Number of entries written
+    """
+    donations = Donation.objects.filter(
+        status__in=('completed', 'refunded'),
+        ledger_entries__isnull=True
+    ).order_by('completed_at', 'id')
+    
+    written = 0
+    batch = []
+    for donation in donations.iterator(chunk_size=batch_size):
+        entry = {
+            'campaign_id': donation.campaign_id,
+            'donor_id': donation.donor_id,
+            'donation_id': donation.pk,
+            'created_at': donation.completed_at or donation.created_at,
+        }
+        batch.append(LedgerEntry(kind='completion', amount=donation.amount, **entry))
+        if donation.status == 'refunded':
+            batch.append(LedgerEntry(kind='refund', amount=-donation.amount, **entry))
+        
+        if len(batch) >= batch_size:
+            LedgerEntry.objects.bulk_create(batch)
+            written += len(batch)
+            batch = []
+    
+    LedgerEntry.objects.bulk_create(batch)
+    return written + len(batch)
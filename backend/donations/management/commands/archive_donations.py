@@ -0,0 +1,23 @@
+"""
+Move donations of long-completed campaigns to the Parquet archive.
+"""
+from django.core.management.base import BaseCommand
+
+from donations.archive import archive, eligible_campaigns
+
+
+class Command(BaseCommand):
+    help = 'Archive the donations of campaigns completed more than the horizon ago to Parquet files'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon-days', type=int, help='Override DONATION_ARCHIVE_HORIZON_DAYS')
+        parser.add_argument('--dry-run', action='store_true', help='List the campaigns that would be archived')
+    
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for campaign in eligible_campaigns(options['horizon_days']):
+                self.stdout.write(f'{campaign.pk}\t{campaign.deadline}\t{campaign.title}')
+            return
+        
+        campaigns, donations = archive(options['horizon_days'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {donations} donations of {campaigns} campaigns'))
@@ -0,0 +1,17 @@
+"""
+Write ledger entries for donations settled before the ledger existed.
+"""
+from django.core.management.base import BaseCommand
+
+from donations import ledger
+
+
+class Command(BaseCommand):
+    help = 'Backfill completion and refund ledger entries, then checkpoint the ledger'
+    
+    def handle(self, *args, **options):
+        entries = ledger.backfill()
+        checkpoints = ledger.checkpoint(lag_seconds=0)
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {entries} ledger entries and {checkpoints} checkpoints'
+        ))
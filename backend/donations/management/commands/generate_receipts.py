@@ -0,0 +1,41 @@
+"""
+Queue PDF receipts for completed donations, e.g. the year-end batch.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from donations.models import Donation
+from donations.receipts import queue_receipts
+
+
+class Command(BaseCommand):
+    help = 'Queue receipt generation on the receipts worker queue; unchanged receipts are skipped by the workers'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Completed on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Completed before this date (YYYY-MM-DD)')
+        parser.add_argument('--campaign', type=int, help='Only this campaign')
+        parser.add_argument('--missing', action='store_true', help='Only donations without a generated receipt')
+    
+    def handle(self, *args, **options):
+        bounds = {}
+        for option in ('since', 'until'):
+            if options[option]:
+                bounds[option] = parse_date(options[option])
+                if bounds[option] is None:
+                    raise CommandError(f'--{option} must be a date (YYYY-MM-DD)')
+        
+        donations = Donation.objects.completed_between(bounds.get('since'), bounds.get('until')).filter(
+            status='completed'
+        )
+        
+        if options['campaign']:
+            donations = donations.filter(campaign_id=options['campaign'])
+        if options['missing']:
+            donations = donations.exclude(receipt__status='ready')
+        
+        donation_ids = list(donations.order_by('id').values_list('id', flat=True))
+        tasks = queue_receipts(donation_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Queued {len(donation_ids)} receipts in {tasks} tasks'
+        ))
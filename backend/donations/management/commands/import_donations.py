@@ -0,0 +1,49 @@
+"""
+Import offline donations from a CSV or NDJSON file.
+"""
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from donations.imports import BATCH_SIZE, FORMATS, import_donations
+
+
+class Command(BaseCommand):
+    help = 'Bulk import completed offline donations (cheques, bank transfers, event collections)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Validate without writing')
+        parser.add_argument('--errors', help='Write the per-row error report to this CSV file')
+    
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in FORMATS:
+            raise CommandError(f'Cannot infer format from {path}; pass --format')
+        
+        with open(path, 'rb') as stream:
+            report = import_donations(
+                stream,
+                file_format,
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run']
+            )
+        
+        if options['errors']:
+            with open(options['errors'], 'w', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(['row', 'field', 'error'])
+                for error in report.errors:
+                    for field, message in error['errors'].items():
+                        writer.writerow([error['row'], field, message])
+        else:
+            for error in report.errors[:20]:
+                self.stderr.write(f"Row {error['row']}: {error['errors']}")
+        
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {report.imported} of {report.total_rows} rows ({report.failed} failed)"
+        ))
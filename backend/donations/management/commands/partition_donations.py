@@ -0,0 +1,32 @@
+"""
+Partition the donations table by month (PostgreSQL only).
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from donations.partitions import convert, ensure_partitions
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly donations partitions; --convert partitions the table first'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help='Convert the plain donations table (locks it for the duration; run in a maintenance window)'
+        )
+        parser.add_argument('--months-ahead', type=int, help='Months to create beyond the current one')
+    
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Donations partitioning requires PostgreSQL')
+        
+        if options['convert']:
+            months = convert(options['months_ahead'])
+            if months is None:
+                self.stdout.write('Donations table is already partitioned')
+            else:
+                self.stdout.write(self.style.SUCCESS(f'Partitioned donations into {months} monthly partitions'))
+        
+        created = ensure_partitions(options['months_ahead'])
+        self.stdout.write(self.style.SUCCESS(f'Created {len(created)} partitions'))
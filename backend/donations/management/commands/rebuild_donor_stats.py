@@ -0,0 +1,17 @@
+"""
+Recompute every donor's DonorStats row from the donations table.
+"""
+from django.core.management.base import BaseCommand
+
+from donations.donor_stats import REBUILD_CHUNK_SIZE, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-donor donation stats (count, total, campaigns, first and last donation)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=REBUILD_CHUNK_SIZE)
+    
+    def handle(self, *args, **options):
+        donors = rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {donors} donors'))
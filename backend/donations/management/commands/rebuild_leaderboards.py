@@ -0,0 +1,14 @@
+"""
+Recompute every donation leaderboard from the database.
+"""
+from django.core.management.base import BaseCommand
+
+from donations.leaderboards import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild campaign, donor, department and graduation year leaderboards from completed donations'
+    
+    def handle(self, *args, **options):
+        boards = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {boards} leaderboards'))
@@ -1,13 +1,58 @@
 """
 Models for Donations.
 """
-from django.db import models
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.db import models, transaction
 from django.utils import timezone
 from users.models import User
 from campaigns.models import Campaign
+from .signals import donation_completed, donation_refunded
 import uuid
 
 
+def _start_of(value):
+    """``value`` as an aware datetime; a date stands for the start of that local day."""
+    if isinstance(value, datetime) or not isinstance(value, date):
+        return value
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+
+class DonationQuerySet(models.QuerySet):
+    
+    def completed_between(self, start=None, end=None):
+        """
+        Donations completed in [start, end); dates are taken as the start of that day.
+        
+        Donations normally complete within DONATION_SETTLEMENT_DAYS of being
+        created (imports are created when they were completed), so the
+        matching created_at bounds let PostgreSQL skip the donations
+        partitions outside the range. The few settled later are flagged
+        ``settled_late``; they are looked up first through a partial
+        completed_at index and then selected by id and created_at. An OR on
+        ``settled_late`` itself would stop PostgreSQL pruning any partition.
+        """
+        
+        donations = self
+        start, end = _start_of(start), _start_of(end)
+        if start is not None:
+            late = self.filter(settled_late=True, completed_at__gte=start)
+            if end is not None:
+                late = late.filter(completed_at__lt=end)
+            late = list(late.order_by().values_list('pk', 'created_at'))
+            
+            in_range = models.Q(created_at__gte=start - timedelta(days=settings.DONATION_SETTLEMENT_DAYS))
+            if late:
+                in_range |= models.Q(
+                    created_at__in={created_at for _, created_at in late}, pk__in=[pk for pk, _ in late]
+                )
+            donations = donations.filter(in_range, completed_at__gte=start)
+        if end is not None:
+            donations = donations.filter(completed_at__lt=end, created_at__lt=end)
+        return donations
+
+
 class Donation(models.Model):
     """Donation model."""
     
@@ -23,6 +68,9 @@ class Donation(models.Model):
         ('card', 'Credit/Debit Card'),
         ('netbanking', 'Net Banking'),
         ('wallet', 'Wallet'),
+        ('cheque', 'Cheque'),
+        ('bank_transfer', 'Bank Transfer'),
+        ('cash', 'Cash'),
     )
     
     transaction_id = models.CharField(max_length=100, unique=True, default=uuid.uuid4)
@@ -34,19 +82,33 @@ class Donation(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     
     # Payment gateway details
-    payment_gateway_id = models.CharField(max_length=100, blank=True)
+    payment_gateway_id = models.CharField(max_length=100, blank=True, db_index=True)
     payment_gateway_response = models.JSONField(blank=True, null=True)
     
     # Donor message
     message = models.TextField(blank=True)
     is_anonymous = models.BooleanField(default=False)
     
+    # Set on donations charged for a recurring pledge
+    pledge = models.ForeignKey(
+        'RecurringPledge', on_delete=models.SET_NULL, null=True, blank=True, related_name='donations'
+    )
+    
     # Receipt
-    receipt_number = models.CharField(max_length=50, unique=True, blank=True)
+    # Allocated on completion; NULL (not '') while pending so unique numbers never collide
+    receipt_number = models.CharField(max_length=50, unique=True, null=True, blank=True)
     receipt_sent = models.BooleanField(default=False)
     
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Partition key of the donations table on PostgreSQL; settable so that
+    # imported donations are filed under the month they were made
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Completed more than DONATION_SETTLEMENT_DAYS after being created
+    settled_late = models.BooleanField(default=False, editable=False)
+    # Rollup segment (first_time / repeat) the donation was counted under
+    donor_segment = models.CharField(max_length=20, blank=True, editable=False)
+    
+    objects = DonationQuerySet.as_manager()
     
     class Meta:
         db_table = 'donations'
@@ -54,29 +116,330 @@ class Donation(models.Model):
         indexes = [
             models.Index(fields=['donor', 'campaign']),
             models.Index(fields=['status', 'created_at']),
+            # Keyset pagination of the donation list, overall and per donor
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['donor', '-created_at', '-id']),
+            models.Index(
+                fields=['completed_at'], condition=models.Q(settled_late=True), name='donations_settled_late_idx'
+            ),
         ]
     
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Status as last read from / written to the database
+        self._saved_status = self.__dict__.get('status') if self.pk else None
+    
     def __str__(self):
         return f"{self.donor.name} - ₹{self.amount} for {self.campaign.title}"
     
     def save(self, *args, **kwargs):
-        # Generate receipt number if not exists
-        if not self.receipt_number:
-            self.receipt_number = f"RCP{timezone.now().strftime('%Y%m%d')}{self.id or ''}"
+        from .receipt_numbers import allocate_receipt_number
+        
+        became_completed = self.status == 'completed' and self._saved_status != 'completed'
+        became_refunded = self.status == 'refunded' and self._saved_status == 'completed'
+        if became_completed and not self.completed_at:
+            self.completed_at = timezone.now()
+        if became_completed and self.created_at:
+            window = timedelta(days=settings.DONATION_SETTLEMENT_DAYS)
+            self.settled_late = self.completed_at - self.created_at > window
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'settled_late'}
         
-        # Update campaign raised amount if completed
-        if self.status == 'completed' and not self.pk:
-            self.campaign.raised += self.amount
-            self.campaign.save(update_fields=['raised'])
+        # Only completed donations are numbered, in the financial year they completed in
+        if self.status == 'completed' and not self.receipt_number:
+            self.receipt_number = allocate_receipt_number(self.completed_at)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'receipt_number'}
         
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            if became_completed:
+                donation_completed.send(sender=Donation, donation=self)
+            elif became_refunded:
+                donation_refunded.send(sender=Donation, donation=self)
+        
+        self._saved_status = self.status
+
+
+class LedgerEntry(models.Model):
+    """Append-only record of one money movement against a campaign."""
+    
+    KIND_CHOICES = (
+        ('completion', 'Completion'),
+        ('refund', 'Refund'),
+        ('correction', 'Correction'),
+    )
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    campaign = models.ForeignKey(Campaign, on_delete=models.PROTECT, related_name='ledger_entries')
+    donor = models.ForeignKey(
+        User, on_delete=models.PROTECT, null=True, blank=True, related_name='ledger_entries'
+    )
+    # Not a database constraint: entries keep the id of donations moved to the archive
+    donation = models.ForeignKey(
+        Donation, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+        related_name='ledger_entries'
+    )
+    # Signed: refunds and downward corrections are negative
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    note = models.TextField(blank=True)
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    # Not auto_now_add, so a backfill can date entries when the money moved
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        db_table = 'donation_ledger'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['campaign', 'id']),
+            models.Index(fields=['donor', 'id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} ₹{self.amount} for campaign {self.campaign_id}"
+    
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Ledger entries are append-only; record a correction instead')
         super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError('Ledger entries are append-only; record a correction instead')
+
+
+class LedgerCheckpoint(models.Model):
+    """Running ledger balance of one campaign or donor up to an entry id."""
+    
+    campaign = models.ForeignKey(
+        Campaign, on_delete=models.CASCADE, null=True, blank=True, related_name='ledger_checkpoints'
+    )
+    donor = models.ForeignKey(
+        User, on_delete=models.CASCADE, null=True, blank=True, related_name='ledger_checkpoints'
+    )
+    # Covers every entry of the campaign or donor with id <= last_entry_id
+    last_entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=14, decimal_places=2)
+    entry_count = models.PositiveIntegerField()
+    # created_at of the newest covered entry
+    as_of = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'donation_ledger_checkpoints'
+        indexes = [
+            models.Index(fields=['campaign', '-last_entry_id']),
+            models.Index(fields=['donor', '-last_entry_id']),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(campaign__isnull=True) ^ models.Q(donor__isnull=True),
+                name='ledger_checkpoint_one_scope'
+            ),
+        ]
+    
+    def __str__(self):
+        scope = f"campaign {self.campaign_id}" if self.campaign_id else f"donor {self.donor_id}"
+        return f"{scope}: ₹{self.balance} at entry {self.last_entry_id}"
+
+
+class DonorStats(models.Model):
+    """Per-donor aggregates over completed donations, kept in step with them."""
+    
+    donor = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='donor_stats')
+    donation_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    campaigns_supported = models.PositiveIntegerField(default=0)
+    first_donation_at = models.DateTimeField(null=True, blank=True)
+    last_donation_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'donor_stats'
+        verbose_name_plural = 'Donor stats'
+    
+    def __str__(self):
+        return f"{self.donor_id}: {self.donation_count} donations, ₹{self.total_amount}"
+    
+    @property
+    def average_amount(self):
+        return self.total_amount / self.donation_count if self.donation_count else 0
+    
+    @property
+    def days_since_last_donation(self):
+        return (timezone.now() - self.last_donation_at).days if self.last_donation_at else 365
+
+
+class ArchiveSegment(models.Model):
+    """One Parquet file of archived donations: one campaign's donations created in one month."""
+    
+    campaign = models.ForeignKey(Campaign, on_delete=models.PROTECT, related_name='archive_segments')
+    month = models.DateField()
+    # Relative to DONATION_ARCHIVE_ROOT
+    path = models.CharField(max_length=255, unique=True)
+    row_count = models.PositiveIntegerField()
+    min_id = models.BigIntegerField()
+    max_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'donation_archive_segments'
+        ordering = ['month', 'campaign']
+        indexes = [
+            models.Index(fields=['min_id', 'max_id']),
+        ]
+    
+    def __str__(self):
+        return self.path
+
+
+class ArchivedDonationTotal(models.Model):
+    """
+    Completed-donation totals of one donor in one archived campaign, so
+    aggregates rebuilt from the donations table can add archived giving back.
+    """
+    
+    campaign = models.ForeignKey(Campaign, on_delete=models.PROTECT, related_name='archived_totals')
+    donor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_totals')
+    is_anonymous = models.BooleanField(default=False)
+    # Zero for donors whose archived donations all failed or were refunded
+    donation_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    first_completed_at = models.DateTimeField(null=True, blank=True)
+    last_completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'donation_archived_totals'
+        unique_together = ['campaign', 'donor', 'is_anonymous']
+        indexes = [
+            models.Index(fields=['donor']),
+        ]
+    
+    def __str__(self):
+        return f"{self.donor_id} in campaign {self.campaign_id}: ₹{self.total_amount}"
+
+
+class ReceiptSequence(models.Model):
+    """Next unreserved receipt number per financial year (non-PostgreSQL backends)."""
+    
+    financial_year = models.CharField(max_length=10, unique=True)
+    next_value = models.BigIntegerField(default=1)
+    
+    class Meta:
+        db_table = 'receipt_sequences'
+    
+    def __str__(self):
+        return f"{self.financial_year}: {self.next_value}"
+
+
+class RecurringPledge(models.Model):
+    """A donor's standing instruction to give a fixed amount every period."""
+    
+    FREQUENCY_CHOICES = (
+        ('monthly', 'Monthly'),
+        ('quarterly', 'Quarterly'),
+        ('yearly', 'Yearly'),
+    )
+    
+    STATUS_CHOICES = (
+        ('active', 'Active'),
+        ('paused', 'Paused'),
+        ('cancelled', 'Cancelled'),
+    )
+    
+    donor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pledges')
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='pledges')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    payment_method = models.CharField(max_length=20, choices=Donation.PAYMENT_METHOD_CHOICES)
+    frequency = models.CharField(max_length=20, choices=FREQUENCY_CHOICES, default='monthly')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    message = models.TextField(blank=True)
+    is_anonymous = models.BooleanField(default=False)
+    
+    # Gateway mandate used to charge without the donor present
+    payment_gateway_customer_id = models.CharField(max_length=100, blank=True)
+    payment_gateway_token = models.CharField(max_length=100, blank=True)
+    
+    next_charge_at = models.DateTimeField()
+    last_charged_at = models.DateTimeField(null=True, blank=True)
+    # Consecutive failed charges; the pledge is paused after PLEDGE_MAX_FAILURES
+    failure_count = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'recurring_pledges'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['next_charge_at'],
+                condition=models.Q(status='active'),
+                name='recurring_pledges_due_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.donor.name} - ₹{self.amount} {self.frequency} for {self.campaign.title}"
+
+
+class PaymentEvent(models.Model):
+    """Verified payment gateway webhook event, processed in batches."""
+    
+    OUTCOME_CHOICES = (
+        ('captured', 'Captured'),
+        ('failed', 'Failed'),
+    )
+    
+    gateway = models.CharField(max_length=20)
+    event_id = models.CharField(max_length=150)
+    order_id = models.CharField(max_length=100)
+    payment_id = models.CharField(max_length=100, blank=True)
+    outcome = models.CharField(max_length=20, choices=OUTCOME_CHOICES)
+    payload = models.JSONField(default=dict)
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Set while the event's order matches no donation yet; the event is drained again after it
+    retry_at = models.DateTimeField(null=True, blank=True)
+    # Processed without ever matching a donation
+    orphaned = models.BooleanField(default=False)
+    # Failed settlement attempts and the last error; after SETTLE_MAX_ATTEMPTS the event is processed unsettled
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    
+    class Meta:
+        db_table = 'payment_events'
+        ordering = ['received_at']
+        unique_together = ['gateway', 'event_id']
+        indexes = [
+            models.Index(
+                fields=['received_at'],
+                condition=models.Q(processed_at__isnull=True),
+                name='payment_events_pending_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.gateway} {self.outcome} for {self.order_id}"
 
 
 class DonationReceipt(models.Model):
     """Donation receipt model."""
     
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+    
     donation = models.OneToOneField(Donation, on_delete=models.CASCADE, related_name='receipt')
     receipt_file = models.FileField(upload_to='receipts/', blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Hash of the content the stored PDF was rendered from
+    content_hash = models.CharField(max_length=64, blank=True)
     generated_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -0,0 +1,188 @@
+"""
+Keyset pagination for donation lists.
+
+Pages are ordered newest first on (created_at, id) and the cursor holds the
+position of the last row returned, so fetching any page is one index range
+scan of ``page_size + 1`` rows instead of an OFFSET that reads every row
+before it. The total count is only computed for the first page; with
+``?approx=1`` it is the query planner's estimate on PostgreSQL.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from analytics.approx import is_approx
+from . import archive
+
+# Below this many estimated rows the exact count is cheap enough to run
+EXACT_COUNT_THRESHOLD = 10000
+
+
+def encode_cursor(donation, reverse=False):
+    payload = json.dumps([donation.created_at.isoformat(), donation.pk, reverse]).encode()
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor into (created_at, id, reverse); raises ValueError if invalid."""
+    
+    try:
+        created_at, pk, reverse = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError
+        return created_at, int(pk), bool(reverse)
+    except (TypeError, ValueError, json.JSONDecodeError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def estimated_count(queryset):
+    """
+    Row count of ``queryset`` as estimated by the PostgreSQL planner, or the
+    exact count for small results and other databases.
+    """
+    
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    return queryset.count() if estimate < EXACT_COUNT_THRESHOLD else estimate
+
+
+class DonationCursorPagination(BasePagination):
+    """Newest-first keyset pagination on (created_at, id)."""
+    
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+    
+    def paginate_queryset(self, queryset, request, view=None, archive_filters=None):
+        """
+        One page of ``queryset``, merged with the archived donations matching
+        ``archive_filters`` when given; only ``page_size + 1`` of those are
+        read from the cursor on.
+        """
+        
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        
+        cursor = request.query_params.get(self.cursor_query_param)
+        try:
+            position = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            raise ValidationError({'error': str(e)})
+        reverse = position[2] if position else False
+        
+        self.count = None
+        if position is None:
+            count = estimated_count(queryset) if is_approx(request) else queryset.count()
+            if archive_filters is not None:
+                count += archive.count(**archive_filters)
+            self.count = count
+        
+        # Previous pages are read oldest first from the cursor, then flipped
+        ordering = ('created_at', 'id') if reverse else ('-created_at', '-id')
+        page = queryset.order_by(*ordering)
+        if position:
+            page = page.filter(self._beyond(position[0], position[1], reverse))
+        
+        rows = list(page[:self.page_size + 1])
+        if archive_filters is not None:
+            rows += archive.page(
+                self.page_size + 1, position=position[:2] if position else None, reverse=reverse, **archive_filters
+            )
+        rows.sort(key=lambda donation: (donation.created_at, donation.pk), reverse=not reverse)
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = rows
+        return rows
+    
+    @staticmethod
+    def _beyond(created_at, pk, reverse):
+        if reverse:
+            return Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+    
+    def _link(self, donation, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(donation, reverse))
+    
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], False)
+    
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(self.page[0], True)
+    
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+    
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+    
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor from the previous response\'s next or previous link',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Number of results per page (at most {self.max_page_size})',
+                'schema': {'type': 'integer'},
+            },
+        ]
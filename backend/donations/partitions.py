@@ -0,0 +1,268 @@
+"""
+Monthly range partitioning of the donations table (PostgreSQL only).
+
+``convert()`` turns the plain donations table into one partitioned by
+``created_at``: one partition per month, plus a default partition for rows
+outside them. ``ensure_partitions()`` (run daily by Celery beat) creates
+the partitions of the coming months ahead of time. Queries bounded on
+created_at, e.g. through ``Donation.objects.completed_between()``, only
+scan the partitions in their range, so years of history do not slow down
+reads of recent donations.
+
+PostgreSQL requires the keys of a partitioned table to include the
+partition key, so after conversion the primary key is (id, created_at).
+Ids still come from a single sequence. transaction_id and receipt_number
+stay globally unique through unpartitioned lookup tables whose primary
+keys are those values: a trigger on donations inserts, moves and deletes
+their rows, so a duplicate raises the same IntegrityError as before.
+Receipts and ledger entries keep their donation_id column but lose the
+database-level foreign key to donations; Django still applies on_delete.
+"""
+import logging
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'donations'
+UNPARTITIONED_TABLE = 'donations_unpartitioned'
+DEFAULT_PARTITION = 'donations_default'
+SEQUENCE = 'donations_id_seq'
+
+# Globally unique columns and the unpartitioned lookup table enforcing each
+UNIQUE_COLUMNS = {
+    'transaction_id': 'donation_transaction_ids',
+    'receipt_number': 'donation_receipt_numbers',
+}
+UNIQUE_TRIGGER = 'donations_unique_keys'
+
+# Held while partitions are created so concurrent runs do not collide
+LOCK_ID = 7301
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _bound(month):
+    """Start of ``month`` in the local time zone."""
+    return timezone.make_aware(datetime.combine(month, time.min))
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year}m{month.month:02d}'
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [TABLE])
+        return cursor.fetchone() is not None
+
+
+def partitions():
+    """Names of the donations table's partitions."""
+    
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [TABLE]
+        )
+        return {name for name, in cursor.fetchall()}
+
+
+def _months(first, months_ahead):
+    """Every month from ``first`` to ``months_ahead`` months after the current one."""
+    
+    last = timezone.localdate().replace(day=1)
+    for _ in range(months_ahead):
+        last = _next_month(last)
+    
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = _next_month(month)
+
+
+def _attach_partition(cursor, month):
+    """
+    Create and attach the partition for ``month``, moving in any of its
+    rows that were filed under the default partition meanwhile.
+    """
+    
+    name = partition_name(month)
+    start, end = _bound(month), _bound(_next_month(month))
+    cursor.execute(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS ('
+        f'DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *'
+        f') INSERT INTO {name} SELECT * FROM moved',
+        [start, end]
+    )
+    cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)', [start, end])
+    # Deleting the moved rows from the default partition released their keys
+    _register_keys(cursor, name)
+
+
+def ensure_partitions(months_ahead=None):
+    """
+    Create the partitions of the current month and the next ``months_ahead``
+    months that do not exist yet.
+    
+    Returns:
+        Names of the partitions created
+    """
+    
+    if not is_partitioned():
+        return []
+    
+    months_ahead = settings.DONATION_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_ID])
+        existing = partitions()
+        for month in _months(timezone.localdate(), months_ahead):
+            if partition_name(month) not in existing:
+                _attach_partition(cursor, month)
+                created.append(partition_name(month))
+    
+    if created:
+        logger.info('Created donations partitions: %s', ', '.join(created))
+    return created
+
+
+def _definitions(cursor):
+    """Non-unique index and foreign key definitions of the donations table."""
+    
+    cursor.execute(
+        'SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = to_regclass(%s) AND NOT indisunique',
+        [TABLE]
+    )
+    indexes = [definition for definition, in cursor.fetchall()]
+    
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [TABLE]
+    )
+    foreign_keys = cursor.fetchall()
+    return indexes, foreign_keys
+
+
+def _register_keys(cursor, table):
+    """Add the unique keys of every row in ``table`` to the lookup tables."""
+    
+    for column, lookup in UNIQUE_COLUMNS.items():
+        cursor.execute(
+            f'INSERT INTO {lookup} ({column}, donation_id) '
+            f'SELECT {column}, id FROM {table} WHERE {column} IS NOT NULL'
+        )
+
+
+def _unique_keys_function():
+    """
+    Trigger function keeping the lookup tables in step with donations;
+    inserting a key that is already taken fails on the lookup table's
+    primary key.
+    """
+    
+    statements = []
+    for column, lookup in UNIQUE_COLUMNS.items():
+        statements.append(f"""
+        IF TG_OP <> 'INSERT' AND OLD.{column} IS NOT NULL
+           AND (TG_OP = 'DELETE' OR NEW.{column} IS DISTINCT FROM OLD.{column}) THEN
+            DELETE FROM {lookup} WHERE {column} = OLD.{column};
+        END IF;
+        IF TG_OP <> 'DELETE' AND NEW.{column} IS NOT NULL
+           AND (TG_OP = 'INSERT' OR NEW.{column} IS DISTINCT FROM OLD.{column}) THEN
+            INSERT INTO {lookup} ({column}, donation_id) VALUES (NEW.{column}, NEW.id);
+        END IF;""")
+    
+    return (
+        f'CREATE FUNCTION {UNIQUE_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$\n'
+        f'BEGIN{"".join(statements)}\n'
+        f'    RETURN NULL;\n'
+        f'END\n'
+        f'$$'
+    )
+
+
+def convert(months_ahead=None):
+    """
+    Replace the plain donations table with a partitioned table holding the
+    same rows. Runs in one transaction holding an exclusive lock on
+    donations, so it belongs in a maintenance window.
+    
+    Returns:
+        Number of partitions created, or None if donations is already partitioned
+    """
+    
+    if is_partitioned():
+        return None
+    
+    months_ahead = settings.DONATION_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        indexes, foreign_keys = _definitions(cursor)
+        
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1, MIN(created_at) FROM {TABLE}')
+        next_id, first_created = cursor.fetchone()
+        
+        # Free the id sequence's name; the partitioned table gets its own
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {UNPARTITIONED_TABLE}')
+        cursor.execute(f'ALTER TABLE {UNPARTITIONED_TABLE} ALTER COLUMN id DROP IDENTITY IF EXISTS')
+        cursor.execute(f'ALTER TABLE {UNPARTITIONED_TABLE} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'DROP SEQUENCE IF EXISTS {SEQUENCE}')
+        
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {UNPARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE (created_at)'
+        )
+        cursor.execute(f'CREATE SEQUENCE {SEQUENCE} START WITH {int(next_id)} OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, created_at)')
+        for column, lookup in UNIQUE_COLUMNS.items():
+            cursor.execute(
+                f'CREATE TABLE {lookup} ({column} varchar(100) PRIMARY KEY, donation_id bigint NOT NULL)'
+            )
+        
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+        first_month = timezone.localdate(first_created) if first_created else timezone.localdate()
+        months = list(_months(first_month, months_ahead))
+        for month in months:
+            cursor.execute(
+                f'CREATE TABLE {partition_name(month)} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)',
+                [_bound(month), _bound(_next_month(month))]
+            )
+        
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {UNPARTITIONED_TABLE}')
+        
+        # Filled in bulk, then kept up to date row by row; a duplicate fails the conversion
+        _register_keys(cursor, TABLE)
+        cursor.execute(_unique_keys_function())
+        cursor.execute(
+            f'CREATE TRIGGER {UNIQUE_TRIGGER} AFTER INSERT OR UPDATE OR DELETE ON {TABLE} '
+            f'FOR EACH ROW EXECUTE FUNCTION {UNIQUE_TRIGGER}()'
+        )
+        
+        # Dropping the old table also drops the foreign keys referencing it
+        # and frees its index names for the partitioned indexes
+        cursor.execute(f'DROP TABLE {UNPARTITIONED_TABLE} CASCADE')
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+        for definition in indexes:
+            cursor.execute(definition)
+        # The unique indexes were not copied; lookups by value still need one
+        for column in UNIQUE_COLUMNS:
+            cursor.execute(f'CREATE INDEX {TABLE}_{column}_idx ON {TABLE} ({column})')
+        
+        cursor.execute(f'ANALYZE {TABLE}')
+    
+    logger.info('Partitioned %s into %d monthly partitions', TABLE, len(months))
+    return len(months)
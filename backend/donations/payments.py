@@ -0,0 +1,175 @@
+"""
+Payment event pipeline.
+
+Webhook events are recorded as PaymentEvent rows (duplicates from gateway
+retries are dropped by the unique key) and a drain is queued on the
+webhooks queue. The drain claims pending events in batches with SKIP
+LOCKED, so several workers can share a burst, and settles each batch's
+donations in one transaction. Every event is settled in its own savepoint:
+an event whose settlement raises is rolled back alone and retried with a
+backoff, and after SETTLE_MAX_ATTEMPTS it is set aside with its error.
+
+An event whose order matches no donation (the webhook can arrive before
+the order is stored) is left pending and drained again later; only once it
+has stayed unmatched for UNMATCHED_ORPHAN_AFTER is it set aside as orphaned.
+"""
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import pledges
+from .gateways import GATEWAYS, get_gateway
+from .models import Donation, PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+DRAIN_BATCH_SIZE = 500
+
+# Unmatched events wait this long before they are drained again
+UNMATCHED_RETRY_SECONDS = 30
+UNMATCHED_ORPHAN_AFTER = timedelta(hours=24)
+
+# Events whose settlement raised wait SETTLE_RETRY_SECONDS, doubling per attempt
+SETTLE_RETRY_SECONDS = 60
+SETTLE_MAX_ATTEMPTS = 5
+
+# Events recorded within this window are drained by a single task
+DRAIN_DEBOUNCE_SECONDS = 1
+
+
+def record_events(gateway, events):
+    """Store normalized webhook events and queue a drain."""
+    
+    if not events:
+        return
+    
+    PaymentEvent.objects.bulk_create(
+        [PaymentEvent(gateway=gateway.name, **event) for event in events],
+        ignore_conflicts=True
+    )
+    schedule_drain()
+
+
+def schedule_drain():
+    from .tasks import drain_payment_events
+    
+    if cache.add('payments:drain', True, DRAIN_DEBOUNCE_SECONDS):
+        transaction.on_commit(
+            lambda: drain_payment_events.apply_async(countdown=DRAIN_DEBOUNCE_SECONDS)
+        )
+
+
+def _settle(donation, event):
+    """Apply one event to its donation; returns True if the donation changed."""
+    
+    if event.outcome == 'captured':
+        # A failed attempt can be followed by a successful one on the same order
+        if donation.status not in ('pending', 'failed'):
+            return False
+        donation.status = 'completed'
+    elif donation.status == 'pending':
+        donation.status = 'failed'
+    else:
+        return False
+    
+    donation.payment_gateway_response = {
+        **(donation.payment_gateway_response or {}),
+        'payment': event.payload,
+    }
+    donation.save(update_fields=['status', 'completed_at', 'payment_gateway_response'])
+    
+    if donation.pledge_id:
+        if donation.status == 'completed':
+            mandate = get_gateway(event.gateway).mandate(event.payload) if event.gateway in GATEWAYS else None
+            if mandate is not None:
+                pledges.store_mandate(donation.pledge_id, *mandate)
+            pledges.record_success(donation.pledge_id)
+        else:
+            pledges.record_failures([donation.pledge_id])
+    return True
+
+
+def _defer_failed(event, error, now):
+    """Schedule a retry of an event whose settlement raised, or give up on it."""
+    
+    event.attempts += 1
+    event.error = repr(error)
+    if event.attempts >= SETTLE_MAX_ATTEMPTS:
+        logger.exception(
+            'Payment event %s for order %s failed %s times; giving up', event.event_id, event.order_id, event.attempts
+        )
+        event.processed_at = now
+    else:
+        logger.exception('Payment event %s for order %s failed; retrying', event.event_id, event.order_id)
+        event.retry_at = now + timedelta(seconds=SETTLE_RETRY_SECONDS * 2 ** (event.attempts - 1))
+    event.save(update_fields=['attempts', 'error', 'processed_at', 'retry_at'])
+
+
+def process_batch(batch_size=DRAIN_BATCH_SIZE):
+    """
+    Settle up to ``batch_size`` pending events in one transaction.
+    
+    Returns:
+        Number of events processed, including those deferred for retry
+    """
+    
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            PaymentEvent.objects.select_for_update(skip_locked=True).filter(
+                Q(retry_at__isnull=True) | Q(retry_at__lte=now),
+                processed_at__isnull=True
+            ).order_by('received_at')[:batch_size]
+        )
+        if not events:
+            return 0
+        
+        donations = {
+            donation.payment_gateway_id: donation
+            for donation in Donation.objects.select_for_update(of=('self',)).filter(
+                payment_gateway_id__in={event.order_id for event in events}
+            ).select_related('campaign')
+        }
+        
+        settled, unmatched, orphaned = [], [], []
+        for event in events:
+            donation = donations.get(event.order_id)
+            if donation is not None:
+                try:
+                    with transaction.atomic():
+                        _settle(donation, event)
+                except Exception as e:
+                    _defer_failed(event, e, now)
+                    # The instance may hold changes that were rolled back
+                    donations[event.order_id] = Donation.objects.select_related('campaign').get(pk=donation.pk)
+                else:
+                    settled.append(event.pk)
+            elif event.received_at < now - UNMATCHED_ORPHAN_AFTER:
+                orphaned.append(event)
+            else:
+                unmatched.append(event.pk)
+        
+        PaymentEvent.objects.filter(pk__in=settled).update(processed_at=now)
+        PaymentEvent.objects.filter(pk__in=unmatched).update(
+            retry_at=now + timedelta(seconds=UNMATCHED_RETRY_SECONDS)
+        )
+        if orphaned:
+            for event in orphaned:
+                logger.error('Payment event %s for unknown order %s orphaned', event.event_id, event.order_id)
+            PaymentEvent.objects.filter(pk__in=[event.pk for event in orphaned]).update(
+                processed_at=now, orphaned=True
+            )
+        return len(events)
+
+
+def drain_events(batch_size=DRAIN_BATCH_SIZE):
+    """Process pending events batch by batch until none are left or due for retry."""
+    
+    total = 0
+    while processed := process_batch(batch_size):
+        total += processed
+    return total
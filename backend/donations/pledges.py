@@ -0,0 +1,281 @@
+"""
+Recurring pledge scheduling and charging.
+
+The scheduler claims due pledges through the partial ``next_charge_at``
+index in batches, with SKIP LOCKED so overlapping runs never claim the same
+pledge. For each batch it bulk-creates one pending Donation per pledge,
+advances the pledges to their next period and queues one charging task.
+The charging task calls the gateway from a bounded thread pool and settles
+through the usual payment event pipeline, so completion, receipts and
+aggregates work exactly as for one-off donations. Gateway requests carry
+idempotency keys and every order is stored before its charge is sent, so
+retries never charge a donor twice.
+
+When the gateway charges against a mandate, a new pledge's first instalment
+is created straight away and paid by the donor at checkout; that payment
+authorises the mandate, and the scheduler only claims pledges holding one.
+"""
+import calendar
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .gateways import GatewayError, GatewayOutcomeUnknown, get_gateway
+from .models import Donation, RecurringPledge
+
+logger = logging.getLogger(__name__)
+
+PERIOD_MONTHS = {
+    'monthly': 1,
+    'quarterly': 3,
+    'yearly': 12,
+}
+
+
+def _add_months(when, months):
+    """``when`` moved ``months`` ahead, clamped to the end of shorter months."""
+    month = when.month - 1 + months
+    year = when.year + month // 12
+    month = month % 12 + 1
+    return when.replace(year=year, month=month, day=min(when.day, calendar.monthrange(year, month)[1]))
+
+
+def next_charge_after(pledge, now):
+    """The pledge's first charge date after ``now``; periods missed while it was not charged are skipped."""
+    
+    months = PERIOD_MONTHS[pledge.frequency]
+    periods = 1
+    while (next_charge := _add_months(pledge.next_charge_at, months * periods)) <= now:
+        periods += 1
+    return next_charge
+
+
+def start(pledge, now=None):
+    """
+    Create a new pledge's first instalment when there is no mandate to charge it against.
+    
+    The instalment is a pending donation the donor pays at checkout, which
+    authorises the mandate; the next instalment falls a period later.
+    Without a mandate requirement the next scheduler run charges the pledge.
+    
+    Returns:
+        The first instalment's donation, or None
+    """
+    from .tasks import create_gateway_order
+    
+    if not get_gateway().requires_mandate or pledge.payment_gateway_token:
+        return None
+    
+    now = now or timezone.now()
+    donation = Donation.objects.create(
+        donor_id=pledge.donor_id,
+        campaign_id=pledge.campaign_id,
+        pledge=pledge,
+        amount=pledge.amount,
+        payment_method=pledge.payment_method,
+        message=pledge.message,
+        is_anonymous=pledge.is_anonymous,
+    )
+    pledge.last_charged_at = now
+    pledge.next_charge_at = _add_months(now, PERIOD_MONTHS[pledge.frequency])
+    pledge.save(update_fields=['last_charged_at', 'next_charge_at', 'updated_at'])
+    
+    transaction.on_commit(lambda: create_gateway_order.delay(donation.pk))
+    return donation
+
+
+def claim_due(batch_size=None, now=None):
+    """
+    Create pending donations for one batch of due pledges and queue their charge.
+    
+    Returns:
+        IDs of the donations created
+    """
+    from .tasks import charge_pledge_donations
+    
+    batch_size = batch_size or settings.PLEDGE_BATCH_SIZE
+    now = now or timezone.now()
+    
+    due = RecurringPledge.objects.select_for_update(skip_locked=True, of=('self',)).filter(
+        status='active',
+        next_charge_at__lte=now,
+        campaign__archived_at__isnull=True
+    )
+    if get_gateway().requires_mandate:
+        # Pledges whose first instalment is still unpaid have nothing to charge yet
+        due = due.exclude(payment_gateway_token='')
+    
+    with transaction.atomic():
+        pledges = list(due.order_by('next_charge_at')[:batch_size])
+        if not pledges:
+            return []
+        
+        donations = Donation.objects.bulk_create([
+            Donation(
+                donor_id=pledge.donor_id,
+                campaign_id=pledge.campaign_id,
+                pledge=pledge,
+                amount=pledge.amount,
+                payment_method=pledge.payment_method,
+                message=pledge.message,
+                is_anonymous=pledge.is_anonymous,
+            )
+            for pledge in pledges
+        ])
+        
+        for pledge in pledges:
+            pledge.last_charged_at = now
+            pledge.updated_at = now
+            pledge.next_charge_at = next_charge_after(pledge, now)
+        RecurringPledge.objects.bulk_update(pledges, ['last_charged_at', 'next_charge_at', 'updated_at'])
+        
+        donation_ids = [donation.pk for donation in donations]
+        transaction.on_commit(lambda: charge_pledge_donations.delay(donation_ids))
+        return donation_ids
+
+
+def schedule_due(batch_size=None):
+    """
+    Claim every due pledge, batch by batch.
+    
+    Returns:
+        Number of donations created
+    """
+    now = timezone.now()
+    total = 0
+    while donation_ids := claim_due(batch_size, now):
+        total += len(donation_ids)
+    return total
+
+
+def _create_order(gateway, donation):
+    try:
+        return gateway.create_order(donation)
+    except GatewayError as e:
+        # Nothing has been charged without an order
+        logger.warning('Pledge order failed for donation %s: %s', donation.pk, e)
+        return None
+
+
+def _charge(gateway, donation, order):
+    """
+    Submit the charge; returns 'submitted', 'failed', or 'unknown' when the
+    gateway may have charged without answering.
+    """
+    try:
+        gateway.charge_order(donation, donation.pledge, order)
+        return 'submitted'
+    except GatewayOutcomeUnknown as e:
+        logger.warning('Pledge charge outcome unknown for donation %s, awaiting webhook: %s', donation.pk, e)
+        return 'unknown'
+    except GatewayError as e:
+        logger.warning('Pledge charge failed for donation %s: %s', donation.pk, e)
+        return 'failed'
+
+
+def _fail(donations):
+    """Mark the donations that are still pending failed and count the failures against their pledges."""
+    
+    with transaction.atomic():
+        # A webhook for the same order may have settled a donation meanwhile
+        failed = list(Donation.objects.select_for_update().filter(
+            pk__in=[donation.pk for donation in donations],
+            status='pending'
+        ).values_list('pk', 'pledge_id'))
+        Donation.objects.filter(pk__in=[pk for pk, pledge_id in failed]).update(status='failed')
+        record_failures([pledge_id for pk, pledge_id in failed])
+
+
+def charge_donations(donation_ids):
+    """
+    Charge pending pledge donations at the gateway, at most
+    PLEDGE_CHARGE_CONCURRENCY requests at a time.
+    
+    Each donation's order is stored as soon as the gateway creates it, and
+    donations are marked ``charge_submitted`` before their charge is sent,
+    so a redelivered task never charges a donation again. A charge whose
+    outcome is unknown leaves the donation pending for the webhook.
+    
+    Returns:
+        Number of charges submitted
+    """
+    
+    gateway = get_gateway()
+    # Everything the gateway calls need is loaded here; the pool threads never touch the database
+    donations = [
+        donation for donation in Donation.objects.filter(
+            pk__in=donation_ids,
+            status='pending'
+        ).select_related('pledge', 'donor')
+        if not (donation.payment_gateway_response or {}).get('charge_submitted')
+    ]
+    
+    orders = {
+        donation.pk: donation.payment_gateway_response['order']
+        for donation in donations if donation.payment_gateway_id
+    }
+    failed = []
+    with ThreadPoolExecutor(max_workers=settings.PLEDGE_CHARGE_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(_create_order, gateway, donation): donation
+            for donation in donations if donation.pk not in orders
+        }
+        for future in as_completed(futures):
+            donation, order = futures[future], future.result()
+            if order is None:
+                failed.append(donation)
+                continue
+            Donation.objects.filter(pk=donation.pk).update(
+                payment_gateway_id=order['id'],
+                payment_gateway_response={'gateway': gateway.name, 'order': order}
+            )
+            orders[donation.pk] = order
+    if failed:
+        _fail(failed)
+    
+    to_charge = [donation for donation in donations if donation.pk in orders]
+    for donation in to_charge:
+        donation.payment_gateway_id = orders[donation.pk]['id']
+        donation.payment_gateway_response = {
+            'gateway': gateway.name, 'order': orders[donation.pk], 'charge_submitted': True
+        }
+    Donation.objects.bulk_update(to_charge, ['payment_gateway_id', 'payment_gateway_response'])
+    
+    with ThreadPoolExecutor(max_workers=settings.PLEDGE_CHARGE_CONCURRENCY) as pool:
+        outcomes = list(pool.map(
+            lambda donation: _charge(gateway, donation, orders[donation.pk]), to_charge
+        ))
+    
+    failed = [donation for donation, outcome in zip(to_charge, outcomes) if outcome == 'failed']
+    if failed:
+        _fail(failed)
+    
+    charged = [donation for donation, outcome in zip(to_charge, outcomes) if outcome == 'submitted']
+    for donation in charged:
+        gateway.after_order(donation, orders[donation.pk])
+    return len(charged)
+
+
+def record_failures(pledge_ids):
+    """Count a failed charge against each pledge and pause those that keep failing."""
+    
+    pledges = RecurringPledge.objects.filter(pk__in=pledge_ids)
+    pledges.update(failure_count=F('failure_count') + 1)
+    pledges.filter(status='active', failure_count__gte=settings.PLEDGE_MAX_FAILURES).update(status='paused')
+
+
+def store_mandate(pledge_id, customer_id, token):
+    """Keep the mandate a pledge's authorisation payment created for charging later instalments."""
+    RecurringPledge.objects.filter(pk=pledge_id).update(
+        payment_gateway_customer_id=customer_id,
+        payment_gateway_token=token,
+        updated_at=timezone.now()
+    )
+
+
+def record_success(pledge_id):
+    RecurringPledge.objects.filter(pk=pledge_id).exclude(failure_count=0).update(failure_count=0)
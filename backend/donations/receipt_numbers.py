@@ -0,0 +1,119 @@
+"""
+Receipt number allocation.
+
+Receipt numbers run in one sequence per financial year, e.g.
+``RCP-2025-26-0000123``. Each process reserves a block of
+RECEIPT_NUMBER_BLOCK_SIZE numbers at a time and hands them out from
+memory, so most allocations never touch the database. Numbers left in a
+block when a process exits are skipped: the sequence is unique and
+increasing but may have gaps.
+
+On PostgreSQL blocks come from a database sequence per financial year;
+``nextval`` is never rolled back, so a block reserved inside a failed
+transaction is not handed out twice. Other backends (development)
+reserve blocks by updating a ReceiptSequence row.
+
+A PostgreSQL sequence keeps the block size it was created with; after
+changing RECEIPT_NUMBER_BLOCK_SIZE, ALTER the existing sequences to match.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ReceiptSequence
+
+PREFIX = 'RCP'
+
+
+def financial_year(when=None):
+    """Label of the financial year containing ``when``, e.g. '2025-26'."""
+    
+    day = timezone.localdate(when) if when else timezone.localdate()
+    start = day.year if day.month >= settings.FINANCIAL_YEAR_START_MONTH else day.year - 1
+    if settings.FINANCIAL_YEAR_START_MONTH == 1:
+        return str(start)
+    return f'{start}-{(start + 1) % 100:02d}'
+
+
+def format_receipt_number(year, number):
+    return f'{PREFIX}-{year}-{number:07d}'
+
+
+class ReceiptNumberAllocator:
+    """Hands out receipt numbers from per-process blocks, one sequence per financial year."""
+    
+    def __init__(self, block_size=None):
+        self.block_size = block_size or settings.RECEIPT_NUMBER_BLOCK_SIZE
+        self._blocks = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._sequences = set()
+    
+    def allocate(self, when=None):
+        """Next receipt number for the financial year containing ``when`` (default: now)."""
+        
+        year = financial_year(when)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked (e.g. a prefork worker): the parent's blocks are not ours to use
+                self._blocks = {}
+                self._pid = os.getpid()
+            
+            next_number, end = self._blocks.get(year, (0, 0))
+            if next_number >= end:
+                next_number = self._reserve(year)
+                end = next_number + self.block_size
+            self._blocks[year] = (next_number + 1, end)
+        return format_receipt_number(year, next_number)
+    
+    def _reserve(self, year):
+        """Reserve a block; returns its first number."""
+        if connection.vendor == 'postgresql':
+            return self._reserve_from_sequence(year)
+        return self._reserve_from_table(year)
+    
+    def _reserve_from_sequence(self, year):
+        name = f"receipt_numbers_{year.replace('-', '_')}"
+        if name not in self._sequences:
+            self._create_sequence(name)
+            self._sequences.add(name)
+        
+        # Sequences advance by a whole block, so nextval() returns the block start
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s)', [name])
+            return cursor.fetchone()[0]
+    
+    def _create_sequence(self, name):
+        # DDL is transactional in PostgreSQL: create the sequence on a separate
+        # autocommit connection so a rollback of the caller's transaction
+        # cannot drop a sequence that blocks were already reserved from
+        creator = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            with creator.cursor() as cursor:
+                cursor.execute(
+                    f'CREATE SEQUENCE IF NOT EXISTS {name} INCREMENT BY {self.block_size} MINVALUE 1 START WITH 1'
+                )
+        except IntegrityError:
+            # Another process created it concurrently
+            pass
+        finally:
+            creator.close()
+    
+    def _reserve_from_table(self, year):
+        with transaction.atomic():
+            ReceiptSequence.objects.get_or_create(financial_year=year)
+            ReceiptSequence.objects.filter(financial_year=year).update(
+                next_value=F('next_value') + self.block_size
+            )
+            return ReceiptSequence.objects.get(financial_year=year).next_value - self.block_size
+
+
+allocator = ReceiptNumberAllocator()
+
+
+def allocate_receipt_number(when=None):
+    return allocator.allocate(when)
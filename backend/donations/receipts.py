@@ -0,0 +1,226 @@
+"""
+PDF donation receipts.
+
+Receipts are rendered by Celery workers, never by web workers. The layout
+is a fixed template; fonts are registered and the logo is decoded once per
+worker process and reused for every receipt it renders. Each stored
+receipt records a hash of the content it was rendered from, so re-running
+generation (e.g. a repeated year-end batch) skips receipts whose content
+has not changed.
+"""
+import functools
+import hashlib
+import io
+import json
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from .models import Donation, DonationReceipt
+
+logger = logging.getLogger(__name__)
+
+# Donations per worker task when generating receipts in bulk
+BATCH_SIZE = 200
+
+# A queued receipt is not queued again for this long, unless its task finishes first
+QUEUE_TIMEOUT = 300
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 20 * mm
+
+# Label and attribute path for each row of the details table
+DETAIL_ROWS = (
+    ('Receipt number', 'receipt_number'),
+    ('Date', 'date'),
+    ('Received from', 'donor_name'),
+    ('Email', 'donor_email'),
+    ('Campaign', 'campaign'),
+    ('Payment method', 'payment_method'),
+    ('Transaction ID', 'transaction_id'),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _fonts():
+    """Register the configured fonts once per process; returns (regular, bold) names."""
+    
+    if not settings.RECEIPT_FONT_PATH:
+        return 'Helvetica', 'Helvetica-Bold'
+    
+    pdfmetrics.registerFont(TTFont('ReceiptRegular', settings.RECEIPT_FONT_PATH))
+    pdfmetrics.registerFont(TTFont('ReceiptBold', settings.RECEIPT_BOLD_FONT_PATH or settings.RECEIPT_FONT_PATH))
+    return 'ReceiptRegular', 'ReceiptBold'
+
+
+@functools.lru_cache(maxsize=None)
+def _logo():
+    """Decode the configured logo once per process."""
+    
+    if not settings.RECEIPT_LOGO_PATH:
+        return None
+    return ImageReader(settings.RECEIPT_LOGO_PATH)
+
+
+def receipt_context(donation):
+    """Everything printed on the receipt, as plain strings."""
+    
+    completed_at = timezone.localtime(donation.completed_at or donation.created_at)
+    return {
+        'organization': settings.RECEIPT_ORGANIZATION,
+        'receipt_number': donation.receipt_number,
+        'date': completed_at.strftime('%d %B %Y'),
+        'donor_name': donation.donor.name,
+        'donor_email': donation.donor.email,
+        'campaign': donation.campaign.title,
+        'payment_method': donation.get_payment_method_display(),
+        'transaction_id': str(donation.transaction_id),
+        'amount': f'{donation.amount:,.2f}',
+    }
+
+
+def content_hash(context):
+    return hashlib.sha256(json.dumps(context, sort_keys=True).encode()).hexdigest()
+
+
+def render_receipt(context):
+    """Render a receipt context to PDF bytes."""
+    
+    regular, bold = _fonts()
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    pdf.setTitle(f"Donation receipt {context['receipt_number']}")
+    pdf.setAuthor(context['organization'])
+    
+    y = PAGE_HEIGHT - MARGIN
+    logo = _logo()
+    if logo is not None:
+        pdf.drawImage(logo, MARGIN, y - 20 * mm, width=40 * mm, height=20 * mm,
+                      preserveAspectRatio=True, anchor='sw', mask='auto')
+    
+    pdf.setFont(bold, 16)
+    pdf.drawRightString(PAGE_WIDTH - MARGIN, y - 8 * mm, context['organization'])
+    pdf.setFont(regular, 11)
+    pdf.drawRightString(PAGE_WIDTH - MARGIN, y - 15 * mm, 'Donation Receipt')
+    
+    y -= 30 * mm
+    pdf.line(MARGIN, y, PAGE_WIDTH - MARGIN, y)
+    
+    y -= 12 * mm
+    for label, key in DETAIL_ROWS:
+        pdf.setFont(bold, 10)
+        pdf.drawString(MARGIN, y, label)
+        pdf.setFont(regular, 10)
+        pdf.drawString(MARGIN + 45 * mm, y, context[key])
+        y -= 8 * mm
+    
+    y -= 6 * mm
+    pdf.setFont(bold, 13)
+    pdf.drawString(MARGIN, y, 'Amount received')
+    pdf.drawRightString(PAGE_WIDTH - MARGIN, y, f"INR {context['amount']}")
+    
+    y -= 16 * mm
+    pdf.setFont(regular, 9)
+    pdf.drawString(MARGIN, y, f"Thank you for supporting {context['organization']}.")
+    pdf.drawString(MARGIN, y - 5 * mm, 'This is a computer-generated receipt and does not require a signature.')
+    
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def write_receipt(receipt):
+    """
+    Render and store the PDF for ``receipt`` unless its stored file already
+    matches the donation's current content.
+    
+    Returns:
+        True if a new PDF was written
+    """
+    
+    context = receipt_context(receipt.donation)
+    digest = content_hash(context)
+    if receipt.status == 'ready' and receipt.content_hash == digest and receipt.receipt_file:
+        return False
+    
+    previous = receipt.receipt_file.name
+    receipt.receipt_file.save(
+        f"{context['receipt_number']}.pdf", ContentFile(render_receipt(context)), save=False
+    )
+    receipt.content_hash = digest
+    receipt.status = 'ready'
+    receipt.generated_at = timezone.now()
+    receipt.save(update_fields=['receipt_file', 'content_hash', 'status', 'generated_at'])
+    
+    if previous and previous != receipt.receipt_file.name:
+        receipt.receipt_file.storage.delete(previous)
+    return True
+
+
+def _queued_key(donation_id):
+    return f'receipts:queued:{donation_id}'
+
+
+def queue_receipts(donation_ids):
+    """
+    Create any missing receipt rows and queue generation in worker-sized batches.
+    
+    Returns:
+        Number of tasks queued
+    """
+    from .tasks import generate_receipts
+    
+    donation_ids = list(donation_ids)
+    DonationReceipt.objects.bulk_create(
+        [DonationReceipt(donation_id=donation_id) for donation_id in donation_ids],
+        ignore_conflicts=True
+    )
+    
+    batches = [donation_ids[start:start + BATCH_SIZE] for start in range(0, len(donation_ids), BATCH_SIZE)]
+    for batch in batches:
+        transaction.on_commit(lambda batch=batch: generate_receipts.delay(batch))
+    return len(batches)
+
+
+def queue_receipt(donation):
+    """Queue one donation's receipt unless it is already waiting for a worker."""
+    if cache.add(_queued_key(donation.pk), True, QUEUE_TIMEOUT):
+        queue_receipts([donation.pk])
+
+
+def generate_batch(donation_ids):
+    """
+    Write the receipts for ``donation_ids``; a receipt that fails to render
+    is marked failed without affecting the rest of the batch.
+    
+    Returns:
+        Number of PDFs written
+    """
+    receipts = DonationReceipt.objects.filter(
+        donation_id__in=donation_ids,
+        donation__status='completed'
+    ).select_related('donation__donor', 'donation__campaign')
+    
+    written = 0
+    ready = []
+    for receipt in receipts:
+        try:
+            written += write_receipt(receipt)
+            ready.append(receipt.donation_id)
+        except Exception:
+            logger.exception('Receipt generation failed for donation %s', receipt.donation_id)
+            DonationReceipt.objects.filter(pk=receipt.pk).update(status='failed')
+    
+    Donation.objects.filter(pk__in=ready, receipt_sent=False).update(receipt_sent=True)
+    cache.delete_many([_queued_key(donation_id) for donation_id in donation_ids])
+    return written
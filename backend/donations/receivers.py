@@ -0,0 +1,52 @@
+"""
+Signal receivers maintaining the ledger, donor stats and donation leaderboards.
+"""
+from django.dispatch import receiver
+
+from .signals import donation_completed, donation_refunded, donations_imported
+from . import donor_stats, leaderboards, ledger
+
+
+@receiver(donation_completed)
+def enter_completed_donation(sender, donation, **kwargs):
+    ledger.record_completion(donation)
+
+
+@receiver(donations_imported)
+def enter_imported_donations(sender, donations, **kwargs):
+    ledger.record_completions(donations)
+
+
+@receiver(donation_refunded)
+def enter_refunded_donation(sender, donation, **kwargs):
+    ledger.record_refund(donation)
+
+
+@receiver(donation_completed)
+def count_donor_donation(sender, donation, **kwargs):
+    donor_stats.record_completed(donation)
+
+
+@receiver(donations_imported)
+def count_imported_donor_donations(sender, donations, **kwargs):
+    donor_stats.record_imported(donations)
+
+
+@receiver(donation_refunded)
+def uncount_donor_donation(sender, donation, **kwargs):
+    donor_stats.record_refunded(donation)
+
+
+@receiver(donation_completed)
+def rank_completed_donation(sender, donation, **kwargs):
+    leaderboards.record_donations([donation])
+
+
+@receiver(donations_imported)
+def rank_imported_donations(sender, donations, **kwargs):
+    leaderboards.record_donations(donations)
+
+
+@receiver(donation_refunded)
+def unrank_refunded_donation(sender, donation, **kwargs):
+    leaderboards.remove_donations([donation])
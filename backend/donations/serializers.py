@@ -2,8 +2,11 @@
 Serializers for Donation API.
 """
 from rest_framework import serializers
-from .models import Donation, DonationReceipt
+from .gateways import GATEWAYS, get_gateway
+from .models import Donation, DonationReceipt, LedgerEntry, RecurringPledge
+from users.models import User
 from users.serializers import UserProfileSerializer
+from campaigns.models import Campaign
 from campaigns.serializers import CampaignListSerializer
 
 
@@ -13,15 +16,23 @@ class DonationSerializer(serializers.ModelSerializer):
     donor = UserProfileSerializer(read_only=True)
     campaign = CampaignListSerializer(read_only=True)
     campaign_id = serializers.IntegerField(write_only=True)
+    checkout = serializers.SerializerMethodField()
     
     class Meta:
         model = Donation
         fields = (
             'id', 'transaction_id', 'donor', 'campaign', 'campaign_id',
             'amount', 'payment_method', 'status', 'message', 'is_anonymous',
-            'receipt_number', 'receipt_sent', 'created_at', 'completed_at'
+            'receipt_number', 'receipt_sent', 'created_at', 'completed_at', 'checkout'
         )
         read_only_fields = ('id', 'transaction_id', 'status', 'receipt_number', 'created_at', 'completed_at')
+    
+    def get_checkout(self, obj):
+        """Gateway checkout details while the donation awaits payment."""
+        if obj.status != 'pending' or not obj.payment_gateway_id:
+            return None
+        gateway = (obj.payment_gateway_response or {}).get('gateway')
+        return get_gateway(gateway).checkout(obj) if gateway in GATEWAYS else None
 
 
 class DonationCreateSerializer(serializers.ModelSerializer):
@@ -31,12 +42,68 @@ class DonationCreateSerializer(serializers.ModelSerializer):
         model = Donation
         fields = ('campaign', 'amount', 'payment_method', 'message', 'is_anonymous')
     
+    def validate_campaign(self, value):
+        if value.archived_at:
+            raise serializers.ValidationError("This campaign is archived")
+        return value
+    
     def validate_amount(self, value):
         if value <= 0:
             raise serializers.ValidationError("Amount must be greater than 0")
         return value
 
 
+class RecurringPledgeSerializer(serializers.ModelSerializer):
+    """Serializer for Recurring Pledge."""
+    
+    has_mandate = serializers.SerializerMethodField()
+    mandate_checkout = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = RecurringPledge
+        fields = (
+            'id', 'donor', 'campaign', 'amount', 'payment_method', 'frequency', 'status',
+            'message', 'is_anonymous', 'next_charge_at', 'last_charged_at', 'failure_count',
+            'has_mandate', 'mandate_checkout', 'created_at'
+        )
+        read_only_fields = ('id', 'donor', 'next_charge_at', 'last_charged_at', 'failure_count', 'created_at')
+    
+    def get_has_mandate(self, obj):
+        return bool(obj.payment_gateway_token)
+    
+    def get_mandate_checkout(self, obj):
+        """Checkout details of the first instalment while its payment is still to authorise the mandate."""
+        if obj.payment_gateway_token or not get_gateway().requires_mandate:
+            return None
+        donation = obj.donations.filter(status='pending').exclude(payment_gateway_id='').order_by('created_at').first()
+        return DonationSerializer().get_checkout(donation) if donation else None
+    
+    def validate_amount(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Amount must be greater than 0")
+        return value
+    
+    def validate_payment_method(self, value):
+        methods = get_gateway().recurring_methods
+        if methods is not None and value not in methods:
+            raise serializers.ValidationError("Recurring pledges cannot be paid with this method")
+        return value
+    
+    def validate_campaign(self, value):
+        if value.archived_at:
+            raise serializers.ValidationError("This campaign is archived")
+        if self.instance is not None and value != self.instance.campaign:
+            raise serializers.ValidationError("A pledge cannot be moved to another campaign")
+        return value
+    
+    def validate_status(self, value):
+        if self.instance is None and value != 'active':
+            raise serializers.ValidationError("New pledges must be active")
+        if self.instance is not None and self.instance.status == 'cancelled' and value != 'cancelled':
+            raise serializers.ValidationError("A cancelled pledge cannot be resumed")
+        return value
+
+
 class DonationReceiptSerializer(serializers.ModelSerializer):
     """Serializer for Donation Receipt."""
     
@@ -44,4 +111,52 @@ class DonationReceiptSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = DonationReceipt
-        fields = ('id', 'donation', 'receipt_file', 'generated_at')
+        fields = ('id', 'donation', 'receipt_file', 'status', 'generated_at')
+
+
+class LedgerEntrySerializer(serializers.ModelSerializer):
+    """Serializer for ledger entries."""
+    
+    class Meta:
+        model = LedgerEntry
+        fields = ('id', 'kind', 'campaign', 'donor', 'donation', 'amount', 'note', 'created_by', 'created_at')
+        read_only_fields = fields
+
+
+class LedgerCorrectionSerializer(serializers.Serializer):
+    """Input for a manual ledger correction."""
+    
+    campaign_id = serializers.IntegerField()
+    donor_id = serializers.IntegerField(required=False, allow_null=True)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    note = serializers.CharField()
+    
+    def validate_campaign_id(self, value):
+        if not Campaign.objects.filter(pk=value).exists():
+            raise serializers.ValidationError("Campaign does not exist")
+        return value
+    
+    def validate_donor_id(self, value):
+        if value is not None and not User.objects.filter(pk=value).exists():
+            raise serializers.ValidationError("Donor does not exist")
+        return value
+    
+    def validate_amount(self, value):
+        if value == 0:
+            raise serializers.ValidationError("Amount must not be zero")
+        return value
+
+
+class DonationExportSerializer(serializers.Serializer):
+    """Filters of a streamed donation export."""
+    
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    campaign = serializers.IntegerField(required=False)
+    status = serializers.ChoiceField(choices=Donation.STATUS_CHOICES, required=False)
+    payment_method = serializers.ChoiceField(choices=Donation.PAYMENT_METHOD_CHOICES, required=False)
+    
+    def validate(self, attrs):
+        if attrs.get('start_date') and attrs.get('end_date') and attrs['start_date'] > attrs['end_date']:
+            raise serializers.ValidationError("start_date must not be after end_date")
+        return attrs
@@ -0,0 +1,16 @@
+"""
+Signals for the donation lifecycle.
+"""
+from django.dispatch import Signal
+
+# Sent inside the saving transaction when a donation transitions to
+# ``completed``. Receivers get the ``donation`` instance.
+donation_completed = Signal()
+
+# Sent inside the saving transaction when a completed donation transitions
+# to ``refunded``. Receivers get the ``donation`` instance.
+donation_refunded = Signal()
+
+# Sent inside the import transaction after a bulk import inserts completed
+# donations without calling save(). Receivers get the list of ``donations``.
+donations_imported = Signal()
@@ -0,0 +1,99 @@
+"""
+Background tasks for Donations.
+"""
+from celery import shared_task
+
+import logging
+
+from . import archive, leaderboards, ledger, pledges
+from .gateways import GatewayError, GatewayRejected, get_gateway
+from .models import Donation
+from .partitions import ensure_partitions
+from .payments import drain_events
+from .receipts import generate_batch
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, max_retries=5)
+def create_gateway_order(self, donation_id):
+    """
+    Create the gateway order for a pending donation.
+    
+    Transient gateway failures are retried with backoff. A rejected request,
+    or one still failing after the last retry, fails the donation, since
+    without an order it can never be paid.
+    """
+    
+    donation = Donation.objects.filter(
+        pk=donation_id, status='pending', payment_gateway_id=''
+    ).select_related('pledge', 'donor').first()
+    if donation is None:
+        return
+    
+    gateway = get_gateway()
+    try:
+        order = gateway.create_order(donation)
+    except GatewayError as e:
+        if not isinstance(e, GatewayRejected) and self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=2 ** self.request.retries)
+        
+        logger.warning('Gateway order failed for donation %s: %s', donation.pk, e)
+        if Donation.objects.filter(pk=donation.pk, status='pending').update(status='failed') and donation.pledge_id:
+            pledges.record_failures([donation.pledge_id])
+        return
+    
+    Donation.objects.filter(pk=donation.pk).update(
+        payment_gateway_id=order['id'],
+        payment_gateway_response={'gateway': gateway.name, 'order': order}
+    )
+    donation.payment_gateway_id = order['id']
+    gateway.after_order(donation, order)
+
+
+@shared_task
+def drain_payment_events():
+    """Settle pending payment gateway events in batches."""
+    drain_events()
+
+
+@shared_task(acks_late=True)
+def generate_receipts(donation_ids):
+    """Render and store receipt PDFs for a batch of donations."""
+    return generate_batch(donation_ids)
+
+
+@shared_task
+def rebuild_leaderboards():
+    """Recompute every leaderboard from the database, correcting any drift."""
+    return leaderboards.rebuild()
+
+
+@shared_task
+def checkpoint_ledger():
+    """Record ledger checkpoints so balance reads only sum a short tail."""
+    return ledger.checkpoint()
+
+
+@shared_task
+def charge_due_pledges():
+    """Create and queue the charges of every recurring pledge that is due."""
+    return pledges.schedule_due()
+
+
+@shared_task(acks_late=True)
+def charge_pledge_donations(donation_ids):
+    """Charge a batch of pledge donations at the gateway."""
+    return pledges.charge_donations(donation_ids)
+
+
+@shared_task
+def create_donation_partitions():
+    """Create the donations partitions of the coming months ahead of time."""
+    return ensure_partitions()
+
+
+@shared_task
+def archive_donations():
+    """Move donations of long-completed campaigns to the Parquet archive."""
+    return archive.archive()
@@ -0,0 +1,1071 @@
+"""
+Tests for the Donations app.
+"""
+import asyncio
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from analytics import dashboard, exports, rollups
+from analytics.models import DonationRollup
+from campaigns import counters
+from campaigns.models import Campaign, CampaignCounterShard, CampaignDonor
+from users.models import User
+from . import archive, donor_stats, imports, leaderboards, ledger, partitions, payments, pledges, receipts
+from .models import (
+    ArchivedDonationTotal, ArchiveSegment, Donation, DonationReceipt, DonorStats, LedgerCheckpoint, LedgerEntry,
+    PaymentEvent, RecurringPledge
+)
+from .receipt_numbers import ReceiptNumberAllocator
+from .signals import donation_completed
+
+# In-process cache and leaderboards, so tests need no Redis; Celery tasks are
+# only queued on commit, which TestCase never reaches
+LOCAL_SERVICES = override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    LEADERBOARD_REDIS_URL='',
+)
+
+
+class DonationTestCase(TestCase):
+    """An admin, an alumnus and an active campaign."""
+    
+    def setUp(self):
+        # The in-process cache and boards outlive each test's rollback
+        cache.clear()
+        leaderboards._store = None
+        self.admin = User.objects.create_superuser('admin@example.com', 'password', name='Admin')
+        self.alumnus = User.objects.create_user('alumnus@example.com', 'password', name='Alumnus')
+        self.campaign = Campaign.objects.create(
+            title='Library', description='Books', goal=100000, deadline=datetime.date(2030, 1, 1),
+            status='active', category='Education', created_by=self.admin
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+    
+    def donate(self, amount, donor=None, **fields):
+        fields.setdefault('status', 'completed')
+        return Donation.objects.create(
+            donor=donor or self.alumnus, campaign=self.campaign, amount=amount, payment_method='upi', **fields
+        )
+
+
+@LOCAL_SERVICES
+class CampaignDeletionTests(DonationTestCase):
+    """Deleting campaigns and donors that have money history."""
+    
+    def test_campaign_without_donations_is_deleted(self):
+        response = self.api.delete(f'/api/campaigns/{self.campaign.pk}/')
+        
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Campaign.objects.filter(pk=self.campaign.pk).exists())
+    
+    def test_campaign_with_ledger_entries_is_kept(self):
+        self.donate(500)
+        
+        response = self.api.delete(f'/api/campaigns/{self.campaign.pk}/')
+        
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('error', response.data)
+        self.assertEqual(LedgerEntry.objects.filter(campaign=self.campaign).count(), 1)
+        self.assertEqual(Donation.objects.filter(campaign=self.campaign).count(), 1)
+    
+    def test_archived_campaign_is_kept(self):
+        Campaign.objects.filter(pk=self.campaign.pk).update(status='completed', archived_at=datetime.datetime(
+            2025, 1, 1, tzinfo=datetime.timezone.utc
+        ))
+        ArchiveSegment.objects.create(
+            campaign=self.campaign, month=datetime.date(2024, 6, 1),
+            path=f'year=2024/month=06/campaign={self.campaign.pk}.parquet', row_count=1, min_id=1, max_id=1
+        )
+        ArchivedDonationTotal.objects.create(
+            campaign=self.campaign, donor=self.alumnus, donation_count=1, total_amount=500
+        )
+        
+        response = self.api.delete(f'/api/campaigns/{self.campaign.pk}/')
+        
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(Campaign.objects.filter(pk=self.campaign.pk).exists())
+        self.assertEqual(ArchivedDonationTotal.objects.filter(campaign=self.campaign).count(), 1)
+    
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_admin_lists_ledger_entries_blocking_donor_deletion(self):
+        self.donate(500)
+        self.client.force_login(self.admin)
+        
+        response = self.client.post(f'/admin/users/user/{self.alumnus.pk}/delete/', {'post': 'yes'})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Cannot delete')
+        self.assertTrue(User.objects.filter(pk=self.alumnus.pk).exists())
+
+
+@LOCAL_SERVICES
+class LedgerTests(DonationTestCase):
+    """Ledger entries, checkpoints and balances."""
+    
+    def test_balance_is_checkpoint_plus_tail(self):
+        self.donate(100)
+        self.donate(200)
+        self.assertEqual(ledger.checkpoint(lag_seconds=0), 2)
+        self.donate(50)
+        
+        balance = ledger.balance('campaign', self.campaign.pk)
+        
+        checkpoint = LedgerCheckpoint.objects.get(campaign=self.campaign)
+        self.assertEqual(checkpoint.balance, 300)
+        self.assertEqual(balance['balance'], 350)
+        self.assertEqual(balance['entry_count'], 3)
+        self.assertEqual(balance['checkpoint_entry_id'], checkpoint.last_entry_id)
+        self.assertEqual(balance['tail_entries'], 1)
+        self.assertEqual(ledger.balance('donor', self.alumnus.pk)['balance'], 350)
+    
+    def test_checkpoint_builds_on_previous_checkpoint(self):
+        self.donate(100)
+        ledger.checkpoint(lag_seconds=0)
+        self.donate(25)
+        ledger.checkpoint(lag_seconds=0)
+        
+        latest = LedgerCheckpoint.objects.filter(campaign=self.campaign).order_by('-last_entry_id').first()
+        
+        self.assertEqual(latest.balance, 125)
+        self.assertEqual(latest.entry_count, 2)
+        self.assertEqual(ledger.balance('campaign', self.campaign.pk)['tail_entries'], 0)
+        self.assertEqual(ledger.checkpoint(lag_seconds=0), 0)
+    
+    def test_entries_are_append_only(self):
+        entry = LedgerEntry.objects.get(donation=self.donate(100))
+        
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+
+@LOCAL_SERVICES
+class RefundTests(DonationTestCase):
+    """Refunds reverse a donation everywhere it was counted."""
+    
+    def test_refund_reverses_raised(self):
+        refunded = self.donate(300)
+        self.donate(200)
+        counters.fold_shards()
+        
+        response = self.api.post(f'/api/donations/{refunded.pk}/refund/')
+        counters.fold_shards()
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'refunded')
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.raised, 200)
+        self.assertEqual(self.campaign.donation_count, 1)
+        self.assertEqual(self.campaign.donor_count, 1)
+        self.assertEqual(LedgerEntry.objects.get(donation=refunded, kind='refund').amount, -300)
+        self.assertEqual(ledger.balance('campaign', self.campaign.pk)['balance'], 200)
+    
+    def test_only_completed_donations_are_refunded(self):
+        pending = self.donate(300, status='pending')
+        
+        response = self.api.post(f'/api/donations/{pending.pk}/refund/')
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(LedgerEntry.objects.filter(donation=pending).exists())
+
+
+@LOCAL_SERVICES
+class DonorStatsTests(DonationTestCase):
+    """Per-donor aggregates kept in step and rebuilt with archived giving."""
+    
+    def setUp(self):
+        super().setUp()
+        self.archived_campaign = Campaign.objects.create(
+            title='Old gym', description='Weights', goal=1000, deadline=datetime.date(2020, 1, 1),
+            status='completed', category='Sports', created_by=self.admin,
+            archived_at=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+        )
+        self.archived_first = datetime.datetime(2019, 3, 1, tzinfo=datetime.timezone.utc)
+        self.archived_last = datetime.datetime(2019, 9, 1, tzinfo=datetime.timezone.utc)
+        ArchivedDonationTotal.objects.create(
+            campaign=self.archived_campaign, donor=self.alumnus, donation_count=3, total_amount=900,
+            first_completed_at=self.archived_first, last_completed_at=self.archived_last
+        )
+    
+    def stats(self, donor=None):
+        return DonorStats.objects.get(donor=donor or self.alumnus)
+    
+    def test_completions_and_refunds_update_the_row(self):
+        first = self.donate(100)
+        second = self.donate(300)
+        
+        stats = self.stats()
+        self.assertEqual((stats.donation_count, stats.total_amount, stats.campaigns_supported), (2, 400, 1))
+        self.assertEqual(stats.last_donation_at, second.completed_at)
+        
+        second.status = 'refunded'
+        second.save()
+        
+        stats = self.stats()
+        self.assertEqual((stats.donation_count, stats.total_amount, stats.campaigns_supported), (1, 100, 1))
+        self.assertEqual(stats.last_donation_at, first.completed_at)
+    
+    def test_refunding_the_last_live_donation_falls_back_to_archived_dates(self):
+        donation = self.donate(100)
+        
+        donation.status = 'refunded'
+        donation.save()
+        
+        self.assertEqual(self.stats().last_donation_at, self.archived_last)
+    
+    def test_rebuild_adds_archived_totals_back(self):
+        donation = self.donate(100)
+        other = User.objects.create_user('other@example.com', 'password', name='Other')
+        self.donate(50, donor=other, status='refunded')
+        DonorStats.objects.filter(donor=self.alumnus).update(donation_count=42, total_amount=1)
+        DonorStats.objects.create(donor=other, donation_count=5, total_amount=500)
+        out = io.StringIO()
+        
+        call_command('rebuild_donor_stats', chunk_size=1, stdout=out)
+        
+        self.assertIn('Rebuilt stats for 2 donors', out.getvalue())
+        stats = self.stats()
+        self.assertEqual((stats.donation_count, stats.total_amount, stats.campaigns_supported), (4, 1000, 2))
+        self.assertEqual(
+            (stats.first_donation_at, stats.last_donation_at), (self.archived_first, donation.completed_at)
+        )
+        # Donors without completed donations are reset rather than left stale
+        other_stats = self.stats(other)
+        self.assertEqual((other_stats.donation_count, other_stats.total_amount), (0, 0))
+        self.assertIsNone(other_stats.last_donation_at)
+    
+    def test_archived_totals_without_completed_donations_are_not_counted(self):
+        ArchivedDonationTotal.objects.filter(donor=self.alumnus).update(
+            donation_count=0, total_amount=0, first_completed_at=None, last_completed_at=None
+        )
+        
+        donor_stats.rebuild()
+        
+        stats = self.stats()
+        self.assertEqual((stats.donation_count, stats.campaigns_supported), (0, 0))
+
+
+@LOCAL_SERVICES
+class HistoryChartTests(DonationTestCase):
+    """Monthly donation history for charts."""
+    
+    def test_non_integer_months_is_rejected(self):
+        response = self.api.get('/api/donations/history-chart/?months=abc')
+        
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'months must be an integer')
+    
+    def test_out_of_range_months_is_clamped(self):
+        self.api.force_authenticate(self.alumnus)
+        self.donate(250)
+        
+        for months in ('100000000000', '0'):
+            with self.subTest(months=months):
+                response = self.api.get(f'/api/donations/history-chart/?months={months}')
+                
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([item['amount'] for item in response.data], [250.0])
+
+
+@LOCAL_SERVICES
+class IdempotencyTests(DonationTestCase):
+    """Idempotency-Key replay on donation creation."""
+    
+    def setUp(self):
+        super().setUp()
+        self.api.force_authenticate(self.alumnus)
+        self.body = {'campaign': self.campaign.pk, 'amount': '250.00', 'payment_method': 'upi'}
+    
+    def create(self, body, key='donation-1'):
+        return self.api.post('/api/donations/create/', body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    def test_retry_replays_the_first_response(self):
+        first = self.create(self.body)
+        retry = self.create(self.body)
+        
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Donation.objects.count(), 1)
+    
+    def test_key_reused_with_another_body_is_rejected(self):
+        self.create(self.body)
+        
+        response = self.create({**self.body, 'amount': '300.00'})
+        
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Donation.objects.count(), 1)
+    
+    def test_keys_are_scoped_per_donor(self):
+        self.create(self.body)
+        self.api.force_authenticate(self.admin)
+        
+        response = self.create(self.body)
+        
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Donation.objects.count(), 2)
+
+
+@override_settings(FINANCIAL_YEAR_START_MONTH=4)
+class ReceiptNumberTests(TestCase):
+    """Receipt numbers handed out from per-process blocks."""
+    
+    def test_allocators_take_separate_blocks(self):
+        # A year no other test numbers in: PostgreSQL sequences survive test
+        # rollbacks, and tests dated relative to today reach recent years
+        when = datetime.datetime(2005, 6, 1, tzinfo=datetime.timezone.utc)
+        first, second = ReceiptNumberAllocator(block_size=3), ReceiptNumberAllocator(block_size=3)
+        
+        numbers = [first.allocate(when), second.allocate(when), first.allocate(when), first.allocate(when)]
+        numbers.append(first.allocate(when))
+        
+        self.assertEqual(numbers, [
+            'RCP-2005-06-0000001', 'RCP-2005-06-0000004', 'RCP-2005-06-0000002',
+            'RCP-2005-06-0000003', 'RCP-2005-06-0000007',
+        ])
+    
+    def test_each_financial_year_has_its_own_sequence(self):
+        allocator = ReceiptNumberAllocator(block_size=3)
+        
+        # Years no other test numbers in: PostgreSQL sequences survive test rollbacks
+        march = allocator.allocate(datetime.datetime(2019, 3, 15, tzinfo=datetime.timezone.utc))
+        april = allocator.allocate(datetime.datetime(2019, 4, 15, tzinfo=datetime.timezone.utc))
+        
+        self.assertEqual(march, 'RCP-2018-19-0000001')
+        self.assertEqual(april, 'RCP-2019-20-0000001')
+
+
+@LOCAL_SERVICES
+class ReceiptAllocationTests(DonationTestCase):
+    """Donations are numbered when they complete."""
+    
+    def test_numbers_are_allocated_on_completion(self):
+        donation = self.donate(100, status='pending')
+        self.assertIsNone(donation.receipt_number)
+        
+        donation.status = 'completed'
+        donation.save(update_fields=['status'])
+        
+        donation.refresh_from_db()
+        self.assertTrue(donation.receipt_number.startswith('RCP-'))
+        self.assertNotEqual(self.donate(100).receipt_number, donation.receipt_number)
+
+
+@LOCAL_SERVICES
+@mock.patch('donations.tasks.generate_receipts.delay')
+class ReceiptGenerationTests(DonationTestCase):
+    """PDF receipts queued from the view and written by the workers."""
+    
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        
+        self.donation = self.donate(100)
+        self.url = f'/api/donations/{self.donation.pk}/receipt/'
+    
+    def test_view_queues_a_receipt_once_until_it_is_written(self, delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.api.get(self.url)
+            second = self.api.post(self.url)
+        
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        delay.assert_called_once_with([self.donation.pk])
+        
+        receipts.generate_batch([self.donation.pk])
+        response = self.api.get(self.url)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.donation.refresh_from_db()
+        self.assertTrue(self.donation.receipt_sent)
+        self.assertEqual(self.api.post(self.url).data['status'], 'ready')
+    
+    def test_unchanged_receipts_are_not_rewritten(self, delay):
+        receipts.queue_receipts([self.donation.pk])
+        
+        self.assertEqual(receipts.generate_batch([self.donation.pk]), 1)
+        self.assertEqual(receipts.generate_batch([self.donation.pk]), 0)
+        
+        receipt = DonationReceipt.objects.get(donation=self.donation)
+        previous = receipt.receipt_file.path
+        Campaign.objects.filter(pk=self.campaign.pk).update(title='Library wing')
+        
+        self.assertEqual(receipts.generate_batch([self.donation.pk]), 1)
+        receipt.refresh_from_db()
+        self.assertEqual(receipt.content_hash, receipts.content_hash(receipts.receipt_context(receipt.donation)))
+        self.assertFalse(os.path.exists(previous))
+        self.assertTrue(os.path.exists(receipt.receipt_file.path))
+    
+    def test_failed_render_leaves_the_rest_of_the_batch(self, delay):
+        other = self.donate(200)
+        receipts.queue_receipts([self.donation.pk, other.pk])
+        render = receipts.render_receipt
+        
+        def failing_render(context):
+            if context['receipt_number'] == other.receipt_number:
+                raise ValueError('Bad font')
+            return render(context)
+        
+        with mock.patch.object(receipts, 'render_receipt', failing_render), \
+                self.assertLogs('donations.receipts', 'ERROR'):
+            self.assertEqual(receipts.generate_batch([self.donation.pk, other.pk]), 1)
+        
+        self.assertEqual(
+            dict(DonationReceipt.objects.values_list('donation_id', 'status')),
+            {self.donation.pk: 'ready', other.pk: 'failed'}
+        )
+        self.assertEqual(list(Donation.objects.filter(receipt_sent=True)), [self.donation])
+    
+    def test_pending_donations_and_other_donors_are_refused(self, delay):
+        pending = self.donate(100, status='pending')
+        
+        self.assertEqual(self.api.get(f'/api/donations/{pending.pk}/receipt/').status_code, 400)
+        self.api.force_authenticate(User.objects.create_user('other@example.com', 'password', name='Other'))
+        self.assertEqual(self.api.get(self.url).status_code, 403)
+
+
+@LOCAL_SERVICES
+class CompletedBetweenTests(DonationTestCase):
+    """Completion-date queries bounded on created_at."""
+    
+    def test_late_settlements_are_included(self):
+        now = datetime.datetime(2026, 6, 15, tzinfo=datetime.timezone.utc)
+        recent = self.donate(100, created_at=now - datetime.timedelta(days=2), completed_at=now)
+        late = self.donate(200, status='pending', created_at=now - datetime.timedelta(days=400))
+        late.status = 'completed'
+        late.completed_at = now
+        late.save()
+        self.donate(300, created_at=now - datetime.timedelta(days=60), completed_at=now - datetime.timedelta(days=59))
+        
+        donations = Donation.objects.completed_between(now - datetime.timedelta(days=30))
+        
+        self.assertTrue(late.settled_late)
+        self.assertEqual(set(donations), {recent, late})
+        self.assertEqual(set(donations.completed_between(end=now)), set())
+
+
+@LOCAL_SERVICES
+@override_settings(FINANCIAL_YEAR_START_MONTH=4)
+class PartitionFallbackTests(DonationTestCase):
+    """Keys stay unique across months on an unpartitioned (non-PostgreSQL or unconverted) table."""
+    
+    def setUp(self):
+        super().setUp()
+        self.june = datetime.datetime(2016, 6, 15, tzinfo=datetime.timezone.utc)
+        self.march = datetime.datetime(2017, 3, 15, tzinfo=datetime.timezone.utc)
+    
+    def test_table_is_left_unpartitioned(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('the test database is not converted')
+        
+        self.assertFalse(partitions.is_partitioned())
+        self.assertEqual(partitions.ensure_partitions(), [])
+        with self.assertRaises(CommandError):
+            call_command('partition_donations', stdout=io.StringIO())
+    
+    def test_ids_come_from_one_sequence_across_months(self):
+        donations = [
+            self.donate(100, created_at=when, completed_at=when) for when in (self.march, self.june, timezone.now())
+        ]
+        
+        ids = [donation.pk for donation in donations]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 3)
+    
+    def test_duplicate_keys_in_other_months_are_rejected(self):
+        donation = self.donate(100, created_at=self.june, completed_at=self.june)
+        
+        for field in ('transaction_id', 'receipt_number'):
+            with self.subTest(field=field):
+                with self.assertRaises(IntegrityError), transaction.atomic():
+                    self.donate(100, created_at=self.march, completed_at=self.march, **{
+                        field: getattr(donation, field)
+                    })
+    
+    def test_receipt_numbers_follow_the_completion_year(self):
+        june = self.donate(100, created_at=self.june, completed_at=self.june)
+        march = self.donate(100, created_at=self.march, completed_at=self.march)
+        later = self.donate(100, created_at=self.june, completed_at=self.june)
+        
+        self.assertTrue(june.receipt_number.startswith('RCP-2016-17-'))
+        self.assertTrue(march.receipt_number.startswith('RCP-2016-17-'))
+        self.assertEqual(len({june.receipt_number, march.receipt_number, later.receipt_number}), 3)
+        self.assertEqual(
+            Donation.objects.get(receipt_number=march.receipt_number, created_at__gte=self.march), march
+        )
+
+
+@LOCAL_SERVICES
+class CursorPaginationTests(DonationTestCase):
+    """Keyset pagination of the donation list."""
+    
+    def test_pages_cover_every_donation_once(self):
+        donations = [self.donate(amount) for amount in range(1, 6)]
+        # Equal timestamps are ordered by id
+        Donation.objects.filter(pk__in=[donation.pk for donation in donations[1:4]]).update(
+            created_at=donations[1].created_at
+        )
+        expected = [
+            donation.pk for donation in sorted(
+                Donation.objects.all(), key=lambda donation: (donation.created_at, donation.pk), reverse=True
+            )
+        ]
+        
+        seen = []
+        response = self.api.get('/api/donations/?page_size=2')
+        self.assertEqual(response.data['count'], 5)
+        self.assertIsNone(response.data['previous'])
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if response.data['next'] is None:
+                break
+            response = self.api.get(response.data['next'])
+        
+        self.assertEqual(seen, expected)
+    
+    def test_previous_link_returns_the_page_before(self):
+        for amount in range(1, 6):
+            self.donate(amount)
+        first = self.api.get('/api/donations/?page_size=2')
+        second = self.api.get(first.data['next'])
+        
+        previous = self.api.get(second.data['previous'])
+        
+        self.assertEqual(
+            [row['id'] for row in previous.data['results']],
+            [row['id'] for row in first.data['results']]
+        )
+    
+    def test_invalid_cursor_is_rejected(self):
+        response = self.api.get('/api/donations/?cursor=not-a-cursor')
+        
+        self.assertEqual(response.status_code, 400)
+
+
+@LOCAL_SERVICES
+class CounterShardTests(DonationTestCase):
+    """Campaign totals counted in shards and folded periodically."""
+    
+    def test_fold_moves_shard_totals_into_the_campaign(self):
+        other = User.objects.create_user('other@example.com', 'password', name='Other')
+        self.donate(100)
+        self.donate(300)
+        self.donate(200, donor=other)
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.raised, 0)
+        self.assertEqual(counters.pending_totals(self.campaign.pk)[:2], (600, 3))
+        
+        self.assertEqual(counters.fold_shards(), 1)
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.raised, 600)
+        self.assertEqual(self.campaign.donation_count, 3)
+        self.assertEqual(self.campaign.donor_count, 2)
+        self.assertEqual(self.campaign.average_donation, 200)
+        self.assertFalse(CampaignCounterShard.objects.exclude(amount=0, donation_count=0, donor_count=0).exists())
+        self.assertEqual(counters.fold_shards(), 0)
+    
+    def test_folds_accumulate(self):
+        self.donate(100)
+        counters.fold_shards()
+        self.donate(300)
+        counters.fold_shards()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.raised, 400)
+        self.assertEqual(self.campaign.donation_count, 2)
+        self.assertEqual(self.campaign.donor_count, 1)
+        self.assertEqual(self.campaign.average_donation, 200)
+    
+    def test_donor_refunding_their_only_donation_leaves_and_rejoins(self):
+        refunded = self.donate(100)
+        self.api.post(f'/api/donations/{refunded.pk}/refund/')
+        counters.fold_shards()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.donor_count, 0)
+        
+        self.donate(200)
+        counters.fold_shards()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.donor_count, 1)
+        self.assertEqual(CampaignDonor.objects.get(campaign=self.campaign, donor=self.alumnus).donation_count, 1)
+    
+    def test_refresh_rebuilds_donor_rows(self):
+        self.donate(100)
+        CampaignDonor.objects.all().delete()
+        
+        counters.refresh_counters()
+        self.donate(200)
+        counters.fold_shards()
+        
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.donor_count, 1)
+        self.assertEqual(CampaignDonor.objects.get(campaign=self.campaign, donor=self.alumnus).donation_count, 2)
+
+
+@LOCAL_SERVICES
+class PaymentEventTests(DonationTestCase):
+    """Settling recorded payment gateway events."""
+    
+    def event(self, order_id, outcome='captured', event_id=None, **fields):
+        return PaymentEvent.objects.create(
+            gateway='stub', event_id=event_id or f'{outcome}:{order_id}', order_id=order_id, outcome=outcome, **fields
+        )
+    
+    def test_captured_event_completes_donation(self):
+        donation = self.donate(400, status='pending', payment_gateway_id='order_1')
+        event = self.event('order_1', payload={'id': 'pay_1'})
+        
+        self.assertEqual(payments.process_batch(), 1)
+        
+        donation.refresh_from_db()
+        event.refresh_from_db()
+        self.assertEqual(donation.status, 'completed')
+        self.assertIsNotNone(donation.receipt_number)
+        self.assertEqual(donation.payment_gateway_response['payment'], {'id': 'pay_1'})
+        self.assertIsNotNone(event.processed_at)
+        self.assertEqual(LedgerEntry.objects.get(donation=donation).amount, 400)
+    
+    def test_failure_after_capture_is_ignored(self):
+        donation = self.donate(400, status='pending', payment_gateway_id='order_1')
+        self.event('order_1')
+        self.event('order_1', outcome='failed')
+        
+        payments.drain_events()
+        
+        donation.refresh_from_db()
+        self.assertEqual(donation.status, 'completed')
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+    
+    def test_unmatched_event_is_retried_later(self):
+        event = self.event('order_unknown')
+        
+        self.assertEqual(payments.drain_events(), 1)
+        
+        event.refresh_from_db()
+        self.assertIsNone(event.processed_at)
+        self.assertIsNotNone(event.retry_at)
+        
+        # The order is stored after its webhook arrived
+        donation = self.donate(400, status='pending', payment_gateway_id='order_unknown')
+        PaymentEvent.objects.filter(pk=event.pk).update(retry_at=event.received_at)
+        payments.drain_events()
+        
+        donation.refresh_from_db()
+        self.assertEqual(donation.status, 'completed')
+    
+    def test_long_unmatched_event_is_orphaned(self):
+        event = self.event('order_unknown')
+        PaymentEvent.objects.filter(pk=event.pk).update(
+            received_at=event.received_at - payments.UNMATCHED_ORPHAN_AFTER - datetime.timedelta(minutes=1)
+        )
+        
+        with self.assertLogs('donations.payments', 'ERROR'):
+            payments.drain_events()
+        
+        event.refresh_from_db()
+        self.assertTrue(event.orphaned)
+        self.assertIsNotNone(event.processed_at)
+    
+    def test_captured_authorisation_stores_pledge_mandate(self):
+        pledge = RecurringPledge.objects.create(
+            donor=self.alumnus, campaign=self.campaign, amount=100, payment_method='upi',
+            next_charge_at=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+        )
+        self.donate(100, status='pending', pledge=pledge, payment_gateway_id='order_1')
+        PaymentEvent.objects.create(
+            gateway='razorpay', event_id='payment.captured:pay_1', order_id='order_1', outcome='captured',
+            payload={'id': 'pay_1', 'customer_id': 'cust_1', 'token_id': 'token_1'}
+        )
+        
+        payments.process_batch()
+        
+        pledge.refresh_from_db()
+        self.assertEqual(pledge.payment_gateway_customer_id, 'cust_1')
+        self.assertEqual(pledge.payment_gateway_token, 'token_1')
+    
+    def test_failing_event_does_not_hold_up_the_batch(self):
+        failing = self.donate(100, status='pending', payment_gateway_id='order_1')
+        donation = self.donate(200, status='pending', payment_gateway_id='order_2')
+        event = self.event('order_1')
+        self.event('order_2')
+        
+        def fail_first(sender, donation, **kwargs):
+            if donation.pk == failing.pk:
+                raise RuntimeError('receiver failed')
+        
+        donation_completed.connect(fail_first)
+        self.addCleanup(donation_completed.disconnect, fail_first)
+        with self.assertLogs('donations.payments', 'ERROR'):
+            self.assertEqual(payments.process_batch(), 2)
+        
+        failing.refresh_from_db()
+        donation.refresh_from_db()
+        event.refresh_from_db()
+        self.assertEqual(failing.status, 'pending')
+        self.assertFalse(LedgerEntry.objects.filter(donation=failing).exists())
+        self.assertEqual(donation.status, 'completed')
+        self.assertEqual((event.attempts, event.processed_at), (1, None))
+        self.assertGreater(event.retry_at, event.received_at)
+        self.assertIn('receiver failed', event.error)
+    
+    def test_event_is_given_up_after_repeated_failures(self):
+        self.donate(100, status='pending', payment_gateway_id='order_1')
+        event = self.event('order_1', attempts=payments.SETTLE_MAX_ATTEMPTS - 1)
+        
+        with mock.patch.object(payments, '_settle', side_effect=RuntimeError('still failing')):
+            with self.assertLogs('donations.payments', 'ERROR'):
+                payments.drain_events()
+        
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, payments.SETTLE_MAX_ATTEMPTS)
+        self.assertIsNotNone(event.processed_at)
+        self.assertFalse(event.orphaned)
+
+
+@LOCAL_SERVICES
+class PledgeFailureTests(DonationTestCase):
+    """Failing pledge charges."""
+    
+    def test_only_pending_donations_are_failed(self):
+        pledge = RecurringPledge.objects.create(
+            donor=self.alumnus, campaign=self.campaign, amount=100, payment_method='upi',
+            next_charge_at=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc)
+        )
+        pending = self.donate(100, status='pending', pledge=pledge)
+        # Settled by its webhook while the charge was reported failed
+        settled = self.donate(100, pledge=pledge)
+        
+        pledges._fail([pending, settled])
+        
+        pending.refresh_from_db()
+        settled.refresh_from_db()
+        pledge.refresh_from_db()
+        self.assertEqual(pending.status, 'failed')
+        self.assertEqual(settled.status, 'completed')
+        self.assertEqual(pledge.failure_count, 1)
+
+
+@LOCAL_SERVICES
+class ImportTests(DonationTestCase):
+    """Bulk import of offline donations."""
+    
+    def test_import_reaches_rollups_by_segment(self):
+        other = User.objects.create_user('other@example.com', 'password', name='Other')
+        self.donate(100, completed_at=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        rows = [
+            'donor_email,campaign_id,amount,completed_at',
+            f'alumnus@example.com,{self.campaign.pk},200,2024-02-01',
+            f'other@example.com,{self.campaign.pk},300,2024-02-01',
+            f'other@example.com,{self.campaign.pk},400,2024-03-01',
+            f'missing@example.com,{self.campaign.pk},500,2024-03-01',
+        ]
+        
+        with mock.patch.object(rollups, 'record_donations', wraps=rollups.record_donations) as record:
+            report = imports.import_donations(io.StringIO('\n'.join(rows)))
+        
+        self.assertEqual((report.imported, report.failed), (3, 1))
+        self.assertEqual(report.errors[0]['row'], 4)
+        record.assert_called_once()
+        self.assertEqual(len(record.call_args.args[0]), 3)
+        
+        segments = dict(Donation.objects.filter(
+            payment_method=imports.DEFAULT_PAYMENT_METHOD
+        ).values_list('amount', 'donor_segment'))
+        self.assertEqual(segments, {200: 'repeat', 300: 'first_time', 400: 'repeat'})
+        self.assertEqual(
+            {
+                (rollup.day.month, rollup.donor_segment): (rollup.total_amount, rollup.donation_count)
+                for rollup in DonationRollup.objects.filter(campaign=self.campaign)
+            },
+            {(2, 'repeat'): (200, 1), (2, 'first_time'): (300, 1), (3, 'repeat'): (400, 1)}
+        )
+        self.assertEqual(Donation.objects.filter(donor=other).count(), 2)
+
+
+@LOCAL_SERVICES
+class LeaderboardTests(DonationTestCase):
+    """Leaderboards kept in the in-process store."""
+    
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other@example.com', 'password', name='Other')
+    
+    @contextlib.contextmanager
+    def committed(self):
+        """Run the board writes queued for commit; the other callbacks would queue Celery tasks."""
+        
+        with self.captureOnCommitCallbacks() as callbacks:
+            yield
+        for callback in callbacks:
+            if callback.__module__ == leaderboards.__name__:
+                callback()
+    
+    def donate(self, amount, donor=None, **fields):
+        with self.committed():
+            return super().donate(amount, donor, **fields)
+    
+    def ranks(self):
+        return [(int(member), amount, count) for member, amount, count in leaderboards.top('campaign', self.campaign.pk)]
+    
+    def test_completion_and_refund_update_ranks(self):
+        self.donate(300, donor=self.other)
+        first = self.donate(200)
+        self.donate(200)
+        
+        self.assertEqual(self.ranks(), [(self.alumnus.pk, 400, 2), (self.other.pk, 300, 1)])
+        
+        with self.committed():
+            self.api.post(f'/api/donations/{first.pk}/refund/')
+        
+        self.assertEqual(self.ranks(), [(self.other.pk, 300, 1), (self.alumnus.pk, 200, 1)])
+    
+    def test_donor_refunded_to_nothing_leaves_the_board(self):
+        donation = self.donate(300)
+        
+        with self.committed():
+            self.api.post(f'/api/donations/{donation.pk}/refund/')
+        
+        self.assertEqual(self.ranks(), [])
+    
+    def test_rebuild_replays_changes_made_while_it_runs(self):
+        self.donate(100)
+        late = super().donate(500, donor=self.other, status='pending')
+        compute_boards = leaderboards.compute_boards
+        
+        def concurrent_compute_boards():
+            # Journaled after the watermark and also in the snapshot: counted once
+            self.donate(50)
+            boards = compute_boards()
+            # Journaled after the watermark but completed after the snapshot: replayed
+            with self.committed():
+                leaderboards.record_donations([late])
+            return boards
+        
+        with mock.patch.object(leaderboards, 'compute_boards', concurrent_compute_boards):
+            leaderboards.rebuild()
+        
+        self.assertEqual(self.ranks(), [(self.other.pk, 500, 1), (self.alumnus.pk, 150, 2)])
+        
+        # A rebuild with nothing in flight agrees
+        Donation.objects.filter(pk=late.pk).update(status='completed')
+        leaderboards.rebuild()
+        self.assertEqual(self.ranks(), [(self.other.pk, 500, 1), (self.alumnus.pk, 150, 2)])
+
+
+@LOCAL_SERVICES
+class ArchiveTests(DonationTestCase):
+    """Campaigns moved to the Parquet archive keep their donations readable and their totals counted."""
+    
+    def setUp(self):
+        super().setUp()
+        archive_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, archive_root)
+        archive_settings = override_settings(DONATION_ARCHIVE_ROOT=archive_root)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+        
+        self.old = Campaign.objects.create(
+            title='Old gym', description='Weights', goal=1000, deadline=datetime.date(2030, 1, 1),
+            status='active', category='Sports', created_by=self.admin
+        )
+        self.other = User.objects.create_user('other@example.com', 'password', name='Other')
+        march = datetime.datetime(2017, 3, 10, tzinfo=datetime.timezone.utc)
+        may = datetime.datetime(2017, 5, 10, tzinfo=datetime.timezone.utc)
+        self.archived = [
+            self.donate(100, campaign=self.old, created_at=march, completed_at=march),
+            self.donate(200, campaign=self.old, created_at=may, completed_at=may,
+                        payment_gateway_response={'gateway': 'test', 'order': {'id': 'order_1'}}),
+            self.donate(50, donor=self.other, campaign=self.old, status='refunded', created_at=may),
+        ]
+        self.live = self.donate(25)
+        counters.fold_shards()
+        Campaign.objects.filter(pk=self.old.pk).update(status='completed', deadline=datetime.date(2020, 1, 1))
+    
+    def donate(self, amount, donor=None, campaign=None, **fields):
+        fields.setdefault('status', 'completed')
+        return Donation.objects.create(
+            donor=donor or self.alumnus, campaign=campaign or self.campaign, amount=amount, payment_method='upi',
+            **fields
+        )
+    
+    def test_round_trip(self):
+        out = io.StringIO()
+        
+        call_command('archive_donations', stdout=out)
+        
+        self.assertIn('Archived 3 donations of 1 campaigns', out.getvalue())
+        self.assertEqual(list(Donation.objects.all()), [self.live])
+        self.assertEqual(
+            list(ArchiveSegment.objects.values_list('month', 'row_count')),
+            [(datetime.date(2017, 3, 1), 1), (datetime.date(2017, 5, 1), 2)]
+        )
+        for segment in ArchiveSegment.objects.all():
+            self.assertTrue((archive.archive_root() / segment.path).exists())
+        
+        fields = (
+            'pk', 'donor_id', 'amount', 'status', 'receipt_number', 'created_at', 'completed_at',
+            'payment_gateway_response'
+        )
+        restored = sorted(archive.donations(campaign_id=self.old.pk), key=lambda donation: donation.pk)
+        self.assertEqual(
+            [tuple(getattr(donation, field) for field in fields) for donation in restored],
+            [tuple(getattr(donation, field) for field in fields) for donation in self.archived]
+        )
+        self.assertEqual(
+            [donation.transaction_id for donation in restored],
+            [str(donation.transaction_id) for donation in self.archived]
+        )
+        self.assertTrue(all(donation.archived for donation in restored))
+    
+    def test_totals_are_preserved(self):
+        self.old.refresh_from_db()
+        raised = self.old.raised
+        
+        archive.archive()
+        
+        self.assertEqual(
+            {
+                row['donor_id']: (row['donation_count'], row['total_amount'])
+                for row in ArchivedDonationTotal.objects.values('donor_id', 'donation_count', 'total_amount')
+            },
+            {self.alumnus.pk: (2, 300), self.other.pk: (0, 0)}
+        )
+        self.old.refresh_from_db()
+        self.assertIsNotNone(self.old.archived_at)
+        self.assertEqual(self.old.raised, raised)
+        
+        donor_stats.rebuild()
+        stats = DonorStats.objects.get(donor=self.alumnus)
+        self.assertEqual((stats.donation_count, stats.total_amount, stats.campaigns_supported), (3, 325, 2))
+        
+        totals = dashboard.compute_dashboard(None)['donations']
+        self.assertEqual((totals['total_amount'], totals['total_count']), (325, 3))
+    
+    def test_donor_history_reads_the_archive(self):
+        archive.archive()
+        self.api.force_authenticate(self.alumnus)
+        
+        response = self.api.get('/api/donations/')
+        
+        self.assertEqual(
+            [row['id'] for row in response.data['results']],
+            [self.live.pk, self.archived[1].pk, self.archived[0].pk]
+        )
+        detail = self.api.get(f'/api/donations/{self.archived[0].pk}/')
+        self.assertEqual(detail.status_code, 200)
+        self.assertEqual(float(detail.data['amount']), 100)
+        self.assertEqual(self.api.get(f'/api/donations/{self.archived[2].pk}/').status_code, 404)
+    
+    def test_failed_archive_leaves_the_campaign_in_place(self):
+        with mock.patch.object(ArchivedDonationTotal.objects, 'bulk_create', side_effect=archive.ArchiveError):
+            with self.assertRaises(archive.ArchiveError):
+                archive.archive_campaign(self.old)
+        
+        self.old.refresh_from_db()
+        self.assertIsNone(self.old.archived_at)
+        self.assertEqual(Donation.objects.filter(campaign=self.old).count(), 3)
+        self.assertFalse(ArchiveSegment.objects.exists())
+        self.assertEqual(list(archive.archive_root().rglob('*.parquet*')), [])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class DonationExportASGITests(TransactionTestCase):
+    """The streamed CSV export under the ASGI application."""
+    
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin@example.com', 'password', name='Admin')
+        # bulk_create skips the signals that queue Celery tasks
+        campaign, = Campaign.objects.bulk_create([Campaign(
+            title='Library', description='Books', goal=100000, deadline=datetime.date(2030, 1, 1),
+            status='active', category='education', created_by=self.admin
+        )])
+        Donation.objects.bulk_create([
+            Donation(
+                donor=self.admin, campaign=campaign, amount=index + 1, payment_method='upi',
+                status='completed', receipt_number=f'TEST-{index}'
+            )
+            for index in range(25)
+        ])
+    
+    async def _get(self, path, events):
+        """Call the ASGI application directly, logging each body it sends to ``events``."""
+        
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.admin).access_token))()
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+            'client': ('127.0.0.1', 1234),
+            'server': ('testserver', 80),
+        }
+        messages = []
+        requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        
+        async def receive():
+            if requests:
+                return requests.pop()
+            # The client stays connected; Django cancels this once the response is sent
+            await asyncio.Event().wait()
+        
+        async def send(message):
+            messages.append(message)
+            if message.get('body'):
+                events.append('send')
+        
+        await get_asgi_application()(scope, receive, send)
+        return messages
+    
+    async def test_streams_chunks_under_asgi(self):
+        events = []
+        write = exports._Echo.write
+        
+        def logged_write(echo, value):
+            events.append('row')
+            return write(echo, value)
+        
+        with mock.patch.object(exports, 'STREAM_CHUNK_SIZE', 10), \
+                mock.patch.object(exports._Echo, 'write', logged_write):
+            messages = await self._get('/api/donations/export/', events)
+        
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertTrue(body.startswith(b'id,transaction_id'))
+        self.assertEqual(body.count(b'\n'), 26)
+        # The header and first chunks go out before the last rows are read, not as one buffered body
+        self.assertLess(events.index('send'), len(events) - 1 - events[::-1].index('row'))
+        self.assertEqual(events.count('send'), 4)
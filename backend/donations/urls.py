@@ -6,9 +6,18 @@ from .views import (
     DonationListView,
     DonationCreateView,
     DonationDetailView,
+    PledgeListCreateView,
+    PledgeDetailView,
+    bulk_import_donations,
+    export_donations,
+    refund_donation,
+    ledger_correction,
+    ledger_balance,
+    payment_webhook,
     donation_statistics,
     donation_history_chart,
     campaign_leaderboard,
+    leaderboard,
     generate_receipt
 )
 
@@ -17,9 +26,35 @@ app_name = 'donations'
 urlpatterns = [
     path('', DonationListView.as_view(), name='donation-list'),
     path('create/', DonationCreateView.as_view(), name='donation-create'),
+    path('import/', bulk_import_donations, name='donation-import'),
+    path('export/', export_donations, name='donation-export'),
+    path('webhooks/<str:gateway>/', payment_webhook, name='payment-webhook'),
     path('<int:pk>/', DonationDetailView.as_view(), name='donation-detail'),
+    path('pledges/', PledgeListCreateView.as_view(), name='pledge-list'),
+    path('pledges/<int:pk>/', PledgeDetailView.as_view(), name='pledge-detail'),
     path('statistics/', donation_statistics, name='donation-statistics'),
     path('history-chart/', donation_history_chart, name='donation-history-chart'),
     path('campaign/<int:campaign_id>/leaderboard/', campaign_leaderboard, name='campaign-leaderboard'),
+    path('leaderboards/donors/', leaderboard, {'scope': 'donors'}, name='donor-leaderboard'),
+    path('leaderboards/departments/', leaderboard, {'scope': 'departments'}, name='department-leaderboard'),
+    path(
+        'leaderboards/departments/<str:key>/', leaderboard, {'scope': 'department'},
+        name='department-donor-leaderboard'
+    ),
+    path(
+        'leaderboards/graduation-years/', leaderboard, {'scope': 'graduation_years'},
+        name='graduation-year-leaderboard'
+    ),
+    path(
+        'leaderboards/graduation-years/<str:key>/', leaderboard, {'scope': 'graduation_year'},
+        name='graduation-year-donor-leaderboard'
+    ),
     path('<int:donation_id>/receipt/', generate_receipt, name='generate-receipt'),
+    path('<int:donation_id>/refund/', refund_donation, name='refund-donation'),
+    path('ledger/corrections/', ledger_correction, name='ledger-correction'),
+    path(
+        'ledger/campaigns/<int:object_id>/balance/', ledger_balance, {'scope': 'campaign'},
+        name='campaign-ledger-balance'
+    ),
+    path('ledger/donors/<int:object_id>/balance/', ledger_balance, {'scope': 'donor'}, name='donor-ledger-balance'),
 ]
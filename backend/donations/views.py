@@ -3,14 +3,40 @@ Views for Donation API.
 """
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from django.db.models import Sum, Count, Q
+from rest_framework.decorators import (
+    api_view, authentication_classes, permission_classes, parser_classes, renderer_classes
+)
+from rest_framework.parsers import MultiPartParser
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Sum, Q
+from django.db.models.functions import TruncMonth
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import timedelta
+import json
 
-from .models import Donation, DonationReceipt
-from .serializers import DonationSerializer, DonationCreateSerializer, DonationReceiptSerializer
+from .models import Donation, DonationReceipt, DonorStats, RecurringPledge
+from .serializers import (
+    DonationSerializer, DonationCreateSerializer, DonationExportSerializer, DonationReceiptSerializer,
+    LedgerCorrectionSerializer, LedgerEntrySerializer, RecurringPledgeSerializer
+)
+from .gateways import GATEWAYS, get_gateway
+from .idempotency import idempotent
+from .pagination import DonationCursorPagination
+from .payments import record_events
+from .receipts import queue_receipt
+from . import archive, leaderboards, ledger, pledges
+from .tasks import create_gateway_order
+from .imports import FORMATS, import_donations
 from campaigns.models import Campaign
+from users.models import User
+from analytics.exports import astream_csv, stream_csv
+from analytics.renderers import TABULAR_RENDERER_CLASSES
+from analytics.params import MAX_MONTHS, int_param
+from analytics.rollups import rollup_series
 
 
 class DonationListView(generics.ListAPIView):
@@ -18,16 +44,37 @@ class DonationListView(generics.ListAPIView):
     
     serializer_class = DonationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = DonationCursorPagination
     
     def get_queryset(self):
         user = self.request.user
+        # The serializer nests the donor and campaign
+        donations = Donation.objects.select_related('donor', 'campaign')
         
         # Admins can see all donations
         if user.role == 'admin':
-            return Donation.objects.all()
+            return donations
         
         # Alumni can only see their own donations
-        return Donation.objects.filter(donor=user)
+        return donations.filter(donor=user)
+    
+    def list(self, request, *args, **kwargs):
+        user = request.user
+        if user.role == 'admin' or not archive.has_donations(user.pk):
+            return super().list(request, *args, **kwargs)
+        
+        # A donor's history includes their archived donations, read one page at a time
+        page = self.paginator.paginate_queryset(
+            self.get_queryset(), request, view=self, archive_filters={'donor_id': user.pk}
+        )
+        archived = [donation for donation in page if getattr(donation, 'archived', False)]
+        campaigns = Campaign.objects.in_bulk({donation.campaign_id for donation in archived})
+        for donation in archived:
+            donation.donor = user
+            donation.campaign = campaigns[donation.campaign_id]
+        
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class DonationCreateView(generics.CreateAPIView):
@@ -39,16 +86,11 @@ class DonationCreateView(generics.CreateAPIView):
     def perform_create(self, serializer):
         donation = serializer.save(donor=self.request.user)
         
-        # TODO: Integrate with payment gateway (Razorpay/Stripe)
-        # For now, mark as completed
-        donation.status = 'completed'
-        donation.completed_at = timezone.now()
-        donation.save()
-        
-        # Update campaign raised amount
-        donation.campaign.raised += donation.amount
-        donation.campaign.save(update_fields=['raised'])
+        # The donation stays pending until the gateway reports the payment;
+        # creating the order is a gateway round-trip, so it runs in the background
+        transaction.on_commit(lambda: create_gateway_order.delay(donation.pk))
     
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -65,13 +107,237 @@ class DonationDetailView(generics.RetrieveAPIView):
     serializer_class = DonationSerializer
     permission_classes = [permissions.IsAuthenticated]
     
+    def get_queryset(self):
+        user = self.request.user
+        donations = Donation.objects.select_related('donor', 'campaign')
+        
+        if user.role == 'admin':
+            return donations
+        
+        return donations.filter(donor=user)
+    
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Fall back to the archive for donations moved out of the table
+            user = self.request.user
+            filters = {} if user.role == 'admin' else {'donor_id': user.pk}
+            archived = archive.donations(pk=self.kwargs['pk'], **filters)
+            if not archived:
+                raise
+            return archived[0]
+
+
+class PledgeListCreateView(generics.ListCreateAPIView):
+    """API endpoint for listing and creating recurring pledges."""
+    
+    serializer_class = RecurringPledgeSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
     def get_queryset(self):
         user = self.request.user
         
         if user.role == 'admin':
-            return Donation.objects.all()
+            return RecurringPledge.objects.all()
+        
+        return RecurringPledge.objects.filter(donor=user)
+    
+    def perform_create(self, serializer):
+        # The first instalment is charged by the next scheduler run, or paid
+        # at checkout when the gateway needs the donor to authorise a mandate
+        with transaction.atomic():
+            pledge = serializer.save(donor=self.request.user, next_charge_at=timezone.now())
+            pledges.start(pledge)
+
+
+class PledgeDetailView(generics.RetrieveUpdateAPIView):
+    """API endpoint for viewing, changing, pausing and cancelling a recurring pledge."""
+    
+    serializer_class = RecurringPledgeSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        user = self.request.user
+        
+        if user.role == 'admin':
+            return RecurringPledge.objects.all()
+        
+        return RecurringPledge.objects.filter(donor=user)
+    
+    def perform_update(self, serializer):
+        resumed = serializer.instance.status == 'paused' and serializer.validated_data.get('status') == 'active'
+        if not resumed:
+            serializer.save()
+            return
+        
+        # A resumed pledge starts over: charge it on the next run if it fell behind
+        serializer.save(
+            failure_count=0,
+            next_charge_at=max(serializer.instance.next_charge_at, timezone.now())
+        )
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([permissions.AllowAny])
+def payment_webhook(request, gateway):
+    """Verify and record a payment gateway webhook; settlement happens on the webhooks queue."""
+    
+    if gateway not in GATEWAYS or gateway != settings.PAYMENT_GATEWAY:
+        return Response({
+            'error': 'Unknown payment gateway'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    gateway = get_gateway(gateway)
+    body = request.body
+    if not gateway.verify_webhook(body, request.headers.get(gateway.signature_header)):
+        return Response({
+            'error': 'Invalid webhook signature'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        events = gateway.parse_webhook(json.loads(body))
+    except (ValueError, AttributeError, KeyError):
+        return Response({
+            'error': 'Malformed webhook payload'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    record_events(gateway, events)
+    return Response({'received': len(events)})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_donations(request):
+    """
+    Stream donations as CSV, filtered by start_date/end_date (creation
+    date), campaign, status and payment_method.
+    """
+    
+    if request.user.role != 'admin':
+        return Response({
+            'error': 'Admin access required'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = DonationExportSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    filters = {key: str(value) for key, value in serializer.validated_data.items()}
+    
+    # Under ASGI a sync iterator would be read completely before the first byte is sent
+    if isinstance(request._request, ASGIRequest):
+        rows = astream_csv('donations', filters)
+    else:
+        rows = stream_csv('donations', filters)
+    response = StreamingHttpResponse(rows, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="donations-{timezone.localdate():%Y%m%d}.csv"'
+    # Ask reverse proxies to pass rows through as they are produced
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@parser_classes([MultiPartParser])
+def bulk_import_donations(request):
+    """Import offline donations from an uploaded CSV or NDJSON file."""
+    
+    if request.user.role != 'admin':
+        return Response({
+            'error': 'Admin access required'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({
+            'error': 'A CSV or NDJSON file is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    file_format = request.data.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+    if file_format not in FORMATS:
+        return Response({
+            'error': f'format must be one of: {", ".join(FORMATS)}'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    dry_run = request.data.get('dry_run') in ('1', 'true')
+    report = import_donations(upload.file, file_format, dry_run=dry_run)
+    
+    return Response({
+        **report.to_dict(max_errors=1000),
+        'dry_run': dry_run
+    }, status=status.HTTP_201_CREATED if report.imported and not dry_run else status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def refund_donation(request, donation_id):
+    """Mark a completed donation refunded; the ledger and aggregates follow via donation_refunded."""
+    
+    if request.user.role != 'admin':
+        return Response({
+            'error': 'Admin access required'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    with transaction.atomic():
+        donation = Donation.objects.select_for_update().filter(pk=donation_id).first()
+        if donation is None:
+            return Response({
+                'error': 'Donation not found'
+            }, status=status.HTTP_404_NOT_FOUND)
         
-        return Donation.objects.filter(donor=user)
+        if donation.status != 'completed':
+            return Response({
+                'error': 'Only completed donations can be refunded'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        donation.status = 'refunded'
+        donation.save(update_fields=['status'])
+    
+    return Response(DonationSerializer(donation).data)
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def ledger_correction(request):
+    """Record a manual ledger correction against a campaign."""
+    
+    if request.user.role != 'admin':
+        return Response({
+            'error': 'Admin access required'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = LedgerCorrectionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    
+    entry = ledger.record_correction(created_by=request.user, **serializer.validated_data)
+    return Response(LedgerEntrySerializer(entry).data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def ledger_balance(request, scope, object_id):
+    """Ledger balance of a campaign or donor, optionally as of a point in time (``as_of``)."""
+    
+    if request.user.role != 'admin' and not (scope == 'donor' and object_id == request.user.id):
+        return Response({
+            'error': 'Permission denied'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    as_of = None
+    if request.GET.get('as_of'):
+        as_of = parse_datetime(request.GET['as_of'])
+        if as_of is None:
+            return Response({
+                'error': 'as_of must be an ISO 8601 datetime'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+    
+    return Response({
+        scope: object_id,
+        'as_of': as_of or timezone.now(),
+        **ledger.balance(scope, object_id, as_of=as_of)
+    })
 
 
 @api_view(['GET'])
@@ -84,13 +350,17 @@ def donation_statistics(request):
     if user.role == 'admin':
         # Admin sees overall stats
         donations = Donation.objects.filter(status='completed')
+        totals = DonorStats.objects.aggregate(total=Sum('total_amount'), count=Sum('donation_count'))
+        total_donated = totals['total'] or 0
+        donation_count = totals['count'] or 0
+        campaigns_supported = Campaign.objects.filter(donation_count__gt=0).count()
     else:
-        # Alumni sees their own stats
+        # Alumni sees their own stats, maintained in their DonorStats row
         donations = Donation.objects.filter(donor=user, status='completed')
-    
-    total_donated = donations.aggregate(total=Sum('amount'))['total'] or 0
-    donation_count = donations.count()
-    campaigns_supported = donations.values('campaign').distinct().count()
+        stats = DonorStats.objects.filter(donor=user).first() or DonorStats(donor=user)
+        total_donated = stats.total_amount
+        donation_count = stats.donation_count
+        campaigns_supported = stats.campaigns_supported
     
     # Recent donations (last 10)
     recent_donations = donations.order_by('-created_at')[:10]
@@ -106,37 +376,47 @@ def donation_statistics(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@renderer_classes(TABULAR_RENDERER_CLASSES)
 def donation_history_chart(request):
     """Get donation history data for charts."""
     
     user = request.user
-    months = int(request.GET.get('months', 12))
+    try:
+        months = int_param(request, 'months', 12, minimum=1, maximum=MAX_MONTHS)
+    except ValueError as e:
+        return Response({
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     
     # Calculate date range
     end_date = timezone.now()
     start_date = end_date - timedelta(days=30 * months)
     
     if user.role == 'admin':
-        donations = Donation.objects.filter(
-            status='completed',
-            completed_at__gte=start_date,
-            completed_at__lte=end_date
+        # Admins read the daily rollups instead of scanning donations
+        series = rollup_series(
+            timezone.localdate(start_date),
+            timezone.localdate(end_date),
+            'month'
         )
+        monthly_data = {
+            item['period'].strftime('%Y-%m'): float(item['total_amount'])
+            for item in series
+        }
     else:
-        donations = Donation.objects.filter(
+        monthly_data = {}
+        donations = Donation.objects.completed_between(start_date, end_date).filter(
             donor=user,
-            status='completed',
-            completed_at__gte=start_date,
-            completed_at__lte=end_date
+            status='completed'
+        ).annotate(
+            month=TruncMonth('completed_at')
+        ).values('month').annotate(
+            total=Sum('amount')
         )
-    
-    # Group by month
-    monthly_data = {}
-    for donation in donations:
-        month_key = donation.completed_at.strftime('%Y-%m')
-        if month_key not in monthly_data:
-            monthly_data[month_key] = 0
-        monthly_data[month_key] += float(donation.amount)
+        
+        # Group by month
+        for item in donations:
+            monthly_data[item['month'].strftime('%Y-%m')] = float(item['total'])
     
     # Format response
     chart_data = [
@@ -147,29 +427,76 @@ def donation_history_chart(request):
     return Response(chart_data)
 
 
+def _leaderboard_limit(request):
+    try:
+        return max(1, min(int(request.GET.get('limit', 10)), leaderboards.MAX_LIMIT))
+    except ValueError:
+        return None
+
+
+def _donor_rows(rows):
+    """Attach donor names to (donor id, amount, count) leaderboard rows."""
+    
+    names = dict(User.objects.filter(pk__in=[member for member, _, _ in rows]).values_list('id', 'name'))
+    return [
+        {
+            'donor__id': int(member),
+            'donor__name': names.get(int(member), ''),
+            'total_amount': amount,
+            'donation_count': count,
+        }
+        for member, amount, count in rows
+    ]
+
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def campaign_leaderboard(request, campaign_id):
     """Get top donors for a specific campaign."""
     
-    limit = int(request.GET.get('limit', 10))
+    limit = _leaderboard_limit(request)
+    if limit is None:
+        return Response({
+            'error': 'limit must be an integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
     
-    top_donors = Donation.objects.filter(
-        campaign_id=campaign_id,
-        status='completed',
-        is_anonymous=False
-    ).values('donor__id', 'donor__name').annotate(
-        total_amount=Sum('amount'),
-        donation_count=Count('id')
-    ).order_by('-total_amount')[:limit]
+    return Response(_donor_rows(leaderboards.top('campaign', campaign_id, limit)))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def leaderboard(request, scope, key=None):
+    """
+    Top donors overall or within a department or graduation year, or
+    departments and graduation years ranked against each other.
+    """
+    
+    limit = _leaderboard_limit(request)
+    if limit is None:
+        return Response({
+            'error': 'limit must be an integer'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    rows = leaderboards.top(scope, key, limit)
+    if scope not in leaderboards.GROUP_SCOPES:
+        return Response(_donor_rows(rows))
     
-    return Response(list(top_donors))
+    field = leaderboards.GROUP_SCOPES[scope]
+    return Response([
+        {field: member, 'total_amount': amount, 'donation_count': count}
+        for member, amount, count in rows
+    ])
 
 
-@api_view(['POST'])
+@api_view(['GET', 'POST'])
 @permission_classes([permissions.IsAuthenticated])
 def generate_receipt(request, donation_id):
-    """Generate receipt for a donation."""
+    """
+    Queue a donation's PDF receipt, or return it once generated.
+    
+    Until a worker has written the PDF this responds 202 with the receipt
+    status; afterwards GET downloads the PDF and POST returns its details.
+    """
     
     try:
         donation = Donation.objects.get(id=donation_id)
@@ -185,13 +512,21 @@ def generate_receipt(request, donation_id):
                 'error': 'Can only generate receipt for completed donations'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create or get receipt
         receipt, created = DonationReceipt.objects.get_or_create(donation=donation)
         
-        # TODO: Generate PDF receipt
-        # For now, just mark as sent
-        donation.receipt_sent = True
-        donation.save(update_fields=['receipt_sent'])
+        if receipt.status != 'ready':
+            # Rendering happens on the receipts queue, never in the web worker
+            queue_receipt(donation)
+            serializer = DonationReceiptSerializer(receipt)
+            return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        
+        if request.method == 'GET':
+            return FileResponse(
+                receipt.receipt_file.open('rb'),
+                as_attachment=True,
+                filename=f'{donation.receipt_number}.pdf',
+                content_type='application/pdf'
+            )
         
         serializer = DonationReceiptSerializer(receipt)
         return Response(serializer.data)